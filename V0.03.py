@@ -1,15 +1,39 @@
+import html
+import os
 import ee
 import geemap
 import ipywidgets as widgets
 from ipyleaflet import DrawControl
 from IPython.display import display, HTML
 from datetime import datetime
-import ollama
+from batch_regions import (
+    batch_region_records, export_table, features_from_draw_control, load_regions, records_to_table
+)
+from chat_session import ChatSessions
+from chat_stream import StreamingReplyView
+from change_detection import CHANGE_VIS, DELTA_VIS, render_change_html
+from chat_tools import ToolContext, ToolRegistry
+from composite_cache import CompositeCache, composite_key, roi_hash
+from engine import AnalysisEngine, AnalysisState
+from export import load_export_arrays
+from formula import FormulaError
+from image_stats import compute_image_stats
+from jobs import JobStatus, runner
+from llm_backends import LLMClient, backend_from_env
+from local_index import LocalIndexCalculator, render_summary_html
+from map_layers import LayerDescriptor, LayerManager
+from prompt_context import SYSTEM_PROMPT
+from tile_cache import tile_proxy_from_env
+from time_series import render_series_png
+from tracing import TracePanel, trace_ee_calls
 
 # Initialize Earth Engine
 ee.Authenticate()
 ee.Initialize()
 
+# Time every EE request; the Debug panel shows where time goes per stage
+trace_ee_calls()
+
 # Create Map
 Map = geemap.Map()
 Map.add_basemap("SATELLITE")
@@ -23,7 +47,12 @@ satellite = widgets.Dropdown(
 
 start_date = widgets.DatePicker(description='Start Date:', value=datetime(2023, 1, 1))
 end_date = widgets.DatePicker(description='End Date:', value=datetime.today())
-cloud_cover = widgets.IntSlider(min=0, max=100, value=10, description='Cloud Cover %:')
+# Scene-level prefilter only; remaining clouds are masked per pixel
+cloud_cover = widgets.IntSlider(min=0, max=100, value=60, description='Cloud Cover %:')
+composite_method = widgets.Dropdown(
+    options=[('Median', 'median'), ('Greenest pixel', 'greenest'), ('Quality mosaic', 'quality')],
+    value='median', description='Composite:'
+)
 
 draw_control = DrawControl(position='topleft', draw_polygon=True, draw_rectangle=True)
 Map.add_control(draw_control)
@@ -39,36 +68,81 @@ index_formula = widgets.Text(
     placeholder='e.g., (B4 - B3)/(B4 + B3)'
 )
 
-band_config = {
-    'Landsat 8': {
-        'collection': "LANDSAT/LC08/C02/T1",
-        'bands': ['B2', 'B3', 'B4', 'B5', 'B6', 'B7'],
-        'common': {'BLUE': 'B2', 'GREEN': 'B3', 'RED': 'B4', 'NIR': 'B5'}
-    },
-    'Landsat 9': {
-        'collection': 'LANDSAT/LC09/C02/T1',
-        'bands': ['B2', 'B3', 'B4', 'B5', 'B6', 'B7'],
-        'common': {'BLUE': 'B2', 'GREEN': 'B3', 'RED': 'B4', 'NIR': 'B5'}
-    },
-    'Sentinel-2': {
-        'collection': 'COPERNICUS/S2_SR_HARMONIZED',
-        'bands': ['B2', 'B3', 'B4', 'B8', 'B11', 'B12'],
-        'common': {'BLUE': 'B2', 'GREEN': 'B3', 'RED': 'B4', 'NIR': 'B8'}
-    }
-}
+formula_feedback = widgets.HTML()
 
 band_vars = {
     name: widgets.Dropdown(description=f'{name} Band:') 
     for name in ['NIR', 'RED', 'GREEN', 'BLUE']
 }
 
-# Global variable to store the Earth Engine image
-current_image = None
+# Composites, statistics and series come from the headless engine shared with the CLI;
+# set GEEMAPBOT_CACHE_DIR to keep statistics across restarts
+engine = AnalysisEngine(
+    composite_cache=CompositeCache(max_entries=32, ttl=3600, disk_dir=os.environ.get('GEEMAPBOT_CACHE_DIR'))
+)
+composite_cache = engine.composite_cache
+band_config = engine.band_config
+
+# Loaded composite, ROI, batch table and series
+state = AnalysisState()
+
+# Optional local tile proxy; set GEEMAPBOT_TILE_CACHE_DIR to cache map tiles on disk.
+# For remote browsers (Voila) also set GEEMAPBOT_TILE_PROXY_HOST/_PORT and _URL.
+tile_proxy = tile_proxy_from_env()
+
+# Band arrays downloaded for local index calculation, reused across formula edits
+index_calculator = LocalIndexCalculator()
+
+# Batch analysis widgets
+batch_button = widgets.Button(description="Batch Analyze")
+export_button = widgets.Button(description="Export CSV")
+region_upload = widgets.FileUpload(accept='.geojson,.json', multiple=False, description="Upload ROIs")
+batch_output = widgets.Output()
+
+# Time series widgets; cached series are extended incrementally when the date range grows
+series_button = widgets.Button(description="Time Series")
+series_period = widgets.Dropdown(
+    options=[('Per image', 'image'), ('Monthly', 'month'), ('Seasonal', 'season')],
+    value='image', description="Period:"
+)
+series_chart = widgets.Image(format='png')
+
+# Change detection widgets; period A is the main date range, period B is set here
+start_date_b = widgets.DatePicker(description='B Start:', value=datetime(2024, 1, 1))
+end_date_b = widgets.DatePicker(description='B End:', value=datetime.today())
+change_threshold = widgets.FloatSlider(min=0.01, max=0.5, value=0.1, step=0.01, description='Threshold:')
+change_button = widgets.Button(description="Detect Change")
+change_stats = widgets.HTML()
 
 # Chatbot widgets
 chat_input = widgets.Text(description="Ask a question:", placeholder="Type your question here...")
 chat_output = widgets.Output()
 chat_button = widgets.Button(description="Ask")
+stream_reply = widgets.Checkbox(value=True, description="Stream reply")
+new_chat_button = widgets.Button(description="New Chat")
+use_tools = widgets.Checkbox(value=False, description="Fetch data with tools")
+
+# Chat backend chosen by GEEMAPBOT_LLM_BACKEND (ollama, openai or fake); requests that
+# time out or fail fall back to a smaller model, and every request's latency is recorded
+CHAT_MODEL = os.environ.get('GEEMAPBOT_CHAT_MODEL', "deepseek-r1:1.5b")
+llm = LLMClient(backend_from_env(), fallback_model=os.environ.get('GEEMAPBOT_FALLBACK_MODEL', "qwen2.5:0.5b"))
+
+# Conversation history per composite/ROI; keep_alive keeps the model loaded between questions
+chat_sessions = ChatSessions(model=CHAT_MODEL, client=llm, keep_alive='30m')
+
+# Load the chat model and prefill the system prompt while the map is being set up
+runner.submit('llm-warmup', lambda job: llm.warmup(CHAT_MODEL, system=SYSTEM_PROMPT))
+
+# Tool calling needs a model with tool support; deepseek-r1 has none in Ollama
+TOOL_MODEL = os.environ.get('GEEMAPBOT_TOOL_MODEL', "qwen2.5:3b")
+tool_registry = ToolRegistry()
+
+# Background job status
+action_status = JobStatus()
+chat_status = JobStatus()
+
+# Map layers (map IDs are only requested for layers that are switched on)
+layer_manager = LayerManager(Map, runner, status=action_status, tile_proxy=tile_proxy)
 
 def update_bands():
     config = band_config[satellite.value]
@@ -80,90 +154,246 @@ update_bands()
 
 load_button = widgets.Button(description="Load Imagery")
 calc_index_button = widgets.Button(description="Calculate Index")
+local_index_button = widgets.Button(description="Local Index Stats")
+local_stats = widgets.HTML()
+geotiff_button = widgets.Button(description="Export GeoTIFF")
 
 def get_image():
     if not draw_control.data:
         print("Error: Please draw a region of interest (ROI) on the map.")
         return None
     
-    geometry = ee.Geometry(draw_control.data[-1]['geometry'])
+    # Reuse the composite when the parameters and the drawn ROI are unchanged
+    roi = draw_control.data[-1]['geometry']
+    state.key, image = engine.composite(satellite.value, start_date.value, end_date.value, cloud_cover.value,
+                                        roi, composite_method.value)
+    state.roi = roi
+    return image
+
+def on_load_button_clicked(b):
+    image = get_image()
+    if image is None:
+        return
     
-    # Determine the cloud cover property based on the satellite
-    cloud_property = 'CLOUDY_PIXEL_PERCENTAGE' if satellite.value == 'Sentinel-2' else 'CLOUD_COVER'
+    # Main image with all bands, the RGB composite and individual band layers.
+    # They are only registered here; map IDs are requested when a layer is switched on.
+    vis_params = {'opacity': opacity.value, 'gamma': gamma.value}
+    rgb_bands = ['B4', 'B3', 'B2']  # Same for Landsat and Sentinel-2 (surface reflectance)
+    layers = [LayerDescriptor('Main Image', image, vis_params, state.key),
+              LayerDescriptor('RGB Composite', image, {'bands': rgb_bands, 'min': 0, 'max': 0.3, **vis_params}, state.key)]
+    layers += [LayerDescriptor(f'Band {band}', image, {'bands': [band], **vis_params}, state.key)
+               for band in band_config[satellite.value]['bands']]
     
-    collection = ee.ImageCollection(band_config[satellite.value]['collection']) \
-        .filterDate(start_date.value.strftime('%Y-%m-%d'), end_date.value.strftime('%Y-%m-%d')) \
-        .filter(ee.Filter.lt(cloud_property, cloud_cover.value))
+    def loaded():
+        state.image = image
     
-    image = collection.median()
+    layer_manager.load(layers, visible=['RGB Composite'], on_loaded=loaded)
+
+def validate_formula(_=None):
+    """Check the index formula locally as it is typed"""
+    aliases = {var: band_vars[var].value for var in band_vars}
+    try:
+        engine.compile_index(satellite.value, index_formula.value, aliases)
+        formula_feedback.value = ''
+    except FormulaError as e:
+        formula_feedback.value = f"<span style='color:#721C24;'>{html.escape(str(e))}</span>"
+
+def on_calc_index_clicked(b):
+    if state.image is None:
+        print("Error: No image loaded. Please load imagery first.")
+        return
     
-    # Clip the image if geometry is provided
-    if geometry:
-        image = image.clip(geometry)
+    # Compiled locally first: typos are reported before any server round-trip
+    aliases = {var: band_vars[var].value for var in band_vars}
+    try:
+        compiled = engine.compile_index(satellite.value, index_formula.value, aliases)
+    except FormulaError as e:
+        action_status.fail(e)
+        return
     
-    return image
+    layer_manager.add(LayerDescriptor(
+        'Custom Index', compiled.to_ee(state.image), {'min': -1, 'max': 1, 'palette': ['blue', 'white', 'green']},
+        (state.key, compiled.ir)
+    ), message='Calculating index…')
 
-def on_load_button_clicked(b):
-    global current_image
-    Map.layers = Map.layers[:2]  # Clear existing layers except the basemap
+def on_local_index_clicked(b):
+    if state.image is None:
+        print("Error: No image loaded. Please load imagery first.")
+        return
     
-    current_image = get_image()
-    if current_image is None:
+    image, key, roi = state.image, state.key, state.roi
+    bands = band_config[satellite.value]['bands']
+    scale = band_config[satellite.value]['scale']
+    formula = index_formula.value
+    aliases = {var: band_vars[var].value for var in band_vars}
+    try:
+        compiled = engine.compile_index(satellite.value, formula, aliases)
+    except FormulaError as e:
+        action_status.fail(e)
         return
     
-    # Add main image with all bands
-    vis_params = {'opacity': opacity.value, 'gamma': gamma.value}
-    Map.addLayer(current_image, vis_params, 'Main Image')
+    # Band arrays are downloaded once per composite; formula edits are evaluated locally
+    def work(job):
+        index_calculator.load(key, image, roi, bands, scale)
+        return index_calculator.compute(key, compiled)
     
-    # Add RGB composite
-    rgb_bands = ['B4', 'B3', 'B2']  # Same for Landsat and Sentinel-2
-    Map.addLayer(current_image, {'bands': rgb_bands, **vis_params}, 'RGB Composite')
+    def show(summary):
+        local_stats.value = render_summary_html(formula, summary)
     
-    # Add individual band layers
-    for band in band_config[satellite.value]['bands']:
-        Map.addLayer(current_image, {'bands': [band], **vis_params}, f'Band {band}')
+    runner.submit(local_index_button, work, on_result=show, status=action_status,
+                  message='Computing index locally…')
 
-def on_calc_index_clicked(b):
-    global current_image
-    if current_image is None:
+def on_geotiff_button_clicked(b):
+    if state.image is None:
         print("Error: No image loaded. Please load imagery first.")
         return
     
+    args = (satellite.value, start_date.value, end_date.value, cloud_cover.value, state.roi,
+            os.environ.get('GEEMAPBOT_EXPORT_DIR', 'exports'))
+    bands = band_config[satellite.value]['bands']
+    
+    # Full-resolution tiles in parallel; an interrupted export resumes where it stopped
+    def work(job):
+        return engine.export(*args, indices=['NDVI', 'NDWI'], method=composite_method.value,
+                             progress=lambda done, total: action_status.start(f'Downloading tiles: {done}/{total}…'))
+    
+    def show(result):
+        # Local index statistics now run on the exported pixels instead of a coarser sample
+        arrays = load_export_arrays(result['array'], result['bands'])
+        index_calculator.register(result['key'], {band: arrays[band] for band in bands})
+        action_status.done(f"Exported {result['path']} ({result['width']}×{result['height']} px)")
+    
+    runner.submit(geotiff_button, work, on_result=show, status=action_status,
+                  message='Exporting GeoTIFF…')
+
+def on_batch_button_clicked(b):
+    # Uploaded GeoJSON takes precedence over the features drawn on the map
+    if region_upload.value:
+        regions = load_regions(region_upload.value[0]['content'])
+    elif draw_control.data:
+        regions = features_from_draw_control(draw_control.data)
+    else:
+        print("Error: Please draw or upload at least one region of interest (ROI).")
+        return
+    
+    config = band_config[satellite.value]
+    start = start_date.value.strftime('%Y-%m-%d')
+    end = end_date.value.strftime('%Y-%m-%d')
+    method = composite_method.value
+    key = composite_key(satellite.value, start, end, cloud_cover.value, regions, mode='batch', method=method)
+    
+    # All regions are reduced in one reduceRegions request
+    def work(job):
+        return composite_cache.get_stats(
+            key,
+            lambda: batch_region_records(config, start, end, cloud_cover.value, regions, method=method)
+        )
+    
+    def show(records):
+        state.batch_table = records_to_table(records)
+        batch_output.clear_output()
+        batch_output.append_display_data(HTML(state.batch_table.round(4).to_html()))
+    
+    runner.submit(batch_button, work, on_result=show, status=action_status,
+                  message=f"Analyzing {len(regions['features'])} regions…")
+
+def on_series_button_clicked(b):
+    if not draw_control.data:
+        print("Error: Please draw a region of interest (ROI) on the map.")
+        return
+    
+    roi = draw_control.data[-1]['geometry']
     formula = index_formula.value
-    bands = {var: band_vars[var].value for var in band_vars}
+    aliases = {var: band_vars[var].value for var in band_vars}
+    args = (satellite.value, start_date.value, end_date.value, cloud_cover.value, roi, formula, aliases)
+    period = series_period.value
+    try:
+        engine.compile_index(satellite.value, formula, aliases)
+    except FormulaError as e:
+        action_status.fail(e)
+        return
+    
+    # Every image (or bucket) is reduced server-side and fetched in one request
+    def work(job):
+        series = engine.time_series(*args, period=period)
+        job.check()
+        return series, render_series_png(series, f"{satellite.value}: {formula} ({len(series)} points)")
+    
+    def show(result):
+        state.series, series_chart.value = result
+        state.series_label = formula
+    
+    runner.submit(series_button, work, on_result=show, status=action_status,
+                  message='Computing time series…')
+
+def on_change_button_clicked(b):
+    if not draw_control.data:
+        print("Error: Please draw a region of interest (ROI) on the map.")
+        return
     
+    roi = draw_control.data[-1]['geometry']
+    formula = index_formula.value
+    aliases = {var: band_vars[var].value for var in band_vars}
+    period_a = (start_date.value, end_date.value)
+    period_b = (start_date_b.value, end_date_b.value)
+    threshold = change_threshold.value
     try:
-        index = current_image.expression(formula, bands).rename('index')
-        Map.addLayer(index, {'min': -1, 'max': 1, 'palette': ['blue', 'white', 'green']}, 'Custom Index')
-    except ee.EEException as e:
-        print(f"Earth Engine Error: {str(e)}")
-    except Exception as e:
-        print(f"Unexpected Error: {str(e)}")
-
-def extract_image_info(image, geometry):
+        key, delta, classes = engine.change(satellite.value, period_a, period_b, cloud_cover.value, roi,
+                                            formula, threshold, aliases, composite_method.value)
+    except FormulaError as e:
+        action_status.fail(e)
+        return
+    
+    # Both composites come from the cache; the server evaluates both sides in one reduction
+    layer_manager.add(LayerDescriptor(f'Change {formula}', delta, DELTA_VIS, (key, 'delta')),
+                      message='Computing difference…')
+    layer_manager.add(LayerDescriptor('Change classes', classes.updateMask(classes.neq(0)),
+                                      CHANGE_VIS, (key, 'classes')), message='Classifying change…')
+    
+    def work(job):
+        return engine.change_stats(key, delta, classes, roi, satellite.value)
+    
+    def show(result):
+        state.change = {'index': formula, 'threshold': threshold, 'stats': result,
+                        'period_a': '..'.join(str(d)[:10] for d in period_a),
+                        'period_b': '..'.join(str(d)[:10] for d in period_b)}
+        change_stats.value = render_change_html(state.change)
+    
+    runner.submit(change_button, work, on_result=show, status=action_status,
+                  message='Measuring area of change…')
+
+def on_export_button_clicked(b):
+    if state.batch_table is None:
+        print("Error: No batch results. Please run Batch Analyze first.")
+        return
+    path = export_table(state.batch_table, f"geemapbot_batch_{datetime.now():%Y%m%d_%H%M%S}.csv")
+    action_status.done(f"Exported {path}")
+
+def extract_image_info(image, geometry, roi=None, progress=None):
     """Extract detailed information about the image."""
     if image is None:
         return "No image loaded."
     
-    # Get image properties
+    # Statistics at the satellite's native scale. Bands, statistics, NDVI and bounds
+    # come back from one getInfo() call; ROIs too large for that are reduced in tiles.
+    if roi is not None:
+        result = engine.region_stats(state.key, image, roi, satellite.value, progress=progress)
+    else:
+        config = band_config[satellite.value]
+        region = geometry if geometry else image.geometry()
+        result = composite_cache.get_stats(
+            roi_hash({'composite': state.key, 'region': region.serialize()}),
+            lambda: compute_image_stats(image, region, config['common'], scale=config['scale'])
+        )
+    
     info = {
-        'Bands': image.bandNames().getInfo(),
-        'Pixel Count': image.reduceRegion(
-            reducer=ee.Reducer.count(),
-            geometry=geometry,
-            scale=30  # Adjust scale based on satellite
-        ).getInfo(),
-        'Mean Pixel Values': image.reduceRegion(
-            reducer=ee.Reducer.mean(),
-            geometry=geometry,
-            scale=30
-        ).getInfo(),
-        'NDVI': image.normalizedDifference(['B5', 'B4']).reduceRegion(
-            reducer=ee.Reducer.mean(),
-            geometry=geometry,
-            scale=30
-        ).getInfo(),
-        'Boundary Extension': geometry.bounds().getInfo() if geometry else "Not defined",
+        'Bands': result['bands'],
+        'Pixel Count': {band: s.get('count') for band, s in result['stats'].items()},
+        'Mean Pixel Values': {band: s.get('mean') for band, s in result['stats'].items()},
+        'NDVI': result['indices']['NDVI'].get('mean'),
+        'Band Statistics': result['stats'],
+        'Indices': result['indices'],
+        'Boundary Extension': result['bounds'] if geometry else "Not defined",
         'Band Values': {}
     }
     # Extract band values for each pixel
@@ -181,109 +411,163 @@ def extract_image_info(image, geometry):
 from IPython.display import HTML, display
 
 def on_chat_button_clicked(b):
-    global current_image
     question = chat_input.value
     if not question:
         return
 
-    # Extract detailed image information
-    geometry = ee.Geometry(draw_control.data[-1]['geometry']) if draw_control.data else None
-    image_info = extract_image_info(current_image, geometry)
-    
-    # Construct the context for DeepSeek
-    context = f"""
-        You are a helpful assistant for Earth Engine data analysis. Your task is to analyze satellite imagery data and provide insights based on the following information:
-
-        ### Satellite and Data Details:
-        - **Satellite Name**: {satellite.value}
-        - **Date Range**: {start_date.value.strftime('%Y-%m-%d')} to {end_date.value.strftime('%Y-%m-%d')}
-        - **Cloud Cover**: {cloud_cover.value}%
-        - **Region of Interest (ROI)**: {"Defined" if draw_control.data else "Not defined"}
-        - **Current Image Status**: {"Loaded" if current_image else "Not loaded"}
-
-        ### Image Information:
-        - **Bands Available**: {image_info.get('Bands', 'N/A')}
-        - **Pixel Count**: {image_info.get('Pixel Count', 'N/A')}
-        - **Mean Pixel Values**: {image_info.get('Mean Pixel Values', 'N/A')}
-        - **NDVI**: {image_info.get('NDVI', 'N/A')}
-        - **Boundary Extension**: {image_info.get('Boundary Extension', 'N/A')}
-        - **Band Values**: {image_info.get('Band Values', 'N/A')}
-
-        ### Additional Context:
-        - The data is sourced from Google Earth Engine (GEE) using the GEE Python API.
-        - The user has drawn a region of interest (ROI) on the map and loaded the satellite imagery.
-        - The user is interested in analyzing the data and answering questions related to the imagery, such as vegetation health, water bodies, urban development, or custom indices.
-
-        ### User's Question:
-        The user has asked the following question: "{question}"
-
-        ### Instructions for DeepSeek:
-        1. Analyze the provided data and answer the user's question in detail.
-        2. If the question involves calculating indices (e.g., NDVI, NDWI, EVI), use the formula provided by the user or suggest an appropriate formula.
-        3. Provide recommendations or insights based on the analysis (e.g., vegetation health, water body detection, urban development).
-        4. If additional information or clarification is needed, ask the user for further details.
-    """
-
-    # Combine the context and the user's question
-    full_message = f"{context}\n\nPlease analyze the data and provide a detailed response to the user's question."
-
-    # Send the combined message to the chatbot model
-    response = ollama.chat(
-        model="deepseek-r1:1.5b",
-        messages=[
-            {"role": "system", "content": context},
-            {"role": "user", "content": full_message}
-        ]
-    )
-    
-    # Extract the reply from the response
-    reply = response["message"]["content"]
-
-    # Format the reply with HTML for better readability
-    formatted_reply = f"""
-    <div style="font-family: Arial, sans-serif; padding: 10px; border: 1px solid #ddd; border-radius: 5px; background-color: #f9f9f9;">
-        <b>GeeMapBot:</b>
-        <p style="white-space: pre-wrap;">{reply}</p>
-    </div>
-    """
-
-    # Display the formatted reply in the chat output
-    with chat_output:
+    # Show the streaming view right away; everything else runs in the background
+    view = StreamingReplyView(title="GeeMapBot") if stream_reply.value else None
+    if view is not None:
+        with chat_output:
+            chat_output.clear_output()
+            display(view.widget)
+
+    def work(job):
+        roi = draw_control.data[-1]['geometry'] if draw_control.data else None
+        tools = None
+        if use_tools.value:
+            # The model fetches only the statistics the question needs
+            stats = None
+            tools = tool_registry.bind(ToolContext(
+                engine, satellite.value, start_date.value, end_date.value, cloud_cover.value, roi,
+                composite_method.value
+            ))
+        else:
+            # Extract detailed image information
+            geometry = ee.Geometry(roi) if roi else None
+            image_info = extract_image_info(
+                state.image, geometry, roi,
+                progress=lambda done, total: chat_status.start(f'Reducing statistics: {done}/{total} tiles…')
+            )
+            stats = None
+            if isinstance(image_info, dict):
+                stats = {'indices': image_info['Indices'], 'stats': image_info['Band Statistics']}
+    
+        # Compact context under a token budget; the system prefix never changes, so
+        # Ollama can reuse its KV cache across questions
+        context = engine.chat_context(satellite.value, start_date.value, end_date.value, cloud_cover.value,
+                                      composite_method.value, roi, stats=stats, state=state)
+
+        # One conversation per composite/ROI; follow-ups only send the new question
+        session_key = state.key or roi_hash(roi or {})
+        if tools is not None:
+            session = chat_sessions.get((session_key, 'tools'), model=TOOL_MODEL)
+        else:
+            session = chat_sessions.get(session_key)
+
+        job.check()
+
+        # Stream tokens into the chat output as they are generated
+        if view is not None:
+            def on_update(splitter, stats):
+                job.check()  # Stop streaming once a newer question was asked
+                view.update(splitter, stats)
+            session.ask(question, context, on_update=on_update, tools=tools)
+            return None
+
+        # Send the question with the conversation so far to the chatbot model
+        return session.ask(question, context, tools=tools).answer.strip()
+
+    def show(reply):
+        if reply is None:
+            return
+
+        # Format the reply with HTML for better readability
+        formatted_reply = f"""
+        <div style="font-family: Arial, sans-serif; padding: 10px; border: 1px solid #ddd; border-radius: 5px; background-color: #f9f9f9;">
+            <b>GeeMapBot:</b>
+            <p style="white-space: pre-wrap;">{reply}</p>
+        </div>
+        """
+
+        # Display the formatted reply in the chat output
         chat_output.clear_output()
-        display(HTML(formatted_reply))
+        chat_output.append_display_data(HTML(formatted_reply))
+
+    runner.submit(chat_button, work, on_result=show, status=chat_status, message='Thinking…')
+
+def on_new_chat_clicked(b):
+    roi = draw_control.data[-1]['geometry'] if draw_control.data else None
+    session_key = state.key or roi_hash(roi or {})
+    chat_sessions.reset(session_key)
+    chat_sessions.reset((session_key, 'tools'))
+    chat_output.clear_output()
+    chat_status.done('Started a new conversation')
 
 # Attach event handlers
 load_button.on_click(on_load_button_clicked)
 calc_index_button.on_click(on_calc_index_clicked)
+local_index_button.on_click(on_local_index_clicked)
+geotiff_button.on_click(on_geotiff_button_clicked)
+batch_button.on_click(on_batch_button_clicked)
+series_button.on_click(on_series_button_clicked)
+change_button.on_click(on_change_button_clicked)
+export_button.on_click(on_export_button_clicked)
 chat_button.on_click(on_chat_button_clicked)
+new_chat_button.on_click(on_new_chat_clicked)
 satellite.observe(lambda _: update_bands(), 'value')
+index_formula.observe(validate_formula, 'value')
+for var in band_vars:
+    band_vars[var].observe(validate_formula, 'value')
 
 # Layout
 satellite_group = widgets.VBox([
     satellite,
     widgets.HBox([start_date, end_date]),
-    cloud_cover
+    cloud_cover,
+    composite_method
 ], layout=widgets.Layout(border='1px solid gray', padding='10px'))
 
 visualization_group = widgets.VBox([
     widgets.HBox([opacity, gamma]),
     index_formula,
+    formula_feedback,
     widgets.VBox(list(band_vars.values()))
 ], layout=widgets.Layout(border='1px solid gray', padding='10px'))
 
-buttons_group = widgets.HBox([load_button, calc_index_button])
+buttons_group = widgets.VBox([
+    widgets.HBox([load_button, calc_index_button, local_index_button, geotiff_button]),
+    action_status.widget,
+    layer_manager.widget,
+    local_stats
+])
+
+batch_group = widgets.VBox([
+    widgets.HBox([region_upload, batch_button, export_button]),
+    batch_output
+], layout=widgets.Layout(border='1px solid gray', padding='10px'))
+
+series_group = widgets.VBox([
+    widgets.HBox([series_period, series_button]),
+    series_chart
+], layout=widgets.Layout(border='1px solid gray', padding='10px'))
+
+change_group = widgets.VBox([
+    widgets.HBox([start_date_b, end_date_b]),
+    widgets.HBox([change_threshold, change_button]),
+    change_stats
+], layout=widgets.Layout(border='1px solid gray', padding='10px'))
 
 chat_group = widgets.VBox([
     chat_input,
-    chat_button,
+    widgets.HBox([chat_button, new_chat_button, stream_reply, use_tools]),
+    chat_status.widget,
     chat_output
 ], layout=widgets.Layout(border='1px solid gray', padding='10px'))
 
+# Timings of EE requests, cache lookups, tiles and LLM calls
+debug_panel = TracePanel()
+debug_group = widgets.Accordion(children=[debug_panel.widget], titles=('Debug: timings',))
+
 controls = widgets.VBox([
     satellite_group,
     visualization_group,
     buttons_group,
-    chat_group
+    batch_group,
+    series_group,
+    change_group,
+    chat_group,
+    debug_group
 ])
 
 display(controls)
@@ -1,10 +1,29 @@
-import ee
+import html
+import os
 import geemap
 import ipywidgets as widgets
 from ipyleaflet import DrawControl
 from IPython.display import display, HTML, clear_output
 from datetime import datetime
-import ollama
+from batch_regions import (
+    batch_region_records, export_table, features_from_draw_control, load_regions, records_to_table
+)
+from chat_session import ChatSessions
+from chat_stream import StreamingReplyView
+from change_detection import CHANGE_VIS, DELTA_VIS, render_change_html
+from chat_tools import ToolContext, ToolRegistry
+from composite_cache import CompositeCache, composite_key
+from engine import AnalysisEngine, AnalysisState, initialize_earth_engine
+from export import load_export_arrays
+from formula import FormulaError
+from jobs import JobStatus, runner
+from llm_backends import LLMClient, backend_from_env
+from local_index import LocalIndexCalculator, render_summary_html
+from map_layers import LayerDescriptor, LayerManager
+from prompt_context import SYSTEM_PROMPT
+from tile_cache import tile_proxy_from_env
+from time_series import render_series_png
+from tracing import TracePanel, trace_ee_calls
 
 # =============================================
 # Earth Engine Authentication Setup
@@ -12,6 +31,35 @@ import ollama
 service_account = 'jintumonibhuyan@ee-jintumb6.iam.gserviceaccount.com'
 json_key_path = "C:/Users/Admin/Downloads/ee-jintumb6-2b68bd3dbc74.json"
 
+# Headless engine (composites, statistics, series) shared by every app instance in this
+# kernel and by the CLI; set GEEMAPBOT_CACHE_DIR to keep statistics across kernel restarts
+engine = AnalysisEngine(
+    composite_cache=CompositeCache(max_entries=32, ttl=3600, disk_dir=os.environ.get('GEEMAPBOT_CACHE_DIR'))
+)
+composite_cache = engine.composite_cache
+
+# Time every EE request; the Debug panel shows where time goes per stage
+trace_ee_calls()
+
+# Optional local tile proxy; set GEEMAPBOT_TILE_CACHE_DIR to cache map tiles on disk.
+# For remote browsers (Voila) also set GEEMAPBOT_TILE_PROXY_HOST/_PORT and _URL.
+tile_proxy = tile_proxy_from_env()
+
+# Band arrays downloaded for local index calculation, reused across formula edits
+index_calculator = LocalIndexCalculator()
+
+# Chat backend chosen by GEEMAPBOT_LLM_BACKEND (ollama, openai or fake); requests that
+# time out or fail fall back to a smaller model, and every request's latency is recorded
+CHAT_MODEL = os.environ.get('GEEMAPBOT_CHAT_MODEL', "deepseek-r1:1.5b")
+llm = LLMClient(backend_from_env(), fallback_model=os.environ.get('GEEMAPBOT_FALLBACK_MODEL', "qwen2.5:0.5b"))
+
+# Conversation history per composite/ROI; keep_alive keeps the model loaded between questions
+chat_sessions = ChatSessions(model=CHAT_MODEL, client=llm, keep_alive='30m')
+
+# Tool calling needs a model with tool support; deepseek-r1 has none in Ollama
+TOOL_MODEL = os.environ.get('GEEMAPBOT_TOOL_MODEL', "qwen2.5:3b")
+tool_registry = ToolRegistry()
+
 # =============================================
 # UI Widgets Configuration
 # =============================================
@@ -36,8 +84,9 @@ clear_login_button.layout.display = 'none'
 def authenticate_earth_engine(b):
     """Handle Earth Engine authentication with service account"""
     try:
-        credentials = ee.ServiceAccountCredentials(service_account, json_key_path)
-        ee.Initialize(credentials)
+        initialize_earth_engine(service_account, json_key_path)
+        # Load the chat model and prefill the system prompt while the app is built
+        runner.submit('llm-warmup', lambda job: llm.warmup(CHAT_MODEL, system=SYSTEM_PROMPT))
         clear_output(wait=True)
         display(auth_button)
         
@@ -98,30 +147,19 @@ def display_main_app():
     # Date Controls
     start_date = widgets.DatePicker(description='Start Date:', value=datetime(2023, 1, 1))
     end_date = widgets.DatePicker(description='End Date:', value=datetime.today())
-    cloud_cover = widgets.IntSlider(min=0, max=100, value=10, description='Cloud Cover %:')
+    # Scene-level prefilter only; remaining clouds are masked per pixel
+    cloud_cover = widgets.IntSlider(min=0, max=100, value=60, description='Cloud Cover %:')
+    composite_method = widgets.Dropdown(
+        options=[('Median', 'median'), ('Greenest pixel', 'greenest'), ('Quality mosaic', 'quality')],
+        value='median', description='Composite:'
+    )
     
     # Visualization Controls
     opacity = widgets.FloatSlider(min=0, max=1, value=1, step=0.1, description='Opacity:')
     gamma = widgets.FloatSlider(min=0.1, max=3, value=1, step=0.1, description='Gamma:')
     
-    # Band Configuration
-    band_config = {
-        'Landsat 8': {
-            'collection': "LANDSAT/LC08/C02/T1",
-            'bands': ['B2', 'B3', 'B4', 'B5', 'B6', 'B7'],
-            'common': {'BLUE': 'B2', 'GREEN': 'B3', 'RED': 'B4', 'NIR': 'B5'}
-        },
-        'Landsat 9': {
-            'collection': 'LANDSAT/LC09/C02/T1',
-            'bands': ['B2', 'B3', 'B4', 'B5', 'B6', 'B7'],
-            'common': {'BLUE': 'B2', 'GREEN': 'B3', 'RED': 'B4', 'NIR': 'B5'}
-        },
-        'Sentinel-2': {
-            'collection': 'COPERNICUS/S2_SR_HARMONIZED',
-            'bands': ['B2', 'B3', 'B4', 'B8', 'B11', 'B12'],
-            'common': {'BLUE': 'B2', 'GREEN': 'B3', 'RED': 'B4', 'NIR': 'B8'}
-        }
-    }
+    # Band Configuration (one source for the UI, the CLI and the chat tools)
+    band_config = engine.band_config
     
     # Band Selection Widgets
     band_vars = {name: widgets.Dropdown(description=f'{name} Band:') 
@@ -133,6 +171,7 @@ def display_main_app():
         description='Index Formula:',
         placeholder='e.g., (B4 - B3)/(B4 + B3)'
     )
+    formula_feedback = widgets.HTML()
     
     # Drawing Control
     draw_control = DrawControl(position='topleft', draw_polygon=True, draw_rectangle=True)
@@ -141,16 +180,50 @@ def display_main_app():
     # Action Buttons
     load_button = widgets.Button(description="Load Imagery")
     calc_index_button = widgets.Button(description="Calculate Index")
+    local_index_button = widgets.Button(description="Local Index Stats")
+    local_stats = widgets.HTML()
+    geotiff_button = widgets.Button(description="Export GeoTIFF")
+    
+    # Batch Analysis
+    batch_button = widgets.Button(description="Batch Analyze")
+    export_button = widgets.Button(description="Export CSV")
+    region_upload = widgets.FileUpload(accept='.geojson,.json', multiple=False, description="Upload ROIs")
+    batch_output = widgets.Output()
+    
+    # Time Series
+    series_button = widgets.Button(description="Time Series")
+    series_period = widgets.Dropdown(
+        options=[('Per image', 'image'), ('Monthly', 'month'), ('Seasonal', 'season')],
+        value='image', description="Period:"
+    )
+    series_chart = widgets.Image(format='png')
+    
+    # Change Detection: period A is the main date range, period B is set here
+    start_date_b = widgets.DatePicker(description='B Start:', value=datetime(2024, 1, 1))
+    end_date_b = widgets.DatePicker(description='B End:', value=datetime.today())
+    change_threshold = widgets.FloatSlider(min=0.01, max=0.5, value=0.1, step=0.01, description='Threshold:')
+    change_button = widgets.Button(description="Detect Change")
+    change_stats = widgets.HTML()
     
     # Chat Interface
     chat_input = widgets.Text(description="Ask a question:", placeholder="Type your question here...")
     chat_output = widgets.Output()
     chat_button = widgets.Button(description="Ask")
+    stream_reply = widgets.Checkbox(value=True, description="Stream reply")
+    new_chat_button = widgets.Button(description="New Chat")
+    use_tools = widgets.Checkbox(value=False, description="Fetch data with tools")
+    
+    # Background Job Status
+    action_status = JobStatus()
+    chat_status = JobStatus()
+    
+    # Map Layers (map IDs are only requested for layers that are switched on)
+    layer_manager = LayerManager(Map, runner, status=action_status, tile_proxy=tile_proxy)
     
     # =========================================
     # Application Logic
     # =========================================
-    current_image = None  # Global variable for image storage
+    state = AnalysisState()  # Composite, ROI, batch table and series of this app instance
     
     def update_bands():
         """Update band options based on satellite selection"""
@@ -165,67 +238,270 @@ def display_main_app():
             print("Error: Please draw a region of interest (ROI) on the map.")
             return None
         
-        geometry = ee.Geometry(draw_control.data[-1]['geometry'])
-        cloud_property = 'CLOUDY_PIXEL_PERCENTAGE' if satellite.value == 'Sentinel-2' else 'CLOUD_COVER'
-        
-        collection = ee.ImageCollection(band_config[satellite.value]['collection']) \
-            .filterDate(start_date.value.strftime('%Y-%m-%d'), end_date.value.strftime('%Y-%m-%d')) \
-            .filter(ee.Filter.lt(cloud_property, cloud_cover.value))
-        
-        return collection.median().clip(geometry)
+        # Reuse the composite when the parameters and the drawn ROI are unchanged
+        roi = draw_control.data[-1]['geometry']
+        state.key, image = engine.composite(satellite.value, start_date.value, end_date.value, cloud_cover.value,
+                                            roi, composite_method.value)
+        state.roi = roi
+        return image
     
     def on_load_button_clicked(b):
         """Handle image loading and display"""
-        global current_image
-        Map.layers = Map.layers[:2]  # Clear existing layers
-        
-        current_image = get_image()
-        if current_image is None:
+        image = get_image()
+        if image is None:
             return
         
+        # Register every layer; only the RGB composite requests a map ID up front
         vis_params = {'opacity': opacity.value, 'gamma': gamma.value}
-        Map.addLayer(current_image, vis_params, 'Main Image')
-        Map.addLayer(current_image, {'bands': ['B4', 'B3', 'B2'], **vis_params}, 'RGB Composite')
+        layers = [LayerDescriptor('Main Image', image, vis_params, state.key),
+                  LayerDescriptor('RGB Composite', image, {'bands': ['B4', 'B3', 'B2'], 'min': 0, 'max': 0.3, **vis_params}, state.key)]
+        layers += [LayerDescriptor(f'Band {band}', image, {'bands': [band], **vis_params}, state.key)
+                   for band in band_config[satellite.value]['bands']]
+        
+        def loaded():
+            state.image = image
         
-        for band in band_config[satellite.value]['bands']:
-            Map.addLayer(current_image, {'bands': [band], **vis_params}, f'Band {band}')
+        layer_manager.load(layers, visible=['RGB Composite'], on_loaded=loaded)
+    
+    def validate_formula(_=None):
+        """Check the index formula locally as it is typed"""
+        aliases = {var: band_vars[var].value for var in band_vars}
+        try:
+            engine.compile_index(satellite.value, index_formula.value, aliases)
+            formula_feedback.value = ''
+        except FormulaError as e:
+            formula_feedback.value = f"<span style='color:#721C24;'>{html.escape(str(e))}</span>"
     
     def on_calc_index_clicked(b):
         """Handle custom index calculation"""
-        global current_image
-        if current_image is None:
+        if state.image is None:
             print("Error: No image loaded. Please load imagery first.")
             return
         
+        # Compiled locally first: typos are reported before any server round-trip
+        aliases = {var: band_vars[var].value for var in band_vars}
         try:
-            formula = index_formula.value
-            bands = {var: band_vars[var].value for var in band_vars}
-            index = current_image.expression(formula, bands).rename('index')
-            Map.addLayer(index, {'min': -1, 'max': 1, 'palette': ['blue', 'white', 'green']}, 'Custom Index')
-        except Exception as e:
-            print(f"Error: {str(e)}")
+            compiled = engine.compile_index(satellite.value, index_formula.value, aliases)
+        except FormulaError as e:
+            action_status.fail(e)
+            return
+        
+        layer_manager.add(LayerDescriptor(
+            'Custom Index', compiled.to_ee(state.image), {'min': -1, 'max': 1, 'palette': ['blue', 'white', 'green']},
+            (state.key, compiled.ir)
+        ), message='Calculating index…')
+    
+    def on_local_index_clicked(b):
+        """Evaluate the index formula locally over downloaded band arrays"""
+        if state.image is None:
+            print("Error: No image loaded. Please load imagery first.")
+            return
+        
+        image, key, roi = state.image, state.key, state.roi
+        bands = band_config[satellite.value]['bands']
+        scale = band_config[satellite.value]['scale']
+        formula = index_formula.value
+        aliases = {var: band_vars[var].value for var in band_vars}
+        try:
+            compiled = engine.compile_index(satellite.value, formula, aliases)
+        except FormulaError as e:
+            action_status.fail(e)
+            return
+        
+        def work(job):
+            index_calculator.load(key, image, roi, bands, scale)  # One download per composite
+            return index_calculator.compute(key, compiled)
+        
+        def show(summary):
+            local_stats.value = render_summary_html(formula, summary)
+        
+        runner.submit(local_index_button, work, on_result=show, status=action_status,
+                      message='Computing index locally…')
+    
+    def on_geotiff_button_clicked(b):
+        """Download the composite and NDVI/NDWI at full resolution as a Cloud-Optimized GeoTIFF"""
+        if state.image is None:
+            print("Error: No image loaded. Please load imagery first.")
+            return
+        
+        args = (satellite.value, start_date.value, end_date.value, cloud_cover.value, state.roi,
+                os.environ.get('GEEMAPBOT_EXPORT_DIR', 'exports'))
+        bands = band_config[satellite.value]['bands']
+        
+        def work(job):
+            # Tiles are fetched in parallel; an interrupted export resumes where it stopped
+            return engine.export(*args, indices=['NDVI', 'NDWI'], method=composite_method.value,
+                                 progress=lambda done, total: action_status.start(f'Downloading tiles: {done}/{total}…'))
+        
+        def show(result):
+            # Local index statistics now run on the exported pixels instead of a coarser sample
+            arrays = load_export_arrays(result['array'], result['bands'])
+            index_calculator.register(result['key'], {band: arrays[band] for band in bands})
+            action_status.done(f"Exported {result['path']} ({result['width']}×{result['height']} px)")
+        
+        runner.submit(geotiff_button, work, on_result=show, status=action_status,
+                      message='Exporting GeoTIFF…')
+    
+    def on_batch_button_clicked(b):
+        """Compute per-region statistics for every drawn or uploaded ROI"""
+        if region_upload.value:
+            regions = load_regions(region_upload.value[0]['content'])
+        elif draw_control.data:
+            regions = features_from_draw_control(draw_control.data)
+        else:
+            print("Error: Please draw or upload at least one region of interest (ROI).")
+            return
+        
+        config = band_config[satellite.value]
+        start = start_date.value.strftime('%Y-%m-%d')
+        end = end_date.value.strftime('%Y-%m-%d')
+        method = composite_method.value
+        key = composite_key(satellite.value, start, end, cloud_cover.value, regions, mode='batch', method=method)
+        
+        def work(job):
+            # All regions are reduced in one reduceRegions request
+            return composite_cache.get_stats(
+                key,
+                lambda: batch_region_records(config, start, end, cloud_cover.value, regions, method=method)
+            )
+        
+        def show(records):
+            state.batch_table = records_to_table(records)
+            batch_output.clear_output()
+            batch_output.append_display_data(HTML(state.batch_table.round(4).to_html()))
+        
+        runner.submit(batch_button, work, on_result=show, status=action_status,
+                      message=f"Analyzing {len(regions['features'])} regions…")
+    
+    def on_series_button_clicked(b):
+        """Chart the index over the ROI for every image or monthly/seasonal bucket"""
+        if not draw_control.data:
+            print("Error: Please draw a region of interest (ROI) on the map.")
+            return
+        
+        roi = draw_control.data[-1]['geometry']
+        formula = index_formula.value
+        aliases = {var: band_vars[var].value for var in band_vars}
+        args = (satellite.value, start_date.value, end_date.value, cloud_cover.value, roi, formula, aliases)
+        period = series_period.value
+        try:
+            engine.compile_index(satellite.value, formula, aliases)
+        except FormulaError as e:
+            action_status.fail(e)
+            return
+        
+        def work(job):
+            # Every image (or bucket) is reduced server-side and fetched in one request
+            series = engine.time_series(*args, period=period)
+            job.check()
+            return series, render_series_png(series, f"{satellite.value}: {formula} ({len(series)} points)")
+        
+        def show(result):
+            state.series, series_chart.value = result
+            state.series_label = formula
+        
+        runner.submit(series_button, work, on_result=show, status=action_status,
+                      message='Computing time series…')
+    
+    def on_change_button_clicked(b):
+        """Difference the index between period A and period B and measure the area of change"""
+        if not draw_control.data:
+            print("Error: Please draw a region of interest (ROI) on the map.")
+            return
+        
+        roi = draw_control.data[-1]['geometry']
+        formula = index_formula.value
+        aliases = {var: band_vars[var].value for var in band_vars}
+        period_a = (start_date.value, end_date.value)
+        period_b = (start_date_b.value, end_date_b.value)
+        threshold = change_threshold.value
+        try:
+            key, delta, classes = engine.change(satellite.value, period_a, period_b, cloud_cover.value, roi,
+                                                formula, threshold, aliases, composite_method.value)
+        except FormulaError as e:
+            action_status.fail(e)
+            return
+        
+        # Both composites come from the cache; the server evaluates both sides in one reduction
+        layer_manager.add(LayerDescriptor(f'Change {formula}', delta, DELTA_VIS, (key, 'delta')),
+                          message='Computing difference…')
+        layer_manager.add(LayerDescriptor('Change classes', classes.updateMask(classes.neq(0)),
+                                          CHANGE_VIS, (key, 'classes')), message='Classifying change…')
+        
+        def work(job):
+            return engine.change_stats(key, delta, classes, roi, satellite.value)
+        
+        def show(result):
+            state.change = {'index': formula, 'threshold': threshold, 'stats': result,
+                            'period_a': '..'.join(str(d)[:10] for d in period_a),
+                            'period_b': '..'.join(str(d)[:10] for d in period_b)}
+            change_stats.value = render_change_html(state.change)
+        
+        runner.submit(change_button, work, on_result=show, status=action_status,
+                      message='Measuring area of change…')
+    
+    def on_export_button_clicked(b):
+        """Export the batch table as CSV"""
+        if state.batch_table is None:
+            print("Error: No batch results. Please run Batch Analyze first.")
+            return
+        path = export_table(state.batch_table, f"geemapbot_batch_{datetime.now():%Y%m%d_%H%M%S}.csv")
+        action_status.done(f"Exported {path}")
     
     def on_chat_button_clicked(b):
         """Handle chat interactions"""
-        global current_image
         question = chat_input.value
-        if not question or not current_image:
+        if not question or state.image is None:
             return
         
-        try:
-            response = ollama.chat(
-                model="deepseek-r1:1.5b",
-                messages=[{
-                    "role": "user",
-                    "content": f"Analyze this satellite data: {question}"
-                }]
-            )
-            reply = response["message"]["content"]
+        # Compact context under a token budget behind the unchanging system prefix
+        roi = draw_control.data[-1]['geometry'] if draw_control.data else None
+        context = engine.chat_context(satellite.value, start_date.value, end_date.value, cloud_cover.value,
+                                      composite_method.value, roi, state=state)
+        
+        # One conversation per composite/ROI; follow-ups only send the new question.
+        # With tools the model fetches the statistics it needs itself.
+        tools = None
+        if use_tools.value:
+            tools = tool_registry.bind(ToolContext(
+                engine, satellite.value, start_date.value, end_date.value, cloud_cover.value, roi,
+                composite_method.value
+            ))
+            session = chat_sessions.get((state.key, 'tools'), model=TOOL_MODEL)
+        else:
+            session = chat_sessions.get(state.key)
+        
+        if stream_reply.value:
+            # Stream tokens into the chat output as they are generated
+            view = StreamingReplyView(title="Assistant")
             with chat_output:
                 chat_output.clear_output()
-                display(HTML(f"<div style='padding:10px'><b>Assistant:</b><br>{reply}</div>"))
-        except Exception as e:
-            print(f"Chat error: {str(e)}")
+                display(view.widget)
+            
+            def work(job):
+                def on_update(splitter, stats):
+                    job.check()  # Stop streaming once a newer question was asked
+                    view.update(splitter, stats)
+                return session.ask(question, context, on_update=on_update, tools=tools)
+            
+            runner.submit(chat_button, work, status=chat_status, message='Thinking…')
+            return
+        
+        def work(job):
+            return session.ask(question, context, tools=tools).answer.strip()
+        
+        def show(reply):
+            chat_output.clear_output()
+            chat_output.append_display_data(HTML(f"<div style='padding:10px'><b>Assistant:</b><br>{reply}</div>"))
+        
+        runner.submit(chat_button, work, on_result=show, status=chat_status, message='Thinking…')
+    
+    def on_new_chat_clicked(b):
+        """Forget the conversation about the current composite"""
+        chat_sessions.reset(state.key)
+        chat_sessions.reset((state.key, 'tools'))
+        chat_output.clear_output()
+        chat_status.done('Started a new conversation')
     
     # =========================================
     # UI Layout Assembly
@@ -236,29 +512,61 @@ def display_main_app():
     satellite_group = widgets.VBox([
         satellite,
         widgets.HBox([start_date, end_date]),
-        cloud_cover
+        cloud_cover,
+        composite_method
     ], layout=widgets.Layout(border='1px solid gray', padding='10px'))
     
     # Visualization Controls Group
     visualization_group = widgets.VBox([
         widgets.HBox([opacity, gamma]),
         index_formula,
+        formula_feedback,
         widgets.VBox(list(band_vars.values()))
     ], layout=widgets.Layout(border='1px solid gray', padding='10px'))
     
+    # Batch Analysis Group
+    batch_group = widgets.VBox([
+        widgets.HBox([region_upload, batch_button, export_button]),
+        batch_output
+    ], layout=widgets.Layout(border='1px solid gray', padding='10px'))
+    
+    # Time Series Group
+    series_group = widgets.VBox([
+        widgets.HBox([series_period, series_button]),
+        series_chart
+    ], layout=widgets.Layout(border='1px solid gray', padding='10px'))
+    
+    change_group = widgets.VBox([
+        widgets.HBox([start_date_b, end_date_b]),
+        widgets.HBox([change_threshold, change_button]),
+        change_stats
+    ], layout=widgets.Layout(border='1px solid gray', padding='10px'))
+    
     # Chat Interface Group
     chat_group = widgets.VBox([
         chat_input,
-        chat_button,
+        widgets.HBox([chat_button, new_chat_button, stream_reply, use_tools]),
+        chat_status.widget,
         chat_output
     ], layout=widgets.Layout(border='1px solid gray', padding='10px'))
     
+    # Debug Group: timings of EE requests, cache lookups, tiles and LLM calls
+    debug_panel = TracePanel()
+    debug_group = widgets.Accordion(children=[debug_panel.widget], titles=('Debug: timings',))
+    
     # Main Controls Assembly
     controls = widgets.VBox([
         satellite_group,
         visualization_group,
-        widgets.HBox([load_button, calc_index_button]),
-        chat_group
+        widgets.HBox([load_button, calc_index_button, local_index_button, geotiff_button]),
+        action_status.widget,
+        layer_manager.widget,
+        local_stats,
+        batch_group,
+        series_group,
+        change_group,
+        chat_group,
+        debug_group
     ])
     
     # =========================================
@@ -268,8 +576,18 @@ def display_main_app():
     clear_login_button.on_click(clear_login)
     load_button.on_click(on_load_button_clicked)
     calc_index_button.on_click(on_calc_index_clicked)
+    local_index_button.on_click(on_local_index_clicked)
+    geotiff_button.on_click(on_geotiff_button_clicked)
+    batch_button.on_click(on_batch_button_clicked)
+    series_button.on_click(on_series_button_clicked)
+    change_button.on_click(on_change_button_clicked)
+    export_button.on_click(on_export_button_clicked)
     chat_button.on_click(on_chat_button_clicked)
+    new_chat_button.on_click(on_new_chat_clicked)
     satellite.observe(lambda _: update_bands(), 'value')
+    index_formula.observe(validate_formula, 'value')
+    for var in band_vars:
+        band_vars[var].observe(validate_formula, 'value')
     
     # Display Components
     display(controls)
@@ -0,0 +1,103 @@
+import json
+import os
+
+import ee
+import pandas as pd
+
+from composites import build_collection, composite_collection
+from image_stats import add_indices
+
+# =============================================
+# Region Sources
+# =============================================
+def features_from_draw_control(data):
+    """Every drawn feature as a GeoJSON FeatureCollection with a 'region' label"""
+    return label_features({'type': 'FeatureCollection', 'features': list(data)})
+
+
+def load_regions(source):
+    """Labelled GeoJSON regions from a GeoJSON file, a shapefile or uploaded GeoJSON bytes
+
+    Shapefiles are converted with geemap; every source yields the same
+    client-side FeatureCollection (see ``label_features``).
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return label_features(json.loads(bytes(source)))
+    if source.lower().endswith('.shp'):
+        import geemap
+        return label_features(geemap.shp_to_geojson(source))
+    with open(source, 'r', encoding='utf-8') as f:
+        return label_features(json.load(f))
+
+
+def label_features(geojson):
+    """Normalize GeoJSON to a FeatureCollection whose features carry a 'region' label"""
+    if geojson.get('type') == 'FeatureCollection':
+        features = geojson['features']
+    elif geojson.get('type') == 'Feature':
+        features = [geojson]
+    else:
+        features = [{'type': 'Feature', 'geometry': geojson, 'properties': {}}]
+    labelled = []
+    for i, feature in enumerate(features):
+        properties = dict(feature.get('properties') or {})
+        properties.pop('style', None)  # DrawControl styling, not data
+        properties['region'] = str(properties.get('region') or properties.get('name') or f'ROI {i + 1}')
+        labelled.append({'type': 'Feature', 'geometry': feature['geometry'], 'properties': properties})
+    return {'type': 'FeatureCollection', 'features': labelled}
+
+# =============================================
+# One-Request Batch Statistics
+# =============================================
+def batch_reducer():
+    return ee.Reducer.mean() \
+        .combine(ee.Reducer.stdDev(), sharedInputs=True) \
+        .combine(ee.Reducer.minMax(), sharedInputs=True) \
+        .combine(ee.Reducer.count(), sharedInputs=True)
+
+
+def batch_region_records(config, start, end, cloud_cover, regions, tile_scale=2, method='median'):
+    """Per-region band and index statistics for every region in a single request
+
+    One composite is built over all regions and reduced with ``reduceRegions``,
+    so the number of round-trips does not grow with the number of regions.
+    """
+    if isinstance(regions, ee.FeatureCollection):
+        collection = regions
+    else:
+        collection = ee.FeatureCollection(label_features(regions))
+    image = composite_collection(build_collection(config, start, end, cloud_cover).filterBounds(collection),
+                                 config, method)
+    image = add_indices(image, config['common'])
+    reduced = image.reduceRegions(
+        collection=collection,
+        reducer=batch_reducer(),
+        scale=config['scale'],
+        tileScale=tile_scale
+    )
+    # Geometries are not needed in the result; dropping them keeps the payload small
+    reduced = reduced.select(['.*'], None, False)
+    return [feature['properties'] for feature in reduced.getInfo()['features']]
+
+
+def records_to_table(records):
+    """Pandas table with one row per region, sorted by region label"""
+    table = pd.DataFrame.from_records(records)
+    if 'region' in table.columns:
+        table = table.set_index('region').sort_index()
+    return table
+
+
+def export_table(table, path):
+    """Write a batch table as CSV or Parquet (Arrow), chosen by file extension"""
+    if os.path.splitext(path)[1].lower() == '.parquet':
+        table.to_parquet(path)
+    else:
+        table.to_csv(path)
+    return path
+
+
+def table_to_context(table, columns=('NDVI_mean', 'NDWI_mean'), digits=3, max_rows=50):
+    """Compact CSV rendering of the key columns for the chat prompt"""
+    selected = [c for c in columns if c in table.columns] or list(table.columns)
+    return table[selected].head(max_rows).round(digits).to_csv()
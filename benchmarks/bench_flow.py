@@ -0,0 +1,162 @@
+"""End-to-end benchmark of the load -> statistics -> index -> chat flow
+
+Record the fixtures once against the real services (EE credentials as for the
+CLI, and a running LLM backend as selected by GEEMAPBOT_LLM_BACKEND):
+
+    python benchmarks/bench_flow.py --record benchmarks/fixtures/flow.json.gz
+
+then replay offline, with the recorded latencies or injected ones:
+
+    python benchmarks/bench_flow.py --fixtures benchmarks/fixtures/flow.json.gz
+    python benchmarks/bench_flow.py --fixtures benchmarks/fixtures/flow.json.gz --ee-latency 0.3 --llm-latency 0.02
+
+Each satellite/ROI-size case runs cold (empty caches) and warm (same engine).
+The stages are the headless equivalents of the notebook handlers: get_image plus
+the RGB map ID (load), extract_image_info (stats), on_calc_index_clicked (index)
+and the chat path (context + streamed answer).
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chat_session import ChatSession  # noqa: E402
+from composite_cache import CompositeCache  # noqa: E402
+from engine import AnalysisEngine, AnalysisState, initialize_earth_engine  # noqa: E402
+from llm_backends import LLMClient, backend_from_env  # noqa: E402
+from tracing import trace_ee_calls, tracer  # noqa: E402
+
+from replay import Fixtures, RecordingBackend, ReplayBackend, record_ee, replay_ee  # noqa: E402
+
+SATELLITES = ['Landsat 8', 'Sentinel-2']
+ROI_SIZES_KM = [1, 10, 50]
+START, END = '2023-01-01', '2023-06-30'  # Fixed, so recorded requests match on replay
+QUESTION = "How healthy is the vegetation in this area?"
+CHAT_MODEL = os.environ.get('GEEMAPBOT_CHAT_MODEL', "deepseek-r1:1.5b")
+
+
+def square_roi(lon, lat, size_km):
+    half_lat = size_km / 111.32 / 2
+    half_lon = half_lat / math.cos(math.radians(lat))
+    ring = [[lon - half_lon, lat - half_lat], [lon + half_lon, lat - half_lat],
+            [lon + half_lon, lat + half_lat], [lon - half_lon, lat + half_lat], [lon - half_lon, lat - half_lat]]
+    return {'type': 'Polygon', 'coordinates': [ring]}
+
+# =============================================
+# Stages
+# =============================================
+def stage_load(engine, case, llm):
+    case['key'], case['image'] = engine.composite(case['satellite'], START, END, 60, case['roi'])
+    case['image'].getMapId({'bands': ['B4', 'B3', 'B2'], 'min': 0, 'max': 0.3})
+
+
+def stage_stats(engine, case, llm):
+    case['stats'] = engine.region_stats(case['key'], case['image'], case['roi'], case['satellite'])
+
+
+def stage_index(engine, case, llm):
+    compiled = engine.compile_index(case['satellite'], 'NDVI')
+    compiled.to_ee(case['image']).getMapId({'min': -1, 'max': 1, 'palette': ['blue', 'white', 'green']})
+
+
+def stage_chat(engine, case, llm):
+    state = AnalysisState()
+    state.key, state.image, state.roi = case['key'], case['image'], case['roi']
+    context = engine.chat_context(case['satellite'], START, END, 60, 'median', case['roi'],
+                                  stats=case['stats'], state=state)
+    ChatSession(model=CHAT_MODEL, client=llm).ask(QUESTION, context, on_update=lambda splitter, stats: None)
+
+
+STAGES = [('load', stage_load), ('stats', stage_stats), ('index', stage_index), ('chat', stage_chat)]
+
+# =============================================
+# Measurement
+# =============================================
+def span_counts():
+    """Finished EE and LLM requests so far, from the tracer's counters"""
+    counts = {'ee': 0, 'llm': 0}
+    for (metric, span, _), value in list(tracer.counters.items()):
+        if metric == 'geemapbot_spans_total' and span.startswith('ee.'):
+            counts['ee'] += value
+        elif metric == 'geemapbot_spans_total' and span == 'llm.chat':
+            counts['llm'] += value
+    return counts
+
+
+def run_case(engine, case, llm, label):
+    rows = []
+    for stage, func in STAGES:
+        before = span_counts()
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        func(engine, case, llm)
+        wall = time.perf_counter() - started
+        after = span_counts()
+        rows.append({
+            'satellite': case['satellite'], 'roi_km': case['size_km'], 'pass': label, 'stage': stage,
+            'wall_s': wall, 'ee_calls': after['ee'] - before['ee'], 'llm_calls': after['llm'] - before['llm'],
+            'peak_mib': tracemalloc.get_traced_memory()[1] / 2 ** 20
+        })
+    return rows
+
+
+def report(rows):
+    print(f"{'satellite':<11} {'ROI km':>6} {'pass':<5} {'stage':<6} {'wall s':>8} {'EE':>4} {'LLM':>4} {'peak MiB':>9}")
+    for r in rows:
+        print(f"{r['satellite']:<11} {r['roi_km']:>6} {r['pass']:<5} {r['stage']:<6} {r['wall_s']:>8.3f} "
+              f"{r['ee_calls']:>4} {r['llm_calls']:>4} {r['peak_mib']:>9.1f}")
+    for label in ('cold', 'warm'):
+        subset = [r for r in rows if r['pass'] == label]
+        print(f"{label}: {sum(r['wall_s'] for r in subset):.2f} s, {sum(r['ee_calls'] for r in subset)} EE "
+              f"and {sum(r['llm_calls'] for r in subset)} LLM round-trips")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--record', metavar='PATH', help='run against EE and the LLM backend and save fixtures')
+    mode.add_argument('--fixtures', metavar='PATH', help='replay recorded fixtures offline')
+    parser.add_argument('--ee-latency', type=float, help='seconds per EE call (default: as recorded)')
+    parser.add_argument('--llm-latency', type=float, help='seconds per streamed chunk (default: as recorded)')
+    parser.add_argument('--satellite', action='append', choices=SATELLITES, help='default: all')
+    parser.add_argument('--roi-km', action='append', type=float, help=f'default: {ROI_SIZES_KM}')
+    parser.add_argument('--center', type=float, nargs=2, default=(91.7, 26.1), metavar=('LON', 'LAT'))
+    parser.add_argument('--json', metavar='PATH', help='also write the rows as JSON for comparing runs')
+    args = parser.parse_args()
+
+    if args.record:
+        fixtures = Fixtures()
+        initialize_earth_engine(os.environ.get('GEEMAPBOT_EE_SERVICE_ACCOUNT'), os.environ.get('GEEMAPBOT_EE_KEY_FILE'))
+        record_ee(fixtures)
+        llm = LLMClient(RecordingBackend(backend_from_env(), fixtures))
+    else:
+        fixtures = Fixtures.load(args.fixtures)
+        replay_ee(fixtures, latency=args.ee_latency)
+        llm = LLMClient(ReplayBackend(fixtures, latency=args.llm_latency))
+    trace_ee_calls()
+
+    tracemalloc.start()
+    rows = []
+    for satellite in args.satellite or SATELLITES:
+        for size_km in args.roi_km or ROI_SIZES_KM:
+            case = {'satellite': satellite, 'size_km': size_km, 'roi': square_roi(*args.center, size_km)}
+            engine = AnalysisEngine(composite_cache=CompositeCache())
+            rows += run_case(engine, case, llm, 'cold')
+            rows += run_case(engine, case, llm, 'warm')
+    tracemalloc.stop()
+
+    report(rows)
+    if args.record:
+        fixtures.save(args.record)
+        print(f'saved {len(fixtures.ee_calls)} EE and {len(fixtures.llm_calls)} LLM responses to {args.record}')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Tile latency benchmark: direct stand-in server vs. the local TileProxy
+
+Run from the repository root:
+
+    python benchmarks/bench_tiles.py --latency 0.08 --tiles 200
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tile_cache import TileCache, TileProxy  # noqa: E402
+
+# Smallest valid PNG, padded to a realistic tile size
+PNG = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                    '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082')
+
+
+# =============================================
+# Stand-In Tile Server
+# =============================================
+class StandInTileServer:
+    """Serves a fixed PNG for /{z}/{x}/{y} after an injected latency"""
+
+    def __init__(self, latency=0.05, tile_bytes=20000):
+        self.latency = latency
+        self.body = PNG + b'\0' * max(0, tile_bytes - len(PNG))
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.latency)
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(server.body)))
+                self.end_headers()
+                self.wfile.write(server.body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url_format(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/{{z}}/{{x}}/{{y}}'
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+# =============================================
+# Measurement
+# =============================================
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def fetch_all(url_format, tiles, concurrency):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+
+    def fetch(tile):
+        z, x, y = tile
+        started = time.perf_counter()
+        session.get(url_format.format(z=z, x=x, y=y)).raise_for_status()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(fetch, tiles))
+    session.close()
+    return latencies
+
+
+def report(label, latencies):
+    print(f'{label:<14} p50 {percentile(latencies, 50) * 1000:7.1f} ms   '
+          f'p95 {percentile(latencies, 95) * 1000:7.1f} ms   '
+          f'mean {statistics.mean(latencies) * 1000:7.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05, help='upstream latency per tile (s)')
+    parser.add_argument('--tiles', type=int, default=100, help='distinct tiles per pass')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--budget-mb', type=float, default=64)
+    args = parser.parse_args()
+
+    upstream = StandInTileServer(latency=args.latency)
+    rng = random.Random(0)
+    tiles = [(12, rng.randrange(4096), rng.randrange(4096)) for _ in range(args.tiles)]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        proxy = TileProxy(TileCache(cache_dir, max_bytes=int(args.budget_mb * 1024 * 1024))).start()
+        local_url = proxy.register(('bench', 'layer'), upstream.url_format)
+
+        report('direct', fetch_all(upstream.url_format, tiles, args.concurrency))
+        report('proxy (cold)', fetch_all(local_url, tiles, args.concurrency))
+        report('proxy (warm)', fetch_all(local_url, tiles, args.concurrency))
+        print(f'upstream requests: {upstream.requests}   cache: {proxy.cache.stats()}')
+        proxy.stop()
+    upstream.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Record/replay harness for Earth Engine and LLM responses
+
+Recording wraps the real ee.data request functions and LLM backend and stores
+every response, keyed by a hash of its request, in one gzipped JSON fixture.
+Replaying installs stand-ins that answer from the fixture after an injected
+latency, so the real analysis code runs offline and deterministically.
+"""
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+import ee
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ee_quota import EE_CALLS, wrap_ee_calls  # noqa: E402
+
+
+def fingerprint(value):
+    """Stable hash of a request: EE objects by their serialized graph, everything else as JSON"""
+
+    def normalize(value):
+        if isinstance(value, ee.ComputedObject):
+            return {'ee': value.serialize(for_cloud_api=True)}
+        if isinstance(value, dict):
+            return {str(k): normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        return value
+
+    text = json.dumps(normalize(value), sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class Fixtures:
+    """Recorded responses: EE algorithm signatures, EE calls and LLM requests"""
+
+    def __init__(self, algorithms=None, ee_calls=None, llm_calls=None):
+        self.algorithms = algorithms
+        self.ee_calls = ee_calls or {}
+        self.llm_calls = llm_calls or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['algorithms'], data['ee'], data['llm'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump({'algorithms': self.algorithms, 'ee': self.ee_calls, 'llm': self.llm_calls}, f)
+
+    def put(self, table, key, entry):
+        with self._lock:
+            table[key] = entry
+
+# =============================================
+# Earth Engine
+# =============================================
+def map_id_to_json(result):
+    fetcher = result.get('tile_fetcher')
+    return {'mapid': result.get('mapid'), 'token': result.get('token'),
+            'url_format': fetcher.url_format if fetcher is not None else None}
+
+
+def map_id_from_json(entry):
+    return {'mapid': entry['mapid'], 'token': entry['token'],
+            'tile_fetcher': ee.data.TileFetcher(entry['url_format'], map_name=entry['mapid'])}
+
+
+def record_ee(fixtures):
+    """Store every EE response from now on; call after EE is initialized"""
+    fixtures.algorithms = ee.data.getAlgorithms()
+
+    def wrapper(name, call):
+        def recording(*args, **kwargs):
+            key = f'{name}:{fingerprint([args, kwargs])}'
+            started = time.perf_counter()
+            result = call(*args, **kwargs)
+            response = map_id_to_json(result) if name == 'getMapId' else result
+            fixtures.put(fixtures.ee_calls, key, {'response': response, 'seconds': time.perf_counter() - started})
+            return result
+        return recording
+
+    wrap_ee_calls('record', wrapper)
+
+
+def replay_ee(fixtures, latency=None):
+    """Answer EE requests from ``fixtures``; ``latency`` seconds per call, or the recorded time when None"""
+
+    def stand_in(name):
+        def replay(*args, **kwargs):
+            key = f'{name}:{fingerprint([args, kwargs])}'
+            entry = fixtures.ee_calls.get(key)
+            if entry is None:
+                raise ee.EEException(f'No recorded response for {name} ({key}); record the fixtures again')
+            time.sleep(entry['seconds'] if latency is None else latency)
+            return map_id_from_json(entry['response']) if name == 'getMapId' else entry['response']
+        return replay
+
+    for name in EE_CALLS:
+        if getattr(ee.data, name, None) is not None:
+            setattr(ee.data, name, stand_in(name))
+    # No credentials and no discovery request: only the algorithm signatures are needed
+    ee.data.getAlgorithms = lambda: fixtures.algorithms
+    ee.data.initialize = lambda **kwargs: None
+    ee.Initialize(credentials=None, project='geemapbot-replay')
+
+# =============================================
+# LLM
+# =============================================
+def plain(response):
+    """Ollama response objects (pydantic models in recent clients) as plain JSON data"""
+    if hasattr(response, 'model_dump'):
+        return response.model_dump(exclude_none=True)
+    return json.loads(json.dumps(response, default=str))
+
+
+def llm_key(model, messages, stream, tools):
+    return fingerprint({'model': model, 'messages': messages, 'stream': stream, 'tools': bool(tools)})
+
+
+class RecordingBackend:
+    """Wraps a real backend and stores its responses (streamed chunks with their timing)"""
+
+    def __init__(self, backend, fixtures):
+        self.backend = backend
+        self.fixtures = fixtures
+        self.name = backend.name
+        self.errors = backend.errors
+
+    def chat(self, model, messages, stream=False, tools=None, **kwargs):
+        key = llm_key(model, messages, stream, tools)
+        started = time.perf_counter()
+        response = self.backend.chat(model, messages, stream=stream, tools=tools, **kwargs)
+        if not stream:
+            self.fixtures.put(self.fixtures.llm_calls, key,
+                              {'response': plain(response), 'seconds': time.perf_counter() - started})
+            return response
+        return self._record_stream(key, started, response)
+
+    def _record_stream(self, key, started, chunks):
+        recorded = []
+        last = started
+        for chunk in chunks:
+            now = time.perf_counter()
+            recorded.append({'chunk': plain(chunk), 'seconds': now - last})
+            last = now
+            yield chunk
+        self.fixtures.put(self.fixtures.llm_calls, key, {'chunks': recorded})
+
+    def warmup(self, model, system=None, keep_alive=None):
+        return self.backend.warmup(model, system=system, keep_alive=keep_alive)
+
+
+class ReplayBackend:
+    """LLM backend answering from fixtures; ``latency`` replaces the recorded per-chunk delays"""
+
+    name = 'replay'
+    errors = ()
+
+    def __init__(self, fixtures, latency=None):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.requests = 0
+
+    def chat(self, model, messages, stream=False, tools=None, **kwargs):
+        self.requests += 1
+        entry = self.fixtures.llm_calls.get(llm_key(model, messages, stream, tools))
+        if entry is None:
+            raise KeyError(f'No recorded LLM response for {model}; record the fixtures again')
+        if not stream:
+            time.sleep(self._delay(entry['seconds']))
+            return entry['response']
+        return self._replay_stream(entry['chunks'])
+
+    def _replay_stream(self, chunks):
+        for item in chunks:
+            time.sleep(self._delay(item['seconds']))
+            yield item['chunk']
+
+    def _delay(self, recorded):
+        return recorded if self.latency is None else self.latency
+
+    def warmup(self, model, system=None, keep_alive=None):
+        return None
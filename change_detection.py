@@ -0,0 +1,91 @@
+import html
+
+import ee
+
+from image_stats import build_reducer, split_band_stats
+from prompt_context import fmt
+
+# =============================================
+# Server-Side Differencing
+# =============================================
+# The index is evaluated on both composites and subtracted on the server (B - A).
+# Pixels are classified as loss (-1), stable (0) or gain (1) against a symmetric
+# threshold; pixels missing in either composite stay masked.
+CHANGE_CLASSES = {-1: 'loss', 0: 'stable', 1: 'gain'}
+DELTA_VIS = {'min': -0.5, 'max': 0.5, 'palette': ['#d7191c', '#ffffbf', '#1a9641']}
+CHANGE_VIS = {'min': -1, 'max': 1, 'palette': ['#d7191c', '#ffffbf', '#1a9641']}
+
+
+def change_images(compiled, image_a, image_b, threshold=0.1):
+    """``(delta, classes)``: the index difference B - A and its loss/stable/gain classification"""
+    delta = compiled.to_ee(image_b, 'delta').subtract(compiled.to_ee(image_a, 'delta')).rename('delta')
+    classes = ee.Image(0) \
+        .where(delta.lte(-threshold), -1) \
+        .where(delta.gte(threshold), 1) \
+        .updateMask(delta.mask()) \
+        .rename('change') \
+        .toInt8()
+    return delta, classes
+
+
+def change_dictionary(delta, classes, roi, scale):
+    """Delta statistics and area per change class in a single reduceRegion
+
+    Every class becomes a band holding the pixel area in hectares where the class
+    applies and 0 elsewhere, so the summed band is the area of that class.
+    """
+    area = ee.Image.pixelArea().divide(1e4)
+    areas = [area.multiply(classes.eq(value)).rename(name) for value, name in CHANGE_CLASSES.items()]
+    stacked = ee.Image.cat([delta] + areas).updateMask(classes.mask())
+    return stacked.reduceRegion(
+        reducer=build_reducer().combine(ee.Reducer.sum(), sharedInputs=True),
+        geometry=ee.Geometry(roi),
+        scale=scale,
+        bestEffort=True
+    )
+
+
+def parse_change_stats(result):
+    """``{'delta': stats, 'area_ha': {class: ha}, 'fraction': {class: share}}`` from the reduction"""
+    per_band = split_band_stats(dict(result), ['delta'] + list(CHANGE_CLASSES.values()))
+    delta = {k: v for k, v in per_band.get('delta', {}).items() if k != 'sum'}
+    area = {name: per_band.get(name, {}).get('sum') or 0.0 for name in CHANGE_CLASSES.values()}
+    total = sum(area.values())
+    return {
+        'delta': delta,
+        'area_ha': area,
+        'fraction': {name: value / total if total else 0.0 for name, value in area.items()}
+    }
+
+# =============================================
+# Rendering
+# =============================================
+def change_to_context(change):
+    """One line per class plus the mean delta, for the chat prompt"""
+    label = f"{change['index']} change {change['period_a']} -> {change['period_b']}"
+    areas = ', '.join(f"{name} {fmt(change['stats']['area_ha'][name], unit='ha')} "
+                      f"({change['stats']['fraction'][name]:.1%})" for name in CHANGE_CLASSES.values())
+    delta = change['stats']['delta']
+    return [f"{label}, threshold ±{change['threshold']}: {areas}",
+            f"Delta mean {fmt(delta.get('mean'))}, min {fmt(delta.get('min'))}, max {fmt(delta.get('max'))}"]
+
+
+def render_change_html(change):
+    """Area-of-change table for the widget UI"""
+    stats = change['stats']
+    colors = dict(zip(CHANGE_CLASSES.values(), CHANGE_VIS['palette']))
+    rows = ''.join(
+        f"<tr><td><span style='color:{colors[name]};'>■</span> {name}</td>"
+        f"<td>{stats['area_ha'][name]:,.1f} ha</td><td>{stats['fraction'][name]:.1%}</td></tr>"
+        for name in CHANGE_CLASSES.values()
+    )
+    delta = stats['delta']
+    mean = delta.get('mean')
+    return f"""
+    <div style="padding:10px; border:1px solid #ddd; border-radius:5px;">
+        <b>Change in {html.escape(change['index'])}:</b> {change['period_a']} → {change['period_b']}
+        (threshold ±{change['threshold']})
+        <table style="margin-top:5px;">{rows}</table>
+        <small>Mean delta: {'n/a' if mean is None else f'{mean:+.4f}'}</small>
+    </div>
+    """
@@ -0,0 +1,171 @@
+import re
+import threading
+
+import ollama
+
+from chat_stream import ThinkSplitter, stream_chat
+from composite_cache import LRUCache
+from prompt_context import SYSTEM_PROMPT, PromptMetrics, estimate_tokens
+
+# =============================================
+# Multi-Turn Chat Session
+# =============================================
+class ChatSession:
+    """Conversation history for one ROI/composite, sent append-only to Ollama
+
+    Every request is the previous request plus the new turn, so Ollama can reuse
+    the KV cache for everything already evaluated and ``keep_alive`` keeps the
+    model loaded between questions. The data context is only re-sent when it
+    changes. Once the history exceeds ``max_history_tokens``, all but the last
+    ``keep_turns`` turns are folded into a short summary; doing this in one step
+    keeps the prefix stable for the following turns.
+    """
+
+    def __init__(self, model="deepseek-r1:1.5b", client=ollama, system=SYSTEM_PROMPT, keep_alive='30m',
+                 max_history_tokens=2048, keep_turns=2, summarize=None):
+        self.model = model
+        self.client = client
+        self.system = system
+        self.keep_alive = keep_alive
+        self.max_history_tokens = max_history_tokens
+        self.keep_turns = keep_turns
+        self.summarize = summarize or summarize_turns
+        self.summary = None
+        self.turns = []
+        self.context = None
+        self.last_metrics = None
+        self._lock = threading.Lock()
+
+    @property
+    def messages(self):
+        messages = [{'role': 'system', 'content': self.system}]
+        if self.summary:
+            messages.append({'role': 'user', 'content': f"Summary of our earlier conversation:\n{self.summary}"})
+            messages.append({'role': 'assistant', 'content': 'Noted.'})
+        for turn in self.turns:
+            messages.append({'role': 'user', 'content': turn['content']})
+            messages.extend(turn['exchange'])
+            messages.append({'role': 'assistant', 'content': turn['answer']})
+        return messages
+
+    def history_tokens(self):
+        return sum(estimate_tokens(m['content']) for m in self.messages[1:])
+
+    def ask(self, question, context=None, on_update=None, tools=None, max_tool_rounds=4):
+        """Send one question; streams through ``on_update`` when given. Returns the ThinkSplitter
+
+        With ``tools`` (see chat_tools.BoundTools) the model may call tools; their
+        results are sent back until it answers or ``max_tool_rounds`` is used up.
+        """
+        with self._lock:
+            self._compact()
+            if context is not None and context != self.context:
+                content = f"{context}\n\n## Question\n{question}"
+            else:
+                content = question
+            messages = self.messages + [{'role': 'user', 'content': content}]
+
+        metrics = PromptMetrics(messages)
+        exchange = []
+        for step in range(max_tool_rounds + 1):
+            kwargs = {'keep_alive': self.keep_alive}
+            if tools is not None and step < max_tool_rounds:
+                kwargs['tools'] = tools.schemas()
+            splitter, calls, prompt_counts = self._request(messages + exchange, on_update, kwargs)
+            if not calls:
+                break
+            # Tool calls and results become part of the turn, keeping the history append-only
+            exchange.append({'role': 'assistant', 'content': splitter.answer, 'tool_calls': [
+                {'function': {'name': call['function']['name'], 'arguments': dict(call['function']['arguments'])}}
+                for call in calls
+            ]})
+            for call in calls:
+                name = call['function']['name']
+                exchange.append({'role': 'tool', 'tool_name': name,
+                                 'content': tools.call(name, call['function']['arguments'])})
+        metrics.record(*prompt_counts)
+
+        with self._lock:
+            # Reasoning is not kept in the history; only the answer is
+            self.turns.append({'question': question, 'content': content, 'exchange': exchange,
+                               'answer': splitter.answer.strip()})
+            if context is not None:
+                self.context = context
+            self.last_metrics = metrics
+        return splitter
+
+    def _request(self, messages, on_update, kwargs):
+        if on_update is not None:
+            splitter, stats = stream_chat(messages, model=self.model, client=self.client,
+                                          on_update=on_update, **kwargs)
+            return splitter, stats.tool_calls, (stats.prompt_eval_count, stats.prompt_eval_duration)
+        response = self.client.chat(model=self.model, messages=messages, **kwargs)
+        splitter = ThinkSplitter()
+        splitter.feed(response['message'].get('content') or '')
+        splitter.flush()
+        calls = response['message'].get('tool_calls') or []
+        return splitter, calls, (response.get('prompt_eval_count'), response.get('prompt_eval_duration'))
+
+    def reset(self):
+        with self._lock:
+            self.summary = None
+            self.turns = []
+            self.context = None
+
+    def _compact(self):
+        if len(self.turns) <= self.keep_turns or self.history_tokens() <= self.max_history_tokens:
+            return
+        cut = len(self.turns) - self.keep_turns
+        evicted, self.turns = self.turns[:cut], self.turns[cut:]
+        self.summary = self.summarize(self.summary, evicted)
+        # The data context may have been in an evicted turn; send it again next time
+        if not any(turn['content'] != turn['question'] for turn in self.turns):
+            self.context = None
+
+
+def first_sentence(text, limit=160):
+    sentence = re.split(r'(?<=[.!?])\s', text.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit - 1] + '…'
+
+
+def summarize_turns(previous, turns, max_tokens=256):
+    """Extractive summary: each question with the first sentence of its answer
+
+    The oldest lines are dropped once the summary exceeds ``max_tokens``, so it
+    stays bounded however long the conversation runs.
+    """
+    lines = previous.split('\n') if previous else []
+    lines += [f"- Q: {first_sentence(turn['question'], 100)} A: {first_sentence(turn['answer'])}"
+              for turn in turns]
+    while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+# =============================================
+# Sessions per ROI/Composite
+# =============================================
+class ChatSessions:
+    """LRU of chat sessions keyed by composite/ROI, created on first use"""
+
+    def __init__(self, max_sessions=16, **session_kwargs):
+        self.sessions = LRUCache(max_sessions)
+        self.session_kwargs = session_kwargs
+        self._lock = threading.Lock()
+
+    def get(self, key, **overrides):
+        """Session for ``key``; ``overrides`` (e.g. another model) apply when it is created"""
+        with self._lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = ChatSession(**{**self.session_kwargs, **overrides})
+                self.sessions.put(key, session)
+            return session
+
+    def reset(self, key):
+        self.sessions.pop(key)
+
+    def reset_prefix(self, prefix):
+        """Drop every session whose tuple key starts with ``prefix``, e.g. all of one server session"""
+        for key in self.sessions.keys():
+            if isinstance(key, tuple) and key[:len(prefix)] == tuple(prefix):
+                self.sessions.pop(key)
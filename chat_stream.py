@@ -0,0 +1,176 @@
+import html
+import time
+
+import ipywidgets as widgets
+import ollama
+
+# =============================================
+# Reasoning / Answer Separation
+# =============================================
+THINK_OPEN = '<think>'
+THINK_CLOSE = '</think>'
+
+
+class ThinkSplitter:
+    """Split streamed text into the <think> reasoning block and the answer
+
+    Tags may arrive split across chunks, so any trailing text that could be the
+    start of a tag is held back until the next chunk decides it.
+    """
+
+    def __init__(self):
+        self.thinking = ''
+        self.answer = ''
+        self.in_think = False
+        self._pending = ''
+
+    def feed(self, text):
+        buffer = self._pending + text
+        self._pending = ''
+        while buffer:
+            tag = THINK_CLOSE if self.in_think else THINK_OPEN
+            pos = buffer.find(tag)
+            if pos >= 0:
+                self._emit(buffer[:pos])
+                buffer = buffer[pos + len(tag):]
+                self.in_think = not self.in_think
+                continue
+            # Hold back a partial tag at the end of the buffer
+            keep = 0
+            for size in range(min(len(tag) - 1, len(buffer)), 0, -1):
+                if tag.startswith(buffer[-size:]):
+                    keep = size
+                    break
+            self._emit(buffer[:len(buffer) - keep])
+            self._pending = buffer[len(buffer) - keep:]
+            break
+
+    def flush(self):
+        self._emit(self._pending)
+        self._pending = ''
+
+    def _emit(self, text):
+        if self.in_think:
+            self.thinking += text
+        else:
+            self.answer += text
+
+# =============================================
+# Streaming Chat
+# =============================================
+class StreamStats:
+    """Time-to-first-token and throughput of one streamed reply"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.chunks = 0
+        self.eval_count = None
+        self.eval_duration = None
+        self.prompt_eval_count = None
+        self.prompt_eval_duration = None
+        self.tool_calls = []
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started
+
+    @property
+    def tokens(self):
+        return self.eval_count if self.eval_count is not None else self.chunks
+
+    @property
+    def tokens_per_second(self):
+        # Prefer Ollama's own generation timings from the final chunk
+        if self.eval_count and self.eval_duration:
+            return self.eval_count / (self.eval_duration / 1e9)
+        if self.first_token_at is None or self.finished_at is None:
+            return None
+        elapsed = self.finished_at - self.first_token_at
+        return self.chunks / elapsed if elapsed > 0 else None
+
+    @property
+    def prefill_seconds(self):
+        if not self.prompt_eval_duration:
+            return None
+        return self.prompt_eval_duration / 1e9
+
+    def summary(self):
+        ttft = self.time_to_first_token
+        tps = self.tokens_per_second
+        prefill = self.prefill_seconds
+        return (f"first token {ttft:.2f}s" if ttft is not None else "no tokens") + \
+            (f" · {tps:.1f} tokens/s" if tps is not None else "") + \
+            f" · {self.tokens} tokens" + \
+            (f" · prompt {self.prompt_eval_count} tokens, prefill {prefill:.2f}s" if prefill is not None else "")
+
+
+def stream_chat(messages, model="deepseek-r1:1.5b", client=ollama, on_update=None, **kwargs):
+    """Stream a chat reply, calling ``on_update(splitter, stats)`` after every chunk
+
+    ``client`` is anything with an Ollama-compatible ``chat`` method, e.g. the
+    ``ollama`` module or ``ollama.Client(host=...)`` pointed at another server.
+    """
+    splitter = ThinkSplitter()
+    stats = StreamStats()
+    for chunk in client.chat(model=model, messages=messages, stream=True, **kwargs):
+        content = chunk['message']['content']
+        if content:
+            if stats.first_token_at is None:
+                stats.first_token_at = time.perf_counter()
+            stats.chunks += 1
+            splitter.feed(content)
+        stats.tool_calls.extend(chunk['message'].get('tool_calls') or [])
+        if chunk.get('done'):
+            stats.eval_count = chunk.get('eval_count')
+            stats.eval_duration = chunk.get('eval_duration')
+            stats.prompt_eval_count = chunk.get('prompt_eval_count')
+            stats.prompt_eval_duration = chunk.get('prompt_eval_duration')
+        if on_update is not None:
+            on_update(splitter, stats)
+    splitter.flush()
+    stats.finished_at = time.perf_counter()
+    if on_update is not None:
+        on_update(splitter, stats)
+    return splitter, stats
+
+# =============================================
+# Chat Output Rendering
+# =============================================
+class StreamingReplyView:
+    """HTML widget that re-renders a streamed reply, throttled to ``interval`` seconds"""
+
+    def __init__(self, title="GeeMapBot", interval=0.05):
+        self.title = title
+        self.interval = interval
+        self.widget = widgets.HTML()
+        self._last_render = 0.0
+
+    def update(self, splitter, stats):
+        now = time.perf_counter()
+        if stats.finished_at is None and now - self._last_render < self.interval:
+            return
+        self._last_render = now
+        self.widget.value = self.render(splitter, stats)
+
+    def render(self, splitter, stats):
+        thinking = ''
+        if splitter.thinking.strip():
+            # Reasoning stays collapsed unless the model is still thinking
+            is_open = ' open' if splitter.in_think and stats.finished_at is None else ''
+            thinking = f"""
+            <details{is_open} style="margin-bottom: 8px; color: #666;">
+                <summary>Reasoning</summary>
+                <p style="white-space: pre-wrap;">{html.escape(splitter.thinking.strip())}</p>
+            </details>"""
+        status = stats.summary() if stats.finished_at is not None else 'generating…'
+        return f"""
+        <div style="font-family: Arial, sans-serif; padding: 10px; border: 1px solid #ddd; border-radius: 5px; background-color: #f9f9f9;">
+            <b>{self.title}:</b>{thinking}
+            <p style="white-space: pre-wrap;">{html.escape(splitter.answer.strip())}</p>
+            <small style="color: #888;">{status}</small>
+        </div>
+        """
@@ -0,0 +1,198 @@
+import json
+import threading
+from datetime import date
+
+import ee
+
+from composite_cache import LRUCache, composite_key
+from composites import COMPOSITE_METHODS
+from formula import FormulaError
+
+# =============================================
+# Tool State
+# =============================================
+class ToolContext:
+    """Composite parameters and ROI the tools act on, seeded from the UI
+
+    ``load_composite`` changes the parameters; later tool calls in the same
+    conversation then use the new composite. The work itself is done by the
+    shared ``engine.AnalysisEngine``.
+    """
+
+    def __init__(self, engine, satellite, start, end, cloud_cover, roi, method='median'):
+        self.engine = engine
+        self.satellite = satellite
+        self.start = str(start)[:10]
+        self.end = str(end)[:10]
+        self.cloud_cover = cloud_cover
+        self.method = method
+        self.roi = roi
+
+    @property
+    def config(self):
+        return self.engine.config(self.satellite)
+
+    @property
+    def key(self):
+        if self.roi is None:
+            raise ValueError("No region of interest drawn; ask the user to draw one on the map")
+        return composite_key(self.satellite, self.start, self.end, self.cloud_cover, self.roi, method=self.method)
+
+    def image(self):
+        self.key  # raises without an ROI
+        return self.engine.composite(self.satellite, self.start, self.end, self.cloud_cover,
+                                     self.roi, self.method)[1]
+
+# =============================================
+# Tools
+# =============================================
+def load_composite(ctx, satellite=None, start_date=None, end_date=None, cloud_cover=None, method=None):
+    """Switch the composite the other tools use; no server round-trip"""
+    if satellite is not None:
+        ctx.engine.config(satellite)
+    if method is not None and method not in COMPOSITE_METHODS:
+        raise ValueError(f"Unknown method {method!r}; choose from {', '.join(COMPOSITE_METHODS)}")
+    for value in (start_date, end_date):
+        if value is not None:
+            date.fromisoformat(str(value))
+    ctx.satellite = satellite or ctx.satellite
+    ctx.start = str(start_date or ctx.start)
+    ctx.end = str(end_date or ctx.end)
+    ctx.cloud_cover = int(cloud_cover) if cloud_cover is not None else ctx.cloud_cover
+    ctx.method = method or ctx.method
+    return {
+        'satellite': ctx.satellite,
+        'start_date': ctx.start,
+        'end_date': ctx.end,
+        'cloud_cover': ctx.cloud_cover,
+        'method': ctx.method,
+        'bands': ctx.config['bands'],
+        'aliases': ctx.config['common']
+    }
+
+
+def compute_index(ctx, formula):
+    """Statistics of an index over the ROI: a name like NDVI/EVI or a band formula"""
+    compiled = ctx.engine.compile_index(ctx.satellite, formula)
+    stats = ctx.engine.index_stats(ctx.key, ctx.image(), ctx.roi, ctx.satellite, [formula])[formula]
+    return {'formula': compiled.text, **stats}
+
+
+REDUCERS = ['mean', 'min', 'max', 'stdDev', 'count', 'p10', 'p50', 'p90']
+
+
+def region_stats(ctx, bands=None, reducer='mean'):
+    """One statistic per band (and NDVI/NDWI) over the ROI at native scale"""
+    if reducer not in REDUCERS:
+        raise ValueError(f"Unknown reducer {reducer!r}; choose from {', '.join(REDUCERS)}")
+    # Same cache entry as the chat's full statistics, so either path fills it for the other
+    result = ctx.engine.region_stats(ctx.key, ctx.image(), ctx.roi, ctx.satellite)
+    available = {**result['stats'], **result['indices']}
+    names = bands or list(available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown band {', '.join(unknown)}; available: {', '.join(available)}")
+    return {'reducer': reducer, 'values': {name: available[name].get(reducer) for name in names}}
+
+
+def time_series(ctx, index='NDVI', period='month'):
+    """Index over time for the ROI, per image or per month/season"""
+    ctx.key  # raises without an ROI
+    series = ctx.engine.time_series(ctx.satellite, ctx.start, ctx.end, ctx.cloud_cover, ctx.roi,
+                                    index, period=period)
+    return {'index': index, 'period': period, 'points': [[d, v] for d, v in series[-48:]]}
+
+
+TOOLS = [
+    (load_composite, False, "Switch satellite, date range, scene cloud cover or compositing method for later tool calls.", {
+        'satellite': {'type': 'string', 'description': 'Landsat 8, Landsat 9 or Sentinel-2'},
+        'start_date': {'type': 'string', 'description': 'YYYY-MM-DD'},
+        'end_date': {'type': 'string', 'description': 'YYYY-MM-DD'},
+        'cloud_cover': {'type': 'integer', 'description': 'Maximum scene cloud cover in percent'},
+        'method': {'type': 'string', 'enum': COMPOSITE_METHODS},
+    }, []),
+    (compute_index, True, "Mean, min, max, stdDev and percentiles of a spectral index over the ROI.", {
+        'formula': {'type': 'string', 'description': 'NDVI, NDWI, EVI, SAVI or a formula over NIR, RED, GREEN, BLUE and band names'},
+    }, ['formula']),
+    (region_stats, True, "Surface reflectance statistic per band over the ROI.", {
+        'bands': {'type': 'array', 'items': {'type': 'string'}, 'description': 'Band names, NDVI or NDWI; all when omitted'},
+        'reducer': {'type': 'string', 'enum': REDUCERS},
+    }, []),
+    (time_series, True, "Time series of an index over the ROI within the composite's date range.", {
+        'index': {'type': 'string', 'description': 'NDVI, NDWI, EVI, SAVI or a band formula'},
+        'period': {'type': 'string', 'enum': ['image', 'month', 'season']},
+    }, []),
+]
+
+# =============================================
+# Registry with Memoized Results
+# =============================================
+def round_values(value, digits=4):
+    if isinstance(value, float):
+        return round(value, digits)
+    if isinstance(value, dict):
+        return {k: round_values(v, digits) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [round_values(v, digits) for v in value]
+    return value
+
+
+class ToolRegistry:
+    """Ollama tool schemas plus dispatch, memoizing results per composite and arguments
+
+    Results are JSON strings for the 'tool' message. Errors are returned to the
+    model as ``{"error": ...}`` so it can correct itself, and are not memoized.
+    """
+
+    def __init__(self, tools=TOOLS, max_results=256):
+        self.tools = {}
+        self.results = LRUCache(max_results)
+        self.calls = 0
+        self._lock = threading.Lock()
+        for func, memoize, description, properties, required in tools:
+            self.tools[func.__name__] = (func, memoize, {
+                'type': 'function',
+                'function': {
+                    'name': func.__name__,
+                    'description': description,
+                    'parameters': {'type': 'object', 'properties': properties, 'required': required}
+                }
+            })
+
+    def schemas(self):
+        return [schema for _, _, schema in self.tools.values()]
+
+    def bind(self, ctx):
+        return BoundTools(self, ctx)
+
+    def call(self, ctx, name, arguments):
+        with self._lock:
+            self.calls += 1
+        if name not in self.tools:
+            return json.dumps({'error': f"Unknown tool {name!r}"})
+        func, memoize, _ = self.tools[name]
+        arguments = dict(arguments or {})
+        try:
+            key = (name, ctx.key, json.dumps(arguments, sort_keys=True, default=str)) if memoize else None
+            result = self.results.get(key) if key else None
+            if result is None:
+                result = json.dumps(round_values(func(ctx, **arguments)), default=str)
+                if key:
+                    self.results.put(key, result)
+            return result
+        except (FormulaError, ValueError, KeyError, TypeError, ee.EEException) as e:
+            return json.dumps({'error': str(e)})
+
+
+class BoundTools:
+    """A registry bound to one ToolContext, as handed to ChatSession.ask"""
+
+    def __init__(self, registry, ctx):
+        self.registry = registry
+        self.ctx = ctx
+
+    def schemas(self):
+        return self.registry.schemas()
+
+    def call(self, name, arguments):
+        return self.registry.call(self.ctx, name, arguments)
@@ -0,0 +1,205 @@
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import ee
+
+from image_stats import add_indices, compute_image_stats
+from roi import bounds_size_m, estimate_pixels, geojson_bounds
+
+# =============================================
+# ROI Tiling
+# =============================================
+DEFAULT_TILE_PIXELS = 4_000_000  # Comfortably below reduceRegion's default maxPixels
+
+
+def grid_tiles(bounds, scale, max_tile_pixels=DEFAULT_TILE_PIXELS):
+    """Split a (west, south, east, north) box into cells of at most ``max_tile_pixels``"""
+    west, south, east, north = bounds
+    width, height = bounds_size_m(bounds)
+    pixels = (width / scale) * (height / scale)
+    cells = max(1, math.ceil(pixels / max_tile_pixels))
+    # Keep cells roughly square in meters
+    cols = max(1, round(math.sqrt(cells * width / height))) if height > 0 else cells
+    rows = max(1, math.ceil(cells / cols))
+    step_x = (east - west) / cols
+    step_y = (north - south) / rows
+    return [
+        (west + i * step_x, south + j * step_y,
+         east if i == cols - 1 else west + (i + 1) * step_x,
+         north if j == rows - 1 else south + (j + 1) * step_y)
+        for j in range(rows) for i in range(cols)
+    ]
+
+# =============================================
+# Per-Tile Reduction
+# =============================================
+def moment_reducer():
+    """Unweighted count, sum and min/max: partial results that merge exactly"""
+    return ee.Reducer.count().unweighted() \
+        .combine(ee.Reducer.sum().unweighted(), sharedInputs=True) \
+        .combine(ee.Reducer.minMax(), sharedInputs=True)
+
+
+def tile_dictionary(image, geometry, scale, histograms=None):
+    """One dictionary per tile: moments of every band and of its square, plus histograms"""
+    bands = image.bandNames()
+    squares = image.multiply(image).rename(bands.map(lambda b: ee.String(b).cat('__sq')))
+    stats = image.addBands(squares).reduceRegion(
+        reducer=moment_reducer(),
+        geometry=geometry,
+        scale=scale,
+        maxPixels=1e13
+    )
+    for band, (low, high, steps) in (histograms or {}).items():
+        histogram = image.select(band).reduceRegion(
+            reducer=ee.Reducer.fixedHistogram(low, high, steps).unweighted(),
+            geometry=geometry,
+            scale=scale,
+            maxPixels=1e13
+        )
+        stats = stats.set(f'{band}__histogram', histogram.get(band))
+    return ee.Dictionary(stats)
+
+
+# Server messages of errors that may succeed when retried; anything else (unknown
+# band, invalid geometry, ...) fails the same way every time
+TRANSIENT_ERRORS = (
+    'too many concurrent aggregations', 'quota', 'rate limit', '429', 'too many requests',
+    'timed out', 'timeout', 'deadline', '503', 'service unavailable', 'internal error'
+)
+
+
+def is_transient(error):
+    message = str(error).lower()
+    return any(text in message for text in TRANSIENT_ERRORS)
+
+
+def reduce_tile(image, roi_geometry, cell, scale, histograms=None, retries=3, backoff=1.0):
+    """Reduce one grid cell, retrying transient errors with exponential backoff"""
+    geometry = roi_geometry.intersection(ee.Geometry.Rectangle(list(cell), 'EPSG:4326', False), ee.ErrorMargin(1))
+    for attempt in range(retries + 1):
+        try:
+            return tile_dictionary(image, geometry, scale, histograms).getInfo()
+        except ee.EEException as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+# =============================================
+# Merging Partial Results
+# =============================================
+def merge_partials(partials, bands):
+    """Combine per-tile moments and histograms into exact global statistics"""
+    merged = {}
+    for band in bands:
+        count = total = squares = 0.0
+        low, high = math.inf, -math.inf
+        histogram = None
+        for partial in partials:
+            n = partial.get(f'{band}_count') or 0
+            if n:
+                count += n
+                total += partial.get(f'{band}_sum') or 0
+                squares += partial.get(f'{band}__sq_sum') or 0
+                low = min(low, partial[f'{band}_min'])
+                high = max(high, partial[f'{band}_max'])
+            rows = partial.get(f'{band}__histogram')
+            if rows:
+                if histogram is None:
+                    histogram = [[row[0], 0] for row in rows]
+                for merged_row, row in zip(histogram, rows):
+                    merged_row[1] += row[1]
+        if not count:
+            merged[band] = {'count': 0}
+            continue
+        mean = total / count
+        variance = max(0.0, squares / count - mean * mean)
+        merged[band] = {
+            'count': int(count),
+            'mean': mean,
+            'min': low,
+            'max': high,
+            'stdDev': math.sqrt(variance),
+            'sum': total
+        }
+        if histogram is not None:
+            merged[band]['histogram'] = histogram
+            merged[band].update(histogram_percentiles(histogram))
+    return merged
+
+
+def histogram_percentiles(histogram, percentiles=(10, 50, 90)):
+    """Percentiles interpolated from [bucket_min, count] rows of a fixed histogram"""
+    total = sum(count for _, count in histogram)
+    if not total:
+        return {}
+    width = histogram[1][0] - histogram[0][0] if len(histogram) > 1 else 0
+    result = {}
+    for pct in percentiles:
+        target = total * pct / 100
+        running = 0
+        for bucket_min, count in histogram:
+            if count and running + count >= target:
+                result[f'p{pct}'] = bucket_min + width * (target - running) / count
+                break
+            running += count
+    return result
+
+# =============================================
+# Chunked Reduction Engine
+# =============================================
+def chunked_stats(image, roi, scale, bands, histograms=None, max_tile_pixels=DEFAULT_TILE_PIXELS,
+                  max_workers=4, retries=3, progress=None):
+    """Exact per-band statistics over a large ROI, reduced tile by tile in parallel
+
+    ``roi`` is the drawn GeoJSON geometry. At most ``max_workers`` tiles are in
+    flight at once, and ``progress(done, total)`` is called as tiles complete.
+    """
+    image = image.select(bands).toDouble()  # Squares of raw DN would lose precision as float
+    roi_geometry = ee.Geometry(roi)
+    cells = grid_tiles(geojson_bounds(roi), scale, max_tile_pixels)
+    partials = []
+    if progress is not None:
+        progress(0, len(cells))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(reduce_tile, image, roi_geometry, cell, scale, histograms, retries)
+                   for cell in cells]
+        for future in as_completed(futures):
+            partials.append(future.result())
+            if progress is not None:
+                progress(len(partials), len(cells))
+    return {'bands': list(bands), 'tiles': len(cells), 'stats': merge_partials(partials, bands)}
+
+
+def region_stats(image, roi, config, max_single_pixels=DEFAULT_TILE_PIXELS, progress=None, **kwargs):
+    """Band and index statistics at the satellite's native scale
+
+    Small ROIs take the single combined round-trip from ``image_stats``; ROIs
+    larger than ``max_single_pixels`` go through the chunked engine. Both return
+    the same structure, including p10/p50/p90; the chunked engine interpolates
+    them from fixed histograms over the index range and ``reflectance_range``.
+    """
+    scale = config['scale']
+    if estimate_pixels(roi, scale) <= max_single_pixels:
+        return compute_image_stats(image.select(config['bands']), ee.Geometry(roi), config['common'], scale=scale)
+
+    indices = ['NDVI', 'NDWI']
+    low, high = config.get('reflectance_range', (0.0, 1.0))
+    histograms = {name: (-1, 1, 200) for name in indices}
+    histograms.update({band: (low, high, 400) for band in config['bands']})
+    result = chunked_stats(
+        add_indices(image, config['common']), roi, scale, config['bands'] + indices,
+        histograms=histograms, progress=progress, **kwargs
+    )
+    west, south, east, north = geojson_bounds(roi)
+    return {
+        'bands': config['bands'],
+        'stats': {band: result['stats'][band] for band in config['bands']},
+        'indices': {name: result['stats'][name] for name in indices},
+        'bounds': {
+            'type': 'Polygon',
+            'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]]
+        },
+        'tiles': result['tiles']
+    }
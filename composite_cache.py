@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from tracing import tracer
+
+# =============================================
+# Cache Keys
+# =============================================
+def roi_hash(geojson):
+    """Stable hash of a drawn GeoJSON geometry (key order and float noise ignored)"""
+    def normalize(value):
+        if isinstance(value, float):
+            return round(value, 9)
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in value.items()}
+        return value
+
+    canonical = json.dumps(normalize(geojson), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def composite_key(satellite, start, end, cloud_cover, geojson, **extra):
+    """Canonical key for a composite: (satellite, date range, cloud threshold, ROI hash)"""
+    params = {
+        'satellite': satellite,
+        'start': str(start),
+        'end': str(end),
+        'cloud_cover': cloud_cover,
+        'roi': roi_hash(geojson),
+        **{k: v for k, v in extra.items() if v is not None}
+    }
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+# =============================================
+# In-Memory LRU/TTL Cache
+# =============================================
+class LRUCache:
+    """Size-bounded LRU cache with optional per-entry time-to-live"""
+
+    def __init__(self, max_entries=64, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+# =============================================
+# Composite and Statistics Cache
+# =============================================
+class CompositeCache:
+    """Memoizes composites and their statistics, with an optional on-disk stats tier
+
+    Composites are server-side ee.Image graphs and only live in memory. Statistics
+    are plain JSON and, when ``disk_dir`` is set, are also written to disk so they
+    survive kernel restarts.
+    """
+
+    def __init__(self, max_entries=32, ttl=3600, disk_dir=None, disk_ttl=None):
+        self.composites = LRUCache(max_entries, ttl)
+        self.stats = LRUCache(max_entries, ttl)
+        self.disk_dir = disk_dir
+        self.disk_ttl = disk_ttl
+        self.disk_hits = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get_composite(self, key, builder):
+        """Return the cached composite for ``key`` or build and store it"""
+        with tracer.span('cache.composite') as span:
+            image = self.composites.get(key)
+            span.set(cache='hit' if image is not None else 'miss')
+            if image is None:
+                image = builder()
+                self.composites.put(key, image)
+            return image
+
+    def get_stats(self, key, builder):
+        """Return cached statistics for ``key``, checking memory, then disk, then building"""
+        with tracer.span('cache.stats') as span:
+            stats = self.stats.get(key)
+            if stats is not None:
+                span.set(cache='hit')
+                return stats
+            stats = self._read_disk(key)
+            if stats is not None:
+                self.disk_hits += 1
+                span.set(cache='disk')
+            else:
+                span.set(cache='miss')
+                stats = builder()
+                self._write_disk(key, stats)
+            self.stats.put(key, stats)
+            return stats
+
+    def invalidate(self, key):
+        self.composites.pop(key)
+        self.stats.pop(key)
+        path = self._disk_path(key)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def summary(self):
+        return {
+            'composites': self.composites.stats(),
+            'stats': {**self.stats.stats(), 'disk_hits': self.disk_hits}
+        }
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.json') if self.disk_dir else None
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.disk_ttl is not None and time.time() - record.get('created', 0) > self.disk_ttl:
+            os.remove(path)
+            return None
+        return record.get('value')
+
+    def _write_disk(self, key, value):
+        path = self._disk_path(key)
+        if not path:
+            return
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'created': time.time(), 'value': value}, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
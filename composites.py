@@ -0,0 +1,94 @@
+import ee
+
+# =============================================
+# Per-Satellite Preprocessing
+# =============================================
+# Each preprocessor masks clouds per pixel, scales to surface reflectance, renames
+# bands to the names in band_config and adds a 'quality' band (higher is clearer)
+# used by the quality mosaic.
+
+LANDSAT_SR_BANDS = ['SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7']
+LANDSAT_QA_MASK = 0b11111  # Fill, dilated cloud, cirrus, cloud, cloud shadow
+
+SCL_CLEAR_CLASSES = [4, 5, 6, 7, 11]  # Vegetation, bare soil, water, unclassified, snow
+
+
+def preprocess_landsat_l2(image, config):
+    """Landsat Collection 2 Level-2: QA_PIXEL cloud/shadow mask and SR scale factors"""
+    qa = image.select('QA_PIXEL')
+    clear = qa.bitwiseAnd(LANDSAT_QA_MASK).eq(0).And(image.select('QA_RADSAT').eq(0))
+    reflectance = image.select(LANDSAT_SR_BANDS).multiply(0.0000275).add(-0.2) \
+        .rename(config['bands'])
+    # Distance to the nearest cloud (ST_CDIST, 0.01 km) ranks pixels for the quality mosaic
+    quality = image.select('ST_CDIST').toFloat().rename('quality')
+    return ee.Image(reflectance.addBands(quality).updateMask(clear)
+                    .copyProperties(image, ['system:time_start']))
+
+
+def preprocess_sentinel2(image, config):
+    """Sentinel-2 L2A: SCL or s2cloudless mask and reflectance scaled by 1/10000"""
+    if config.get('cloud_mask') == 's2cloudless':
+        probability = ee.Image(image.get('cloud_probability')).select('probability')
+        clear = probability.lt(config.get('cloud_probability', 40))
+    else:
+        probability = image.select('MSK_CLDPRB')
+        clear = image.select('SCL').remap(SCL_CLEAR_CLASSES, [1] * len(SCL_CLEAR_CLASSES), 0)
+    reflectance = image.select(config['bands']).divide(10000)
+    quality = ee.Image(100).subtract(probability).toFloat().rename('quality')
+    return ee.Image(reflectance.addBands(quality).updateMask(clear)
+                    .copyProperties(image, ['system:time_start']))
+
+
+PREPROCESSORS = {
+    'landsat_l2': preprocess_landsat_l2,
+    'sentinel2': preprocess_sentinel2,
+}
+
+# =============================================
+# Composite Construction
+# =============================================
+COMPOSITE_METHODS = ['median', 'greenest', 'quality']
+
+
+def build_collection(config, start, end, cloud_cover):
+    """Filtered, cloud-masked and reflectance-scaled collection
+
+    ``cloud_cover`` is a loose scene-level prefilter; clouds that remain are
+    masked per pixel, so partly cloudy scenes still contribute their clear pixels.
+    """
+    collection = ee.ImageCollection(config['collection']) \
+        .filterDate(start, end) \
+        .filter(ee.Filter.lt(config['cloud_property'], cloud_cover))
+    if config.get('cloud_mask') == 's2cloudless':
+        probabilities = ee.ImageCollection('COPERNICUS/S2_CLOUD_PROBABILITY').filterDate(start, end)
+        collection = ee.ImageCollection(ee.Join.saveFirst('cloud_probability').apply(
+            collection, probabilities, ee.Filter.equals(leftField='system:index', rightField='system:index')
+        ))
+    preprocess = PREPROCESSORS[config['preprocess']]
+    return collection.map(lambda image: preprocess(ee.Image(image), config))
+
+
+def composite_collection(collection, config, method='median'):
+    """Reduce a preprocessed collection to one image with the configured bands
+
+    'median' takes the per-pixel median, 'greenest' keeps the pixel with the
+    highest NDVI and 'quality' the pixel farthest from clouds.
+    """
+    if method == 'median':
+        image = collection.median()
+    elif method == 'greenest':
+        common = config['common']
+        image = collection.map(
+            lambda img: img.addBands(img.normalizedDifference([common['NIR'], common['RED']]).rename('greenness'))
+        ).qualityMosaic('greenness')
+    elif method == 'quality':
+        image = collection.qualityMosaic('quality')
+    else:
+        raise ValueError(f"Unknown composite method: {method}")
+    return image.select(config['bands'])
+
+
+def build_composite(config, start, end, cloud_cover, geometry, method='median'):
+    """Cloud-masked composite of the collection clipped to the ROI"""
+    collection = build_collection(config, start, end, cloud_cover).filterBounds(geometry)
+    return composite_collection(collection, config, method).clip(geometry)
@@ -0,0 +1,107 @@
+import functools
+import threading
+import time
+
+import ee
+
+# =============================================
+# Global Earth Engine Rate Limiting
+# =============================================
+# Every server round-trip of the EE client goes through one of these ee.data
+# functions (getInfo -> computeValue, getMapId, getDownloadURL -> getDownloadId, ...).
+# Wrapping them limits all callers in the process: widgets, chat tools, chunked
+# statistics and the CLI alike.
+EE_CALLS = [
+    'computeValue', 'computePixels', 'computeFeatures', 'getMapId', 'getDownloadId',
+    'getThumbId', 'getTableDownloadId', 'getList', 'getInfo', 'listImages', 'getAsset'
+]
+
+
+class RateLimiter:
+    """Token bucket of ``rate`` requests/second (bursts up to ``burst``) plus a concurrency cap"""
+
+    def __init__(self, rate=10.0, burst=None, max_concurrent=10):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.max_concurrent = max_concurrent
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.calls = 0
+        self.waited = 0.0
+        self.in_flight = 0
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        started = time.monotonic()
+        self._slots.acquire()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.calls += 1
+                    self.in_flight += 1
+                    self.waited += now - started
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'in_flight': self.in_flight, 'waited_seconds': round(self.waited, 3),
+                    'rate': self.rate, 'max_concurrent': self.max_concurrent}
+
+
+_originals = {}
+_installed = {}
+_wrappers = {}
+
+
+def wrap_ee_calls(tag, wrapper, names=EE_CALLS):
+    """Install ``wrapper(name, call) -> call`` around the ee.data request functions
+
+    Wrappers are stacked in installation order (the first one is innermost);
+    installing again under the same ``tag`` replaces the earlier wrapper. A
+    function replaced in ee.data since the last installation (e.g. by a replay
+    stub) becomes the new innermost call.
+    """
+    _wrappers[tag] = wrapper
+    for name in names:
+        current = getattr(ee.data, name, None)
+        if current is None:
+            continue
+        if current is not _installed.get(name):
+            _originals[name] = current
+        call = _originals[name]
+        for wrap in _wrappers.values():
+            call = functools.wraps(_originals[name])(wrap(name, call))
+        setattr(ee.data, name, call)
+        _installed[name] = call
+
+
+def limit_ee_calls(limiter, names=EE_CALLS):
+    """Route the ee.data request functions through ``limiter``; calling it again swaps the limiter"""
+
+    def wrapper(name, call):
+        def limited(*args, **kwargs):
+            with limiter:
+                return call(*args, **kwargs)
+        return limited
+
+    wrap_ee_calls('quota', wrapper, names)
+    return limiter
@@ -0,0 +1,277 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import ee
+
+from batch_regions import table_to_context
+from change_detection import change_dictionary, change_images, change_to_context, parse_change_stats
+from chunked_stats import is_transient, region_stats
+from composite_cache import CompositeCache, composite_key, roi_hash
+from composites import build_composite
+from export import export_image, load_export_arrays
+from formula import compile_formula
+from image_stats import build_reducer, split_band_stats
+from local_index import array_region_stats
+from prompt_context import ContextBuilder, band_lines, bounds_line
+from time_series import TimeSeriesEngine, series_to_context
+
+# =============================================
+# Satellite Configuration
+# =============================================
+# The single source of satellite settings for the UI, the CLI and the chat tools.
+BAND_CONFIG = {
+    'Landsat 8': {
+        'collection': 'LANDSAT/LC08/C02/T1_L2',
+        'scale': 30,
+        'cloud_property': 'CLOUD_COVER',
+        'preprocess': 'landsat_l2',
+        'reflectance_range': (-0.2, 1.6),  # Collection 2 scale factors applied to DN 0-65535
+        'bands': ['B2', 'B3', 'B4', 'B5', 'B6', 'B7'],
+        'common': {'BLUE': 'B2', 'GREEN': 'B3', 'RED': 'B4', 'NIR': 'B5'}
+    },
+    'Landsat 9': {
+        'collection': 'LANDSAT/LC09/C02/T1_L2',
+        'scale': 30,
+        'cloud_property': 'CLOUD_COVER',
+        'preprocess': 'landsat_l2',
+        'reflectance_range': (-0.2, 1.6),  # Collection 2 scale factors applied to DN 0-65535
+        'bands': ['B2', 'B3', 'B4', 'B5', 'B6', 'B7'],
+        'common': {'BLUE': 'B2', 'GREEN': 'B3', 'RED': 'B4', 'NIR': 'B5'}
+    },
+    'Sentinel-2': {
+        'collection': 'COPERNICUS/S2_SR_HARMONIZED',
+        'scale': 10,
+        'cloud_property': 'CLOUDY_PIXEL_PERCENTAGE',
+        'preprocess': 'sentinel2',
+        'cloud_mask': 'scl',  # or 's2cloudless'
+        'reflectance_range': (0.0, 1.6),
+        'bands': ['B2', 'B3', 'B4', 'B8', 'B11', 'B12'],
+        'common': {'BLUE': 'B2', 'GREEN': 'B3', 'RED': 'B4', 'NIR': 'B8'}
+    }
+}
+
+INDEX_FORMULAS = {
+    'NDVI': '(NIR - RED) / (NIR + RED)',
+    'NDWI': '(GREEN - NIR) / (GREEN + NIR)',
+    'EVI': '2.5 * (NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1)',
+    'SAVI': '1.5 * (NIR - RED) / (NIR + RED + 0.5)',
+}
+
+
+def initialize_earth_engine(service_account=None, key_file=None):
+    """Initialize EE with a service account key, or with the default credentials"""
+    if service_account and key_file:
+        ee.Initialize(ee.ServiceAccountCredentials(service_account, key_file))
+    else:
+        ee.Initialize()
+
+# =============================================
+# Session State
+# =============================================
+class AnalysisState:
+    """What one user currently has loaded: composite, ROI and derived results
+
+    ``change`` is the latest comparison: index, periods, threshold and statistics.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.roi = None
+        self.image = None
+        self.batch_table = None
+        self.series = None
+        self.series_label = None
+        self.change = None
+
+# =============================================
+# Analysis Engine
+# =============================================
+class AnalysisEngine:
+    """Composites, index and band statistics, time series and chat context without any UI
+
+    Composites and statistics are memoized in ``composite_cache`` and series in
+    ``series_engine``, so the widget UI, the chat tools and the CLI share results.
+    Dates may be strings or date objects.
+    """
+
+    def __init__(self, band_config=BAND_CONFIG, composite_cache=None, series_engine=None):
+        self.band_config = band_config
+        self.composite_cache = composite_cache or CompositeCache()
+        self.series_engine = series_engine or TimeSeriesEngine()
+
+    def config(self, satellite):
+        if satellite not in self.band_config:
+            raise ValueError(f"Unknown satellite {satellite!r}; choose from {', '.join(self.band_config)}")
+        return self.band_config[satellite]
+
+    def composite(self, satellite, start, end, cloud_cover, roi, method='median'):
+        """``(key, image)`` of the cloud-masked composite clipped to the ROI"""
+        config = self.config(satellite)
+        start, end = str(start)[:10], str(end)[:10]
+        key = composite_key(satellite, start, end, cloud_cover, roi, method=method)
+        image = self.composite_cache.get_composite(
+            key,
+            lambda: build_composite(config, start, end, cloud_cover, ee.Geometry(roi), method)
+        )
+        return key, image
+
+    def compile_index(self, satellite, formula, aliases=None):
+        """Compile a named index (NDVI, EVI, ...) or a band formula for a satellite"""
+        config = self.config(satellite)
+        formula = INDEX_FORMULAS.get(formula.strip().upper(), formula)
+        return compile_formula(formula, config['bands'], aliases or config['common'])
+
+    def region_stats(self, key, image, roi, satellite, progress=None):
+        """Band and NDVI/NDWI statistics of a composite over its ROI"""
+        config = self.config(satellite)
+        return self.composite_cache.get_stats(
+            roi_hash({'composite': key, 'roi': roi}),
+            lambda: region_stats(image, roi, config, progress=progress)
+        )
+
+    def index_stats(self, key, image, roi, satellite, indices, aliases=None):
+        """Statistics of several indices over the ROI in one reduction, keyed by the given names"""
+        config = self.config(satellite)
+        compiled = {name: self.compile_index(satellite, name, aliases) for name in indices}
+        bands = [f'index_{i}' for i in range(len(compiled))]
+
+        def build():
+            stacked = ee.Image.cat([c.to_ee(image, band) for c, band in zip(compiled.values(), bands)])
+            stats = stacked.reduceRegion(
+                reducer=build_reducer(),
+                geometry=ee.Geometry(roi),
+                scale=config['scale'],
+                bestEffort=True
+            ).getInfo()
+            per_band = split_band_stats(stats, bands)
+            return [per_band.get(band, {}) for band in bands]
+
+        irs = [repr(c.ir) for c in compiled.values()]
+        result = self.composite_cache.get_stats(roi_hash({'composite': key, 'indices': irs}), build)
+        return dict(zip(compiled, result))
+
+    def time_series(self, satellite, start, end, cloud_cover, roi, formula, aliases=None, period='image'):
+        """Sorted ``[(date, value)]`` of an index over the ROI"""
+        compiled = self.compile_index(satellite, formula, aliases)
+        return self.series_engine.series(
+            satellite, self.config(satellite), start, end, cloud_cover, roi,
+            compiled.text, aliases or self.config(satellite)['common'], period=period
+        )
+
+    def change(self, satellite, period_a, period_b, cloud_cover, roi, formula='NDVI', threshold=0.1,
+               aliases=None, method='median'):
+        """``(key, delta, classes)`` comparing the composites of two ``(start, end)`` periods
+
+        Each side comes from the composite cache, so moving one period reuses the
+        other side's graph. Composites are lazy graphs: the server evaluates both
+        sides again for every reduction.
+        """
+        compiled = self.compile_index(satellite, formula, aliases)
+        key_a, image_a = self.composite(satellite, *period_a, cloud_cover, roi, method)
+        key_b, image_b = self.composite(satellite, *period_b, cloud_cover, roi, method)
+        delta, classes = change_images(compiled, image_a, image_b, threshold)
+        key = roi_hash({'change': [key_a, key_b], 'index': repr(compiled.ir), 'threshold': threshold})
+        return key, delta, classes
+
+    def change_stats(self, key, delta, classes, roi, satellite):
+        """Delta statistics and loss/stable/gain areas in hectares over the ROI, from one reduction"""
+        config = self.config(satellite)
+        return self.composite_cache.get_stats(
+            key,
+            lambda: parse_change_stats(change_dictionary(delta, classes, roi, config['scale']).getInfo())
+        )
+
+    def chat_context(self, satellite, start, end, cloud_cover, method, roi, stats=None, state=None,
+                     budget_tokens=768):
+        """Compact chat context from whatever statistics and results are available"""
+        context = ContextBuilder(budget_tokens=budget_tokens)
+        context.add('Data', [
+            f"Satellite: {satellite}, {str(start)[:10]} to {str(end)[:10]}, "
+            f"scene cloud cover < {cloud_cover}%, {method} composite",
+            f"ROI: {bounds_line(roi) if roi else 'not defined'}",
+            f"Image: {'loaded' if state is not None and state.image is not None else 'not loaded'}"
+        ], priority=1)
+        if stats is not None:
+            context.add('Indices (ROI, unitless)', band_lines(stats['indices'], unit='index'), priority=2)
+            context.add('Bands (ROI, surface reflectance)', band_lines(stats['stats']), priority=3)
+        if state is not None and state.series:
+            context.add(f'Time series of {state.series_label} (date: ROI mean)',
+                        [series_to_context(state.series)], priority=4)
+        if state is not None and state.change is not None:
+            context.add('Change detection (ROI)', change_to_context(state.change), priority=4)
+        if state is not None and state.batch_table is not None:
+            context.add('Per-region statistics (CSV)', table_to_context(state.batch_table), priority=5)
+        return context.build()
+
+    def export(self, satellite, start, end, cloud_cover, roi, out_dir, indices=(), method='median',
+               workers=4, progress=None):
+        """Download the composite's bands plus named index bands as a COG; see ``export.export_image``
+
+        The index bands are named after the indices (NDVI, ...) and listed under
+        ``indices``; ``key`` identifies the composite for LocalIndexCalculator.register.
+        The ROI statistics of the composite are computed from the downloaded
+        pixels and cached, so ``region_stats`` needs no further reduction.
+        """
+        config = self.config(satellite)
+        key, image = self.composite(satellite, start, end, cloud_cover, roi, method)
+        for name in indices:
+            image = image.addBands(self.compile_index(satellite, name).to_ee(image, name.strip().upper()))
+        bands = list(config['bands']) + [name.strip().upper() for name in indices]
+        name = f"{satellite.replace(' ', '_')}_{str(start)[:10]}_{str(end)[:10]}_{key[:8]}"
+        os.makedirs(out_dir, exist_ok=True)
+        result = export_image(image, roi, bands, config['scale'], out_dir, name, key,
+                              workers=workers, progress=progress)
+        result.update(key=key, indices=bands[len(config['bands']):])
+        # Statistics of this composite come from the downloaded pixels unless already cached
+        arrays = load_export_arrays(result['array'], bands)
+        self.composite_cache.get_stats(roi_hash({'composite': key, 'roi': roi}),
+                                       lambda: array_region_stats(arrays, config, roi))
+        return result
+
+    # =========================================
+    # Headless Batch Analysis
+    # =========================================
+    def analyze(self, satellite, roi, indices=('NDVI',), start='2023-01-01', end=None, cloud_cover=60,
+                method='median', region=None, band_stats=False):
+        """One flat record of index (and optionally band) statistics for one ROI"""
+        end = end or time.strftime('%Y-%m-%d')
+        key, image = self.composite(satellite, start, end, cloud_cover, roi, method)
+        record = {'region': region, 'satellite': satellite, 'start': str(start)[:10], 'end': str(end)[:10]}
+        for name, stats in self.index_stats(key, image, roi, satellite, list(indices)).items():
+            record.update({f'{name}_{stat}': value for stat, value in stats.items()})
+        if band_stats:
+            result = self.region_stats(key, image, roi, satellite)
+            for band, stats in result['stats'].items():
+                record.update({f'{band}_{stat}': value for stat, value in stats.items()
+                               if stat in ('mean', 'stdDev', 'count')})
+        return record
+
+    def analyze_many(self, jobs, max_workers=8, retries=2, backoff=2.0, progress=None):
+        """Run ``analyze(**job)`` for every job on a worker pool, yielding records as they finish
+
+        Transient failures (quota, timeouts, see ``chunked_stats.is_transient``) are
+        retried with exponential backoff; any failed job is yielded with an 'error'
+        field instead of stopping the batch. ``progress(done, total, failed)`` is
+        called after each job.
+        """
+        jobs = list(jobs)
+        done = failed = 0
+
+        def run(job):
+            for attempt in range(retries + 1):
+                try:
+                    return self.analyze(**job)
+                except Exception as e:
+                    if attempt == retries or not is_transient(e):
+                        return {'region': job.get('region'), 'error': str(e) or repr(e)}
+                    time.sleep(backoff * 2 ** attempt)
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='geemapbot-analyze') as pool:
+            for future in as_completed([pool.submit(run, job) for job in jobs]):
+                record = future.result()
+                done += 1
+                failed += 'error' in record
+                if progress is not None:
+                    progress(done, len(jobs), failed)
+                yield record
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from roi import geojson_bounds
+from tracing import tracer
+
+# =============================================
+# Tile Plan
+# =============================================
+# Exports use one Web Mercator pixel grid. Every tile is requested with an
+# explicit crs_transform and dimensions, so tiles line up exactly and the
+# mosaic needs no resampling. The projected pixel size is scale / cos(latitude)
+# of the ROI centre, which keeps the ground resolution at the sensor's scale.
+EARTH_RADIUS = 6378137.0
+NODATA = -9999.0
+MAX_REQUEST_BYTES = 32 * 1024 * 1024  # getDownloadURL rejects requests above ~48 MB
+MAX_TILE_SIDE = 8192
+
+
+def mercator(lon, lat):
+    x = EARTH_RADIUS * math.radians(lon)
+    y = EARTH_RADIUS * math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+    return x, y
+
+
+def plan_tiles(geojson, scale, n_bands, max_request_bytes=MAX_REQUEST_BYTES):
+    """Pixel grid covering the ROI and its split into download tiles of at most ``max_request_bytes``"""
+    west, south, east, north = geojson_bounds(geojson)
+    pixel = scale / math.cos(math.radians((south + north) / 2))
+    min_x, min_y = mercator(west, south)
+    max_x, max_y = mercator(east, north)
+    x0 = math.floor(min_x / pixel) * pixel
+    y0 = math.ceil(max_y / pixel) * pixel
+    width = max(1, math.ceil((max_x - x0) / pixel))
+    height = max(1, math.ceil((y0 - min_y) / pixel))
+    side = min(MAX_TILE_SIDE, int(math.sqrt(max_request_bytes / (4 * n_bands))))
+    tiles = []
+    for row in range(0, height, side):
+        for col in range(0, width, side):
+            tiles.append({
+                'name': f'tile_{row // side:03d}_{col // side:03d}',
+                'row': row,
+                'col': col,
+                'width': min(side, width - col),
+                'height': min(side, height - row),
+                'transform': [pixel, 0, x0 + col * pixel, 0, -pixel, y0 - row * pixel]
+            })
+    return {'crs': 'EPSG:3857', 'transform': [pixel, 0, x0, 0, -pixel, y0],
+            'width': width, 'height': height, 'tiles': tiles}
+
+# =============================================
+# Resumable Tile Download
+# =============================================
+class TileDownloader:
+    """Fetches tiles through getDownloadURL on a worker pool with one pooled HTTP session
+
+    A finished tile is kept as ``<name>.tif`` and skipped on the next run; an
+    interrupted one is kept as ``<name>.tif.part`` and continued with a Range
+    request when the server supports it.
+    """
+
+    def __init__(self, workers=4, timeout=300, chunk_size=1024 * 1024):
+        self.workers = workers
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def download(self, image, plan, tile_dir, progress=None):
+        os.makedirs(tile_dir, exist_ok=True)
+        pending = [t for t in plan['tiles'] if not os.path.exists(self.tile_path(tile_dir, t))]
+        done, total = len(plan['tiles']) - len(pending), len(plan['tiles'])
+        if progress is not None:
+            progress(done, total)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='geemapbot-export') as pool:
+            futures = [pool.submit(self.fetch, image, plan, tile, tile_dir) for tile in pending]
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+
+    def fetch(self, image, plan, tile, tile_dir):
+        path = self.tile_path(tile_dir, tile)
+        part = path + '.part'
+        with tracer.span('export.tile', tile=tile['name']) as span:
+            url = image.getDownloadURL({
+                'format': 'GEO_TIFF',
+                'crs': plan['crs'],
+                'crs_transform': tile['transform'],
+                'dimensions': f"{tile['width']}x{tile['height']}"
+            })
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                resumed = offset and response.status_code == 206
+                with open(part, 'ab' if resumed else 'wb') as f:
+                    for chunk in response.iter_content(self.chunk_size):
+                        f.write(chunk)
+            span.set(bytes=os.path.getsize(part), resumed=bool(resumed))
+        os.replace(part, path)
+
+    @staticmethod
+    def tile_path(tile_dir, tile):
+        return os.path.join(tile_dir, f"{tile['name']}.tif")
+
+# =============================================
+# Memory-Mapped Mosaic and COG
+# =============================================
+def mosaic_tiles(plan, tile_dir, bands, npy_path):
+    """Write every tile into one (band, row, col) float32 memmap; NODATA pixels become NaN"""
+    import rasterio
+
+    canvas = np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.float32,
+                                       shape=(len(bands), plan['height'], plan['width']))
+    for tile in plan['tiles']:
+        with rasterio.open(TileDownloader.tile_path(tile_dir, tile)) as src:
+            data = src.read(out_dtype=np.float32)
+        data[data == NODATA] = np.nan
+        canvas[:, tile['row']:tile['row'] + tile['height'], tile['col']:tile['col'] + tile['width']] = data
+    canvas.flush()
+    return canvas
+
+
+def write_cog(canvas, plan, bands, path, block=512):
+    """Cloud-Optimized GeoTIFF from the memmap, written block by block and then copied with overviews"""
+    import rasterio
+    from rasterio.shutil import copy as copy_dataset
+    from rasterio.transform import Affine
+    from rasterio.windows import Window
+
+    a, b, c, d, e, f = plan['transform']
+    profile = {
+        'driver': 'GTiff', 'dtype': 'float32', 'count': len(bands), 'nodata': np.nan,
+        'width': plan['width'], 'height': plan['height'], 'crs': plan['crs'],
+        'transform': Affine(a, b, c, d, e, f), 'tiled': True, 'blockxsize': block, 'blockysize': block,
+        'compress': 'deflate', 'BIGTIFF': 'IF_SAFER'
+    }
+    staging = path + '.staging.tif'
+    with rasterio.open(staging, 'w', **profile) as dst:
+        for row in range(0, plan['height'], block):
+            for col in range(0, plan['width'], block):
+                height, width = min(block, plan['height'] - row), min(block, plan['width'] - col)
+                dst.write(canvas[:, row:row + height, col:col + width], window=Window(col, row, width, height))
+        for i, band in enumerate(bands, start=1):
+            dst.set_band_description(i, band)
+    copy_dataset(staging, path, driver='COG', compress='deflate', overview_resampling='average', BIGTIFF='IF_SAFER')
+    os.remove(staging)
+    return path
+
+# =============================================
+# Export
+# =============================================
+def export_fingerprint(key, bands, plan):
+    text = json.dumps({'key': key, 'bands': list(bands), 'transform': plan['transform'],
+                       'tiles': [t['name'] for t in plan['tiles']]}, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def export_image(image, geojson, bands, scale, out_dir, name, key, workers=4, keep_tiles=False, progress=None,
+                 max_request_bytes=MAX_REQUEST_BYTES):
+    """Download ``bands`` of ``image`` over the ROI as ``<out_dir>/<name>.tif`` (COG) plus ``<name>.npy``
+
+    Tiles live in ``<out_dir>/<name>.tiles`` with a manifest; a re-run with the
+    same composite, bands and grid only fetches the missing tiles.
+    ``progress(done, total)`` is called as tiles finish.
+    """
+    plan = plan_tiles(geojson, scale, len(bands), max_request_bytes)
+    tile_dir = os.path.join(out_dir, f'{name}.tiles')
+    manifest_path = os.path.join(tile_dir, 'manifest.json')
+    fingerprint = export_fingerprint(key, bands, plan)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            if json.load(f).get('fingerprint') != fingerprint:
+                shutil.rmtree(tile_dir)  # Different composite or grid: old tiles do not fit
+    os.makedirs(tile_dir, exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'fingerprint': fingerprint, 'key': key, 'bands': list(bands), 'plan': plan}, f)
+
+    prepared = image.select(bands).toFloat().unmask(NODATA)
+    TileDownloader(workers=workers).download(prepared, plan, tile_dir, progress)
+
+    npy_path = os.path.join(out_dir, f'{name}.npy')
+    with tracer.span('export.mosaic', tiles=len(plan['tiles'])):
+        canvas = mosaic_tiles(plan, tile_dir, bands, npy_path)
+        path = write_cog(canvas, plan, bands, os.path.join(out_dir, f'{name}.tif'))
+    with open(os.path.join(out_dir, f'{name}.json'), 'w', encoding='utf-8') as f:
+        json.dump({'key': key, 'bands': list(bands), 'crs': plan['crs'], 'transform': plan['transform'],
+                   'width': plan['width'], 'height': plan['height'], 'cog': path, 'array': npy_path}, f)
+    if not keep_tiles:
+        shutil.rmtree(tile_dir)
+    return {'path': path, 'array': npy_path, 'bands': list(bands), 'width': plan['width'],
+            'height': plan['height'], 'tiles': len(plan['tiles'])}
+
+
+def load_export_arrays(npy_path, bands):
+    """Band arrays of an export as read-only memmaps, in the form LocalIndexCalculator uses"""
+    canvas = np.load(npy_path, mmap_mode='r')
+    return {band: canvas[i] for i, band in enumerate(bands)}
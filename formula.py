@@ -0,0 +1,295 @@
+import ast
+import functools
+import operator
+
+import ee
+import numpy as np
+
+# =============================================
+# Safe Formula Parsing
+# =============================================
+# Index formulas use the arithmetic subset of ee.Image.expression syntax:
+# band names or aliases, numbers, + - * / ** %, comparisons, b('B4') and a few
+# functions. Anything else (attributes, subscripts, lambdas, ...) is rejected.
+
+class FormulaError(ValueError):
+    """Raised when an index formula cannot be parsed or uses unknown names"""
+
+
+def _safe_divide(a, b):
+    """Division where a zero denominator gives NaN instead of +/-inf"""
+    return np.where(np.asarray(b) == 0, np.nan, np.true_divide(a, b))
+
+
+def _safe_mod(a, b):
+    return np.where(np.asarray(b) == 0, np.nan, np.mod(a, b))
+
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: _safe_divide,
+    ast.Pow: operator.pow,
+    ast.Mod: _safe_mod,
+}
+
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+COMPARE_OPERATORS = {
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+}
+
+OPERATOR_NODES = tuple(BINARY_OPERATORS) + tuple(UNARY_OPERATORS) + tuple(COMPARE_OPERATORS)
+
+NUMPY_FUNCTIONS = {
+    'abs': np.abs,
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'log': np.log,
+    'log10': np.log10,
+    'min': np.minimum,
+    'max': np.maximum,
+}
+
+FUNCTION_ARITY = {'abs': 1, 'sqrt': 1, 'exp': 1, 'log': 1, 'log10': 1, 'min': 2, 'max': 2}
+
+
+def parse_formula(text):
+    """Parse ``text`` into a validated expression AST"""
+    try:
+        tree = ast.parse(text.strip(), mode='eval')
+    except SyntaxError as e:
+        raise FormulaError(f"Invalid formula syntax at column {e.offset}: {text}") from None
+    band_args = set()
+    for node in ast.walk(tree):
+        _check_node(node)
+        if isinstance(node, ast.Call) and node.func.id == 'b':
+            band_args.add(id(node.args[0]))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in band_args:
+            raise FormulaError(f"Unexpected string in formula: {node.value!r}")
+    return tree
+
+
+def _check_node(node):
+    if isinstance(node, (ast.Expression, ast.Load, ast.Name)):
+        return
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float, str)):
+            raise FormulaError(f"Unsupported constant: {node.value!r}")
+        return
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        return
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        return
+    if isinstance(node, ast.Compare) and all(type(op) in COMPARE_OPERATORS for op in node.ops):
+        if len(node.ops) > 1:
+            raise FormulaError("Chained comparisons are not supported")
+        return
+    if isinstance(node, OPERATOR_NODES):
+        return
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.keywords:
+            raise FormulaError("Only plain function calls are supported")
+        if node.func.id == 'b':
+            if len(node.args) != 1 or not isinstance(node.args[0], ast.Constant) \
+                    or not isinstance(node.args[0].value, str):
+                raise FormulaError("b() takes a single band name, e.g. b('B4')")
+            return
+        if node.func.id not in NUMPY_FUNCTIONS:
+            raise FormulaError(f"Unknown function: {node.func.id}")
+        arity = FUNCTION_ARITY[node.func.id]
+        if len(node.args) != arity:
+            raise FormulaError(f"{node.func.id}() takes {arity} argument{'s' if arity > 1 else ''}, "
+                               f"got {len(node.args)}")
+        return
+    raise FormulaError(f"Unsupported syntax in formula: {type(node).__name__}")
+
+
+def formula_names(tree):
+    """Band names and aliases referenced by a parsed formula"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not _is_function_name(tree, node):
+            names.add(node.id)
+        elif isinstance(node, ast.Call) and node.func.id == 'b':
+            names.add(node.args[0].value)
+    return names
+
+
+def _is_function_name(tree, name_node):
+    return any(isinstance(n, ast.Call) and n.func is name_node for n in ast.walk(tree))
+
+# =============================================
+# Formula Compiler
+# =============================================
+# A validated formula is lowered to a small tuple IR with every alias resolved to
+# a band name and constant subexpressions folded:
+#   ('const', value) | ('band', name) | ('binary', op, left, right)
+#   ('unary', op, operand) | ('compare', op, left, right) | ('call', name, args)
+
+EE_BINARY_METHODS = {
+    ast.Add: 'add',
+    ast.Sub: 'subtract',
+    ast.Mult: 'multiply',
+    ast.Div: 'divide',
+    ast.Pow: 'pow',
+    ast.Mod: 'mod',
+}
+
+EE_COMPARE_METHODS = {
+    ast.Lt: 'lt',
+    ast.LtE: 'lte',
+    ast.Gt: 'gt',
+    ast.GtE: 'gte',
+    ast.Eq: 'eq',
+    ast.NotEq: 'neq',
+}
+
+EE_FUNCTIONS = {
+    'abs': 'abs',
+    'sqrt': 'sqrt',
+    'exp': 'exp',
+    'log': 'log',
+    'log10': 'log10',
+    'min': 'min',
+    'max': 'max',
+}
+
+
+class CompiledFormula:
+    """A validated, constant-folded formula that can run locally or on Earth Engine"""
+
+    def __init__(self, text, ir, bands):
+        self.text = text
+        self.ir = ir
+        self.bands = bands
+
+    def evaluate(self, arrays):
+        """Evaluate over NumPy band arrays; division by zero and invalid operations yield NaN"""
+        def visit(node):
+            kind = node[0]
+            if kind == 'const':
+                return np.float64(node[1])
+            if kind == 'band':
+                return arrays[node[1]]
+            if kind == 'binary':
+                return BINARY_OPERATORS[node[1]](visit(node[2]), visit(node[3]))
+            if kind == 'unary':
+                return UNARY_OPERATORS[node[1]](visit(node[2]))
+            if kind == 'compare':
+                return np.asarray(COMPARE_OPERATORS[node[1]](visit(node[2]), visit(node[3])), dtype=float)
+            return NUMPY_FUNCTIONS[node[1]](*[visit(arg) for arg in node[2]])
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            result = np.asarray(visit(self.ir), dtype=float)
+            result[~np.isfinite(result)] = np.nan
+        return result
+
+    def to_ee(self, image, name='index'):
+        """Build the equivalent ee.Image operator graph (bands are cast to float)"""
+        selected = {band: image.select(band).toFloat() for band in self.bands}
+
+        def as_image(value):
+            return value if isinstance(value, ee.Image) else ee.Image.constant(value)
+
+        def visit(node):
+            kind = node[0]
+            if kind == 'const':
+                return node[1]
+            if kind == 'band':
+                return selected[node[1]]
+            if kind == 'binary':
+                return getattr(as_image(visit(node[2])), EE_BINARY_METHODS[node[1]])(visit(node[3]))
+            if kind == 'unary':
+                operand = as_image(visit(node[2]))
+                return operand.multiply(-1) if node[1] is ast.USub else operand
+            if kind == 'compare':
+                return getattr(as_image(visit(node[2])), EE_COMPARE_METHODS[node[1]])(visit(node[3]))
+            args = [visit(arg) for arg in node[2]]
+            return getattr(as_image(args[0]), EE_FUNCTIONS[node[1]])(*args[1:])
+
+        return as_image(visit(self.ir)).rename(name)
+
+
+def compile_formula(text, bands, aliases=None):
+    """Parse, validate against ``bands`` and ``aliases``, and constant-fold a formula
+
+    Compiled formulas are kept in an LRU cache, so re-running an unchanged formula
+    costs a dictionary lookup.
+    """
+    aliases = tuple(sorted((aliases or {}).items()))
+    return _compile_cached(text.strip(), tuple(bands), aliases)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_cached(text, bands, aliases):
+    tree = parse_formula(text)
+    alias_map = dict(aliases)
+    unknown = sorted(name for name in formula_names(tree)
+                     if alias_map.get(name, name) not in bands)
+    if unknown:
+        available = ', '.join(list(alias_map) + list(bands))
+        raise FormulaError(f"Unknown band or alias: {', '.join(unknown)} (available: {available})")
+
+    used = []
+
+    def band(name):
+        resolved = alias_map.get(name, name)
+        if resolved not in used:
+            used.append(resolved)
+        return ('band', resolved)
+
+    def lower(node):
+        if isinstance(node, ast.Expression):
+            return lower(node.body)
+        if isinstance(node, ast.Constant):
+            return ('const', float(node.value))
+        if isinstance(node, ast.Name):
+            return band(node.id)
+        if isinstance(node, ast.BinOp):
+            return _fold(('binary', type(node.op), lower(node.left), lower(node.right)))
+        if isinstance(node, ast.UnaryOp):
+            return _fold(('unary', type(node.op), lower(node.operand)))
+        if isinstance(node, ast.Compare):
+            return _fold(('compare', type(node.ops[0]), lower(node.left), lower(node.comparators[0])))
+        if node.func.id == 'b':
+            return band(node.args[0].value)
+        return _fold(('call', node.func.id, tuple(lower(arg) for arg in node.args)))
+
+    ir = lower(tree)
+    return CompiledFormula(text, ir, tuple(used))
+
+
+def _fold(node):
+    """Replace an operation whose operands are all constants by its value"""
+    operands = node[2:] if node[0] != 'call' else node[2]
+    if not all(operand[0] == 'const' for operand in operands):
+        return node
+    if node[0] == 'binary' and node[1] in (ast.Div, ast.Mod) and operands[1][1] == 0:
+        raise FormulaError("Division by zero in formula")
+    value = CompiledFormula('', node, ()).evaluate({})
+    if not np.isfinite(value):
+        raise FormulaError("Formula contains a constant expression that is not a finite number")
+    return ('const', float(value))
+
+
+# =============================================
+# Vectorized NumPy Evaluation
+# =============================================
+def evaluate(text, arrays, aliases=None):
+    """Evaluate a formula over NumPy band arrays
+
+    ``arrays`` maps band names to arrays and ``aliases`` maps formula names such
+    as NIR to band names. Division by zero and invalid operations yield NaN.
+    """
+    return compile_formula(text, tuple(arrays), aliases).evaluate(arrays)
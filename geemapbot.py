@@ -0,0 +1,119 @@
+import argparse
+import os
+import sys
+from datetime import date
+
+from batch_regions import export_table, load_regions, records_to_table
+from composite_cache import CompositeCache
+from composites import COMPOSITE_METHODS
+from engine import BAND_CONFIG, AnalysisEngine, initialize_earth_engine
+
+# =============================================
+# Command-Line Interface
+# =============================================
+# python geemapbot.py analyze --satellite "Sentinel-2" --roi fields.geojson --index NDVI
+#
+# Every feature of the ROI file is one job; jobs run on a worker pool and one
+# row per feature is written as CSV (stdout or --output) or Parquet.
+#
+# python geemapbot.py export --satellite "Sentinel-2" --roi field.geojson --index NDVI --out-dir exports
+#
+# Downloads the composite of every feature as a Cloud-Optimized GeoTIFF; run it
+# again after an interruption and only the missing tiles are fetched.
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='geemapbot', description='Headless GeeMapBot analysis')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    analyze = commands.add_parser('analyze', help='Index statistics for every feature of an ROI file')
+    analyze.add_argument('--satellite', choices=list(BAND_CONFIG), default='Landsat 8')
+    analyze.add_argument('--roi', required=True, help='GeoJSON file or shapefile; one job per feature')
+    analyze.add_argument('--index', action='append', dest='indices',
+                         help='NDVI, NDWI, EVI, SAVI or a band formula; repeat for several (default NDVI)')
+    analyze.add_argument('--start', default='2023-01-01', help='YYYY-MM-DD')
+    analyze.add_argument('--end', default=date.today().isoformat(), help='YYYY-MM-DD')
+    analyze.add_argument('--cloud-cover', type=int, default=60, help='Maximum scene cloud cover in percent')
+    analyze.add_argument('--method', choices=COMPOSITE_METHODS, default='median')
+    analyze.add_argument('--band-stats', action='store_true', help='Also report per-band mean/stdDev/count')
+    analyze.add_argument('--workers', type=int, default=8)
+    analyze.add_argument('--retries', type=int, default=2)
+    analyze.add_argument('--output', help='.csv or .parquet file; CSV on stdout when omitted')
+    analyze.add_argument('--service-account', default=os.environ.get('GEEMAPBOT_EE_SERVICE_ACCOUNT'))
+    analyze.add_argument('--key-file', default=os.environ.get('GEEMAPBOT_EE_KEY_FILE'))
+    analyze.add_argument('--cache-dir', default=os.environ.get('GEEMAPBOT_CACHE_DIR'),
+                         help='Keep statistics on disk so re-runs skip finished ROIs')
+
+    export = commands.add_parser('export', help='Full-resolution GeoTIFF of the composite for every feature')
+    export.add_argument('--satellite', choices=list(BAND_CONFIG), default='Landsat 8')
+    export.add_argument('--roi', required=True, help='GeoJSON file or shapefile; one GeoTIFF per feature')
+    export.add_argument('--index', action='append', dest='indices', default=[],
+                        help='Add an index band (NDVI, NDWI, EVI, SAVI); repeat for several')
+    export.add_argument('--start', default='2023-01-01', help='YYYY-MM-DD')
+    export.add_argument('--end', default=date.today().isoformat(), help='YYYY-MM-DD')
+    export.add_argument('--cloud-cover', type=int, default=60, help='Maximum scene cloud cover in percent')
+    export.add_argument('--method', choices=COMPOSITE_METHODS, default='median')
+    export.add_argument('--workers', type=int, default=4, help='Tiles downloaded in parallel')
+    export.add_argument('--out-dir', default='exports')
+    export.add_argument('--service-account', default=os.environ.get('GEEMAPBOT_EE_SERVICE_ACCOUNT'))
+    export.add_argument('--key-file', default=os.environ.get('GEEMAPBOT_EE_KEY_FILE'))
+    export.add_argument('--cache-dir', default=os.environ.get('GEEMAPBOT_CACHE_DIR'),
+                        help='Keep the statistics of the exported pixels for later analyze runs')
+    return parser
+
+
+def run_analyze(args):
+    initialize_earth_engine(args.service_account, args.key_file)
+    engine = AnalysisEngine(composite_cache=CompositeCache(disk_dir=args.cache_dir))
+    regions = load_regions(args.roi)
+    jobs = [{
+        'satellite': args.satellite,
+        'roi': feature['geometry'],
+        'region': feature['properties']['region'],
+        'indices': args.indices or ['NDVI'],
+        'start': args.start,
+        'end': args.end,
+        'cloud_cover': args.cloud_cover,
+        'method': args.method,
+        'band_stats': args.band_stats
+    } for feature in regions['features']]
+
+    def progress(done, total, failed):
+        print(f'\r{done}/{total} regions, {failed} failed', end='', file=sys.stderr, flush=True)
+
+    records = list(engine.analyze_many(jobs, max_workers=args.workers, retries=args.retries, progress=progress))
+    print(file=sys.stderr)
+    table = records_to_table(records)
+    if args.output:
+        export_table(table, args.output)
+    else:
+        table.to_csv(sys.stdout)
+    return 1 if any('error' in record for record in records) else 0
+
+
+def run_export(args):
+    initialize_earth_engine(args.service_account, args.key_file)
+    engine = AnalysisEngine(composite_cache=CompositeCache(disk_dir=args.cache_dir))
+    for feature in load_regions(args.roi)['features']:
+        region = feature['properties']['region']
+
+        def progress(done, total):
+            print(f'\r{region}: {done}/{total} tiles', end='', file=sys.stderr, flush=True)
+
+        result = engine.export(args.satellite, args.start, args.end, args.cloud_cover, feature['geometry'],
+                               args.out_dir, indices=args.indices, method=args.method,
+                               workers=args.workers, progress=progress)
+        print(file=sys.stderr)
+        print(f"{region}\t{result['path']}\t{result['width']}x{result['height']}")
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'analyze':
+        return run_analyze(args)
+    if args.command == 'export':
+        return run_export(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import ee
+
+# =============================================
+# Combined Statistics Engine
+# =============================================
+# All per-band statistics, the derived indices and the ROI bounds are packed
+# into a single ee.Dictionary so that one getInfo() call fetches everything.
+
+DEFAULT_PERCENTILES = [10, 50, 90]
+
+
+def build_reducer(percentiles=DEFAULT_PERCENTILES):
+    """Combine count, mean, min/max, stdDev and percentiles into one reducer"""
+    return ee.Reducer.count() \
+        .combine(ee.Reducer.mean(), sharedInputs=True) \
+        .combine(ee.Reducer.minMax(), sharedInputs=True) \
+        .combine(ee.Reducer.stdDev(), sharedInputs=True) \
+        .combine(ee.Reducer.percentile(percentiles), sharedInputs=True)
+
+
+def add_indices(image, common):
+    """Append NDVI and NDWI bands computed from the satellite's common band names"""
+    ndvi = image.normalizedDifference([common['NIR'], common['RED']]).rename('NDVI')
+    ndwi = image.normalizedDifference([common['GREEN'], common['NIR']]).rename('NDWI')
+    return image.addBands(ndvi).addBands(ndwi)
+
+
+def build_stats_dictionary(image, geometry, common, scale=30, percentiles=DEFAULT_PERCENTILES):
+    """Build the server-side dictionary holding every statistic for the ROI"""
+    stats = add_indices(image, common).reduceRegion(
+        reducer=build_reducer(percentiles),
+        geometry=geometry,
+        scale=scale,
+        bestEffort=True
+    )
+    return ee.Dictionary({
+        'bands': image.bandNames(),
+        'stats': stats,
+        'bounds': geometry.bounds()
+    })
+
+
+def split_band_stats(stats, bands):
+    """Regroup flat reducer output ('B4_mean', 'NDVI_p50', ...) per band"""
+    grouped = {}
+    # Longest names first so 'B1_' never claims keys belonging to 'B11_'
+    for band in sorted(bands, key=len, reverse=True):
+        prefix = f'{band}_'
+        for key in [k for k in stats if k.startswith(prefix)]:
+            grouped.setdefault(band, {})[key[len(prefix):]] = stats.pop(key)
+    return grouped
+
+
+def compute_image_stats(image, geometry, common, scale=30, percentiles=DEFAULT_PERCENTILES):
+    """Fetch bands, statistics, indices and bounds in a single round-trip"""
+    result = build_stats_dictionary(image, geometry, common, scale, percentiles).getInfo()
+    bands = result['bands']
+    per_band = split_band_stats(dict(result['stats']), bands + ['NDVI', 'NDWI'])
+    return {
+        'bands': bands,
+        'stats': {band: per_band.get(band, {}) for band in bands},
+        'indices': {name: per_band.get(name, {}) for name in ['NDVI', 'NDWI']},
+        'bounds': result['bounds']
+    }
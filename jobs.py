@@ -0,0 +1,125 @@
+import html
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import ipywidgets as widgets
+
+# =============================================
+# Background Job Runner
+# =============================================
+class JobCancelled(Exception):
+    """Raised inside a job that has been superseded by a newer request"""
+
+
+class Job:
+    """Handle for one submitted unit of work"""
+
+    def __init__(self, key, generation):
+        self.key = key
+        self.generation = generation
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def check(self):
+        """Call from long-running work to stop early once superseded"""
+        if self.cancelled:
+            raise JobCancelled(self.key)
+
+
+class JobRunner:
+    """Runs blocking Earth Engine / LLM work off the kernel's main thread
+
+    Jobs are keyed by the widget that started them: submitting a new job for a
+    key cancels the previous one if it has not started yet, and discards its
+    result if it has. Callbacks only fire for the latest job of each key.
+    """
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='geemapbot')
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, work, on_result=None, on_error=None, status=None, message='Working…'):
+        """Run ``work(job)`` in the pool and hand its result to ``on_result``"""
+        with self._lock:
+            previous = self._latest.get(key)
+            job = Job(key, previous.generation + 1 if previous else 1)
+            self._latest[key] = job
+        if previous is not None:
+            previous.cancel()
+        if status is not None:
+            status.start(message)
+        job.future = self._executor.submit(self._run, job, work, on_result, on_error, status)
+        return job
+
+    def is_current(self, job):
+        with self._lock:
+            return self._latest.get(job.key) is job and not job.cancelled
+
+    def cancel(self, key):
+        with self._lock:
+            job = self._latest.pop(key, None)
+        if job is not None:
+            job.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._latest.values())
+            self._latest.clear()
+        for job in jobs:
+            job.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job, work, on_result, on_error, status):
+        try:
+            job.check()
+            result = work(job)
+        except JobCancelled:
+            return
+        except Exception as e:
+            if self.is_current(job):
+                if status is not None:
+                    status.fail(e)
+                if on_error is not None:
+                    on_error(e)
+                else:
+                    traceback.print_exc()
+            return
+        if not self.is_current(job):
+            return
+        if on_result is not None:
+            on_result(result)
+        if status is not None:
+            status.done()
+
+# =============================================
+# Progress Indicator
+# =============================================
+class JobStatus:
+    """Small HTML label showing whether a widget's job is running, done or failed"""
+
+    def __init__(self):
+        self.widget = widgets.HTML(value='')
+
+    def start(self, message):
+        self.widget.value = f"<span style='color:#007BFF;'>⏳ {message}</span>"
+
+    def done(self, message=''):
+        self.widget.value = f"<span style='color:#155724;'>{message}</span>" if message else ''
+
+    def fail(self, error):
+        self.widget.value = f"<span style='color:#721C24;'>❌ {html.escape(str(error))}</span>"
+
+
+# Shared by every app instance in the kernel
+runner = JobRunner()
@@ -0,0 +1,306 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import httpx
+import ollama
+import requests
+from requests.adapters import HTTPAdapter
+
+from prompt_context import estimate_tokens
+from tracing import tracer
+
+# =============================================
+# Backends
+# =============================================
+# Every backend exposes ``chat(model, messages, stream=False, tools=None, **kwargs)``
+# returning Ollama-shaped responses (or an iterator of chunks when streaming):
+#   {'message': {'role', 'content', 'tool_calls'}, 'done', 'prompt_eval_count',
+#    'prompt_eval_duration', 'eval_count', 'eval_duration'}
+# so stream_chat and ChatSession work with any of them unchanged.
+
+class OllamaBackend:
+    """Ollama through one persistent ``ollama.Client`` (a pooled httpx connection)"""
+
+    name = 'ollama'
+    errors = (ollama.ResponseError, httpx.HTTPError, OSError)
+
+    def __init__(self, host=None, timeout=120):
+        self.client = ollama.Client(host=host, timeout=timeout)
+
+    def chat(self, model, messages, stream=False, tools=None, **kwargs):
+        if tools is not None:
+            kwargs['tools'] = tools
+        return self.client.chat(model=model, messages=messages, stream=stream, **kwargs)
+
+    def warmup(self, model, system=None, keep_alive='30m'):
+        """Load the model into memory and, with ``system``, prefill that prefix"""
+        if system is None:
+            return self.client.chat(model=model, messages=[], keep_alive=keep_alive)
+        return self.client.chat(model=model, messages=[{'role': 'system', 'content': system}],
+                                keep_alive=keep_alive, options={'num_predict': 1})
+
+
+class OpenAICompatibleBackend:
+    """Any server with an OpenAI-style /v1/chat/completions endpoint (llama.cpp, vLLM, LM Studio, ...)
+
+    Requests go through a pooled ``requests.Session``; responses and tool calls
+    are translated to the Ollama shape.
+    """
+
+    name = 'openai'
+    errors = (requests.RequestException,)
+
+    def __init__(self, base_url='http://localhost:8000/v1', api_key=None, timeout=120, pool_size=8):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if api_key:
+            self.session.headers['Authorization'] = f'Bearer {api_key}'
+
+    def chat(self, model, messages, stream=False, tools=None, keep_alive=None, options=None, **kwargs):
+        payload = {'model': model, 'messages': to_openai_messages(messages), 'stream': stream}
+        if tools is not None:
+            payload['tools'] = tools  # Ollama already uses the OpenAI tool schema
+        if options and 'num_predict' in options:
+            payload['max_tokens'] = options['num_predict']
+        if stream:
+            payload['stream_options'] = {'include_usage': True}
+        response = self.session.post(f'{self.base_url}/chat/completions', json=payload,
+                                     timeout=self.timeout, stream=stream)
+        response.raise_for_status()
+        if stream:
+            return self._stream(response)
+        body = response.json()
+        message = body['choices'][0]['message']
+        return ollama_response(message.get('content') or '', parse_tool_calls(message.get('tool_calls')),
+                               body.get('usage'), done=True)
+
+    def warmup(self, model, system=None, keep_alive=None):
+        messages = [{'role': 'system', 'content': system or 'ok'}]
+        return self.chat(model, messages, options={'num_predict': 1})
+
+    def _stream(self, response):
+        pending = {}
+        usage = None
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                event = json.loads(data)
+                usage = event.get('usage') or usage
+                for choice in event.get('choices') or []:
+                    delta = choice.get('delta') or {}
+                    # Tool call arguments arrive as string fragments keyed by index
+                    for call in delta.get('tool_calls') or []:
+                        slot = pending.setdefault(call.get('index', 0), {'name': '', 'arguments': ''})
+                        function = call.get('function') or {}
+                        slot['name'] += function.get('name') or ''
+                        slot['arguments'] += function.get('arguments') or ''
+                    if delta.get('content'):
+                        yield ollama_response(delta['content'], [], None, done=False)
+        calls = [{'function': {'name': c['name'], 'arguments': c['arguments']}} for _, c in sorted(pending.items())]
+        yield ollama_response('', parse_tool_calls(calls), usage, done=True)
+
+
+class FakeBackend:
+    """Deterministic offline backend for tests and benchmarks
+
+    ``reply(messages)`` returns the answer text (default: echo of the last user
+    message) and ``tool_calls(messages)`` an optional list of
+    ``(name, arguments)``. Streaming yields one chunk per word, ``latency``
+    seconds apart. Every request is recorded in ``requests``.
+    """
+
+    name = 'fake'
+    errors = (TimeoutError,)
+
+    def __init__(self, reply=None, tool_calls=None, latency=0.0, fail_models=()):
+        self.reply = reply or (lambda messages: f"Echo: {last_user_content(messages)}")
+        self.tool_calls = tool_calls or (lambda messages: [])
+        self.latency = latency
+        self.fail_models = set(fail_models)
+        self.requests = []
+
+    def chat(self, model, messages, stream=False, tools=None, **kwargs):
+        self.requests.append({'model': model, 'messages': list(messages), 'stream': stream, 'tools': tools})
+        if model in self.fail_models:
+            raise TimeoutError(f"Fake timeout for {model}")
+        calls = [{'function': {'name': name, 'arguments': args}}
+                 for name, args in (self.tool_calls(messages) if tools else [])]
+        text = '' if calls else self.reply(messages)
+        usage = {'prompt_tokens': sum(estimate_tokens(m.get('content') or '') for m in messages),
+                 'completion_tokens': len(text.split())}
+        if not stream:
+            time.sleep(self.latency)
+            return ollama_response(text, calls, usage, done=True)
+        return self._stream(text, calls, usage)
+
+    def warmup(self, model, system=None, keep_alive=None):
+        return self.chat(model, [{'role': 'system', 'content': system or ''}])
+
+    def _stream(self, text, calls, usage):
+        words = text.split(' ')
+        for i, word in enumerate(words):
+            time.sleep(self.latency)
+            yield ollama_response(word if i == 0 else ' ' + word, [], None, done=False)
+        yield ollama_response('', calls, usage, done=True)
+
+
+def ollama_response(content, tool_calls, usage, done):
+    response = {'message': {'role': 'assistant', 'content': content, 'tool_calls': tool_calls or None},
+                'done': done}
+    if usage:
+        response['prompt_eval_count'] = usage.get('prompt_tokens')
+        response['eval_count'] = usage.get('completion_tokens')
+    return response
+
+
+def parse_tool_calls(calls):
+    """OpenAI tool calls (JSON-string arguments) to the Ollama form (dict arguments)"""
+    parsed = []
+    for call in calls or []:
+        function = call['function']
+        arguments = function.get('arguments') or {}
+        if isinstance(arguments, str):
+            arguments = json.loads(arguments) if arguments.strip() else {}
+        parsed.append({'function': {'name': function['name'], 'arguments': arguments}})
+    return parsed
+
+
+def to_openai_messages(messages):
+    """Ollama chat messages to OpenAI ones, pairing tool results with call ids by order"""
+    converted = []
+    call_ids = deque()
+    for i, message in enumerate(messages):
+        if message.get('tool_calls'):
+            calls = []
+            for j, call in enumerate(message['tool_calls']):
+                call_id = f'call_{i}_{j}'
+                call_ids.append(call_id)
+                calls.append({'id': call_id, 'type': 'function', 'function': {
+                    'name': call['function']['name'],
+                    'arguments': json.dumps(call['function']['arguments'])
+                }})
+            converted.append({'role': 'assistant', 'content': message.get('content') or '', 'tool_calls': calls})
+        elif message['role'] == 'tool':
+            converted.append({'role': 'tool', 'content': message['content'],
+                              'tool_call_id': call_ids.popleft() if call_ids else 'call_0'})
+        else:
+            converted.append({'role': message['role'], 'content': message['content']})
+    return converted
+
+
+def last_user_content(messages):
+    for message in reversed(messages):
+        if message['role'] == 'user':
+            return message['content']
+    return ''
+
+# =============================================
+# Fallback and Latency Recording
+# =============================================
+class LLMClient:
+    """A backend plus fallback to a smaller model and per-request latency records
+
+    If a request to ``model`` fails with one of the backend's errors (timeout,
+    connection refused, model missing) before any output, it is retried once with
+    ``fallback_model``. Each request appends a record to ``latencies``.
+    """
+
+    def __init__(self, backend, fallback_model=None, max_records=500):
+        self.backend = backend
+        self.fallback_model = fallback_model
+        self.latencies = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def chat(self, model, messages, stream=False, **kwargs):
+        models = [model] + ([self.fallback_model] if self.fallback_model and self.fallback_model != model else [])
+        for attempt, name in enumerate(models):
+            started = time.perf_counter()
+            try:
+                response = self.backend.chat(name, messages, stream=stream, **kwargs)
+                if not stream:
+                    self._record(name, started, None, response, attempt > 0, stream)
+                    return response
+                # Fall back only if the stream fails before its first chunk
+                chunks = iter(response)
+                first = next(chunks)
+                return self._stream(name, started, first, chunks, attempt > 0)
+            except self.backend.errors as e:
+                self._record(name, started, None, None, attempt > 0, stream, error=e)
+                if attempt == len(models) - 1:
+                    raise
+
+    def warmup(self, model, system=None, keep_alive='30m'):
+        started = time.perf_counter()
+        try:
+            self.backend.warmup(model, system=system, keep_alive=keep_alive)
+        except self.backend.errors as e:
+            self._record(model, started, None, None, False, False, error=e, kind='warmup')
+            return False
+        self._record(model, started, None, None, False, False, kind='warmup')
+        return True
+
+    def latency_summary(self):
+        """Request count and p50/p95 total latency per model"""
+        summary = {}
+        with self._lock:
+            records = [r for r in self.latencies if r['kind'] == 'chat' and r['error'] is None]
+        for model in sorted({r['model'] for r in records}):
+            totals = sorted(r['total'] for r in records if r['model'] == model)
+            summary[model] = {
+                'requests': len(totals),
+                'p50': totals[len(totals) // 2],
+                'p95': totals[min(len(totals) - 1, int(len(totals) * 0.95))]
+            }
+        return summary
+
+    def _stream(self, model, started, first, chunks, fallback):
+        first_at = time.perf_counter()
+        last = first
+        yield first
+        for chunk in chunks:
+            last = chunk
+            yield chunk
+        self._record(model, started, first_at, last, fallback, True)
+
+    def _record(self, model, started, first_at, response, fallback, stream, error=None, kind='chat'):
+        now = time.perf_counter()
+        record = {
+            'kind': kind,
+            'backend': self.backend.name,
+            'model': model,
+            'stream': stream,
+            'fallback': fallback,
+            'total': now - started,
+            'first_token': first_at - started if first_at is not None else None,
+            'prompt_tokens': response.get('prompt_eval_count') if response is not None else None,
+            'error': repr(error) if error is not None else None
+        }
+        with self._lock:
+            self.latencies.append(record)
+        tracer.record(f'llm.{kind}', record['total'], error=error, model=model, backend=self.backend.name,
+                      stream=stream, fallback=fallback, first_token=record['first_token'],
+                      prompt_tokens=record['prompt_tokens'])
+
+
+def backend_from_env():
+    """Backend selected by GEEMAPBOT_LLM_BACKEND (ollama, openai or fake) and GEEMAPBOT_LLM_URL"""
+    kind = os.environ.get('GEEMAPBOT_LLM_BACKEND', 'ollama')
+    url = os.environ.get('GEEMAPBOT_LLM_URL')
+    timeout = float(os.environ.get('GEEMAPBOT_LLM_TIMEOUT', 120))
+    if kind == 'openai':
+        return OpenAICompatibleBackend(url or 'http://localhost:8000/v1',
+                                       api_key=os.environ.get('GEEMAPBOT_LLM_API_KEY'), timeout=timeout)
+    if kind == 'fake':
+        return FakeBackend()
+    return OllamaBackend(host=url, timeout=timeout)
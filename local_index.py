@@ -0,0 +1,200 @@
+import html
+import math
+
+import ee
+import numpy as np
+
+from chunked_stats import merge_partials
+from composite_cache import LRUCache
+from formula import CompiledFormula, compile_formula
+from roi import estimate_pixels, geojson_bounds
+
+# =============================================
+# Band Array Download
+# =============================================
+MAX_SAMPLE_PIXELS = 262144  # Earth Engine's sampleRectangle limit
+NODATA = -9999
+
+
+def sample_scale(geojson, scale, max_pixels=MAX_SAMPLE_PIXELS):
+    """Coarsen ``scale`` until the ROI's bounding box fits in one sampleRectangle"""
+    pixels = estimate_pixels(geojson, scale)
+    if pixels <= max_pixels:
+        return scale
+    return scale * math.ceil(math.sqrt(pixels / max_pixels) * 100) / 100
+
+
+def mercator_scale(geojson, scale):
+    """Web Mercator units per pixel for ``scale`` ground meters at the ROI's centre latitude"""
+    west, south, east, north = geojson_bounds(geojson)
+    return scale / math.cos(math.radians((south + north) / 2))
+
+
+def fetch_band_arrays(image, geojson, bands, scale):
+    """Download the clipped bands once as NumPy arrays (masked pixels become NaN)"""
+    geometry = ee.Geometry(geojson)
+    # Mercator units grow as 1/cos(latitude); without the correction a high-latitude
+    # ROI would have 1/cos²(latitude) times the pixels sample_scale planned for
+    sampled = image.select(bands) \
+        .reproject(crs='EPSG:3857', scale=mercator_scale(geojson, sample_scale(geojson, scale))) \
+        .sampleRectangle(region=geometry, defaultValue=NODATA) \
+        .getInfo()['properties']
+    arrays = {}
+    for band in bands:
+        array = np.asarray(sampled[band], dtype=float)
+        array[array == NODATA] = np.nan
+        arrays[band] = array
+    return arrays
+
+# =============================================
+# Local Index Calculator
+# =============================================
+def summarize(values, bins=50, value_range=None):
+    """Statistics and histogram of the finite values of an index array"""
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return {'count': 0, 'stats': {}, 'histogram': {'counts': [], 'edges': []}}
+    counts, edges = np.histogram(finite, bins=bins, range=value_range)
+    p10, p50, p90 = np.percentile(finite, [10, 50, 90])
+    return {
+        'count': int(finite.size),
+        'stats': {
+            'mean': float(finite.mean()),
+            'stdDev': float(finite.std()),
+            'min': float(finite.min()),
+            'max': float(finite.max()),
+            'p10': float(p10),
+            'p50': float(p50),
+            'p90': float(p90)
+        },
+        'histogram': {'counts': counts.tolist(), 'edges': edges.tolist()}
+    }
+
+
+class LocalIndexCalculator:
+    """Evaluates index formulas locally over band arrays downloaded once per composite
+
+    Arrays are cached per composite key and summaries per (composite, formula,
+    aliases), so editing and re-running a formula needs no Earth Engine requests.
+    """
+
+    def __init__(self, max_composites=4, max_results=64):
+        self.arrays = LRUCache(max_composites)
+        self.results = LRUCache(max_results)
+
+    def load(self, key, image, geojson, bands, scale):
+        """Band arrays of ``key``, downloaded at the satellite's ``scale`` (coarsened for large ROIs)"""
+        arrays = self.arrays.get(key)
+        if arrays is None:
+            arrays = fetch_band_arrays(image, geojson, bands, scale)
+            self.arrays.put(key, arrays)
+        return arrays
+
+    def register(self, key, arrays):
+        """Use band arrays obtained elsewhere, e.g. the memmaps of a full-resolution export
+
+        Summaries computed from the previous arrays of ``key`` are dropped.
+        """
+        self.arrays.put(key, arrays)
+        for result_key in self.results.keys():
+            if result_key[0] == key:
+                self.results.pop(result_key)
+
+    def compute(self, key, formula, aliases=None, bins=50, value_range=None):
+        """Summary of ``formula`` over the arrays loaded for ``key``
+
+        ``formula`` is a band formula or a CompiledFormula, e.g. a named index
+        resolved by ``AnalysisEngine.compile_index``.
+        """
+        arrays = self.arrays.get(key)
+        if arrays is None:
+            raise KeyError("Band arrays are not loaded for this composite")
+        if isinstance(formula, CompiledFormula):
+            compiled = formula
+        else:
+            compiled = compile_formula(formula, tuple(arrays), aliases)
+        # Keyed by the compiled form, so equivalent spellings share one result
+        result_key = (key, compiled.ir, bins, value_range)
+        summary = self.results.get(result_key)
+        if summary is None:
+            summary = summarize(compiled.evaluate(arrays), bins, value_range)
+            self.results.put(result_key, summary)
+        return summary
+
+
+def block_partial(name, values, histogram=None):
+    """Moments (and a fixed histogram) of one block, in the form ``chunked_stats.merge_partials`` merges"""
+    finite = values[np.isfinite(values)].astype(np.float64)
+    partial = {f'{name}_count': int(finite.size)}
+    if finite.size:
+        partial.update({f'{name}_sum': float(finite.sum()), f'{name}__sq_sum': float(np.dot(finite, finite)),
+                        f'{name}_min': float(finite.min()), f'{name}_max': float(finite.max())})
+    if histogram is not None:
+        low, high, steps = histogram
+        counts, edges = np.histogram(finite, bins=steps, range=(low, high))
+        partial[f'{name}__histogram'] = [[float(edge), int(count)] for edge, count in zip(edges, counts)]
+    return partial
+
+
+def array_region_stats(arrays, config, geojson, block_pixels=1024 * 1024):
+    """Band and NDVI/NDWI statistics from full-resolution arrays, shaped like ``region_stats``
+
+    The arrays (usually memmaps of an export) are read in blocks of rows of at
+    most ``block_pixels`` and the per-block moments and histograms are merged as
+    in the chunked engine, so memory stays bounded by the block size.
+    """
+    indices = {name: compile_formula(formula, tuple(arrays), config['common'])
+               for name, formula in (('NDVI', '(NIR - RED) / (NIR + RED)'), ('NDWI', '(GREEN - NIR) / (GREEN + NIR)'))}
+    low, high = config.get('reflectance_range', (0.0, 1.0))
+    histograms = {name: (-1, 1, 200) for name in indices}
+    histograms.update({band: (low, high, 400) for band in config['bands']})
+
+    height, width = arrays[config['bands'][0]].shape
+    rows = max(1, block_pixels // max(1, width))
+    partials = []
+    for row in range(0, height, rows):
+        block = {band: arrays[band][row:row + rows] for band in arrays}
+        partial = {}
+        for band in config['bands']:
+            partial.update(block_partial(band, block[band], histograms[band]))
+        for name, compiled in indices.items():
+            partial.update(block_partial(name, compiled.evaluate(block), histograms[name]))
+        partials.append(partial)
+    merged = merge_partials(partials, list(config['bands']) + list(indices))
+
+    west, south, east, north = geojson_bounds(geojson)
+    return {
+        'bands': list(config['bands']),
+        'stats': {band: merged[band] for band in config['bands']},
+        'indices': {name: merged[name] for name in indices},
+        'bounds': {
+            'type': 'Polygon',
+            'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]]
+        }
+    }
+
+# =============================================
+# Rendering
+# =============================================
+def render_summary_html(formula, summary):
+    """Compact HTML table of index statistics with an inline histogram"""
+    stats = summary['stats']
+    rows = ''.join(f"<tr><td>{name}</td><td>{value:.4f}</td></tr>" for name, value in stats.items())
+    counts = summary['histogram']['counts']
+    edges = summary['histogram']['edges']
+    peak = max(counts) if counts else 1
+    bars = ''.join(
+        f"<div title='{edges[i]:.3f} – {edges[i + 1]:.3f}: {count}' "
+        f"style='display:inline-block; width:4px; margin-right:1px; background:#28A745; "
+        f"height:{max(1, round(60 * count / peak))}px;'></div>"
+        for i, count in enumerate(counts)
+    )
+    range_label = f"{edges[0]:.3f} … {edges[-1]:.3f}" if edges else ''
+    return f"""
+    <div style="padding:10px; border:1px solid #ddd; border-radius:5px;">
+        <b>Local index:</b> <code>{html.escape(formula)}</code> ({summary['count']} pixels)
+        <table style="margin-top:5px;">{rows}</table>
+        <div style="display:flex; align-items:flex-end; height:62px; margin-top:5px;">{bars}</div>
+        <small>{range_label}</small>
+    </div>
+    """
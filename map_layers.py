@@ -0,0 +1,169 @@
+import json
+
+import ipywidgets as widgets
+from ipyleaflet import TileLayer
+
+from composite_cache import LRUCache
+
+# =============================================
+# Lazy Layer Manager
+# =============================================
+class LayerDescriptor:
+    """A layer that can be shown on the map; no map ID is requested until it is"""
+
+    def __init__(self, name, image, vis_params, image_key):
+        self.name = name
+        self.image = image
+        self.vis_params = dict(vis_params)
+        self.image_key = image_key
+
+    @property
+    def opacity(self):
+        return self.vis_params.get('opacity', 1)
+
+    @property
+    def map_id_key(self):
+        """Opacity is a layer property, so it does not need a new map ID"""
+        vis = {k: v for k, v in self.vis_params.items() if k != 'opacity'}
+        return (self.image_key, json.dumps(vis, sort_keys=True, default=str))
+
+
+class LayerManager:
+    """Registers layer descriptors up front and requests tiles only for visible layers
+
+    Fetched tile URLs are cached by (image key, visualization) and reused when the
+    same layer is toggled or reloaded. The map is updated by diffing the layers this
+    manager owns against the desired set, leaving every other layer untouched.
+    With a ``tile_proxy``, tiles are served through its local on-disk cache.
+    """
+
+    def __init__(self, Map, runner, status=None, max_map_ids=128, tile_proxy=None):
+        self.Map = Map
+        self.runner = runner
+        self.status = status
+        self.tile_proxy = tile_proxy
+        self.descriptors = {}
+        self.visible = []
+        self._urls = LRUCache(max_map_ids)
+        self._layers = {}
+        self._placed = []
+        self.widget = widgets.VBox()
+        self._toggles = {}
+
+    # -----------------------------------------
+    # Registration
+    # -----------------------------------------
+    def load(self, descriptors, visible=(), on_loaded=None, message='Loading imagery…'):
+        """Replace the registered layers, fetching map IDs for ``visible`` in the background"""
+        descriptors = list(descriptors)
+        wanted = [d for d in descriptors if d.name in visible]
+
+        def work(job):
+            self._materialize(wanted, job)
+
+        def show(_):
+            self.descriptors = {d.name: d for d in descriptors}
+            self.visible = [d.name for d in wanted]
+            self._rebuild_toggles()
+            self.sync()
+            if on_loaded is not None:
+                on_loaded()
+
+        return self.runner.submit((id(self), 'load'), work, on_result=show,
+                                  status=self.status, message=message)
+
+    def add(self, descriptor, message='Loading layer…'):
+        """Register one more layer and show it (e.g. a calculated index)"""
+        def work(job):
+            self._materialize([descriptor], job)
+
+        def show(_):
+            self.descriptors[descriptor.name] = descriptor
+            if descriptor.name not in self.visible:
+                self.visible.append(descriptor.name)
+            self._rebuild_toggles()
+            self.sync()
+
+        return self.runner.submit((id(self), descriptor.name), work, on_result=show,
+                                  status=self.status, message=message)
+
+    # -----------------------------------------
+    # Visibility
+    # -----------------------------------------
+    def show(self, name):
+        descriptor = self.descriptors[name]
+        if descriptor.map_id_key in self._urls:
+            self._set_visible(name, True)
+            return
+
+        def work(job):
+            self._materialize([descriptor], job)
+
+        self.runner.submit((id(self), name), work, on_result=lambda _: self._set_visible(name, True),
+                           status=self.status, message=f'Loading {name}…')
+
+    def hide(self, name):
+        self.runner.cancel((id(self), name))
+        self._set_visible(name, False)
+
+    def _set_visible(self, name, on):
+        if on and name not in self.visible:
+            self.visible.append(name)
+        elif not on and name in self.visible:
+            self.visible.remove(name)
+        toggle = self._toggles.get(name)
+        if toggle is not None and toggle.value != on:
+            toggle.value = on
+        self.sync()
+
+    # -----------------------------------------
+    # Map Synchronisation
+    # -----------------------------------------
+    def sync(self):
+        """Diff the managed layers on the map against the visible descriptors"""
+        desired = []
+        for name in self.visible:
+            descriptor = self.descriptors.get(name)
+            url = self._urls.get(descriptor.map_id_key) if descriptor else None
+            if url is None:
+                continue
+            if self.tile_proxy is not None:
+                url = self.tile_proxy.register(descriptor.map_id_key, url)
+            layer = self._layers.get(name)
+            if layer is None or layer.url != url:
+                layer = TileLayer(url=url, name=name, attribution='Google Earth Engine', max_zoom=24)
+                self._layers[name] = layer
+            layer.opacity = descriptor.opacity
+            desired.append(layer)
+
+        placed = set(id(l) for l in self._placed)
+        current = list(self.Map.layers)
+        kept = [l for l in current if id(l) not in placed]
+        new_layers = tuple(kept + desired)
+        if [id(l) for l in current] != [id(l) for l in new_layers]:
+            self.Map.layers = new_layers
+        self._placed = desired
+
+        # Forget layer objects that are no longer registered
+        for name in [n for n in self._layers if n not in self.descriptors]:
+            del self._layers[name]
+
+    def _materialize(self, descriptors, job):
+        for descriptor in descriptors:
+            job.check()
+            if descriptor.map_id_key in self._urls:
+                continue
+            vis = {k: v for k, v in descriptor.vis_params.items() if k != 'opacity'}
+            map_id = descriptor.image.getMapId(vis)
+            self._urls.put(descriptor.map_id_key, map_id['tile_fetcher'].url_format)
+
+    # -----------------------------------------
+    # Layer Toggles
+    # -----------------------------------------
+    def _rebuild_toggles(self):
+        self._toggles = {}
+        for name in self.descriptors:
+            toggle = widgets.Checkbox(value=name in self.visible, description=name, indent=False)
+            toggle.observe(lambda change, name=name: self.show(name) if change['new'] else self.hide(name), 'value')
+            self._toggles[name] = toggle
+        self.widget.children = list(self._toggles.values())
@@ -0,0 +1,155 @@
+import logging
+
+from roi import geojson_bounds
+
+logger = logging.getLogger('geemapbot.prompt')
+
+# =============================================
+# Stable System Prefix
+# =============================================
+# Kept byte-for-byte identical across turns so Ollama can reuse the KV cache for
+# it; everything that changes per question goes into the user message.
+SYSTEM_PROMPT = """You are GeeMapBot, an assistant for Google Earth Engine satellite imagery analysis.
+The user draws a region of interest (ROI) on a map and loads a cloud-masked composite. Each question comes with a compact data context: band statistics in surface reflectance (0-1), spectral indices (unitless, -1 to 1), the ROI extent and optional batch or time-series results.
+1. Answer the question using the data context; cite the numbers you rely on.
+2. For index questions (NDVI, NDWI, EVI, ...), use the user's formula or suggest an appropriate one.
+3. Give practical insights, e.g. vegetation health, water bodies or urban development.
+4. If the context lacks what the question needs, say so and ask for it."""
+
+# =============================================
+# Compact Serialization
+# =============================================
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English and numbers)"""
+    return (len(text) + 3) // 4
+
+
+def fmt(value, digits=3, unit=''):
+    """Round a number for the prompt; None and non-numbers pass through as text"""
+    if value is None:
+        return 'n/a'
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, int) or abs(value) >= 1000:
+        text = f'{value:,.0f}'
+    elif abs(value) >= 1:
+        text = f'{value:.{digits}g}'
+    else:
+        text = f'{value:.{digits}f}'
+    return f'{text} {unit}'.rstrip()
+
+
+def band_lines(stats, unit='refl', digits=3):
+    """One line per band: mean, spread, range and pixel count together"""
+    lines = []
+    for band, s in stats.items():
+        if not s.get('count'):
+            lines.append(f'{band}: no valid pixels')
+            continue
+        parts = [f"mean {fmt(s.get('mean'), digits)}", f"sd {fmt(s.get('stdDev'), digits)}",
+                 f"range {fmt(s.get('min'), digits)}..{fmt(s.get('max'), digits)}"]
+        if 'p50' in s:
+            parts.append(f"median {fmt(s['p50'], digits)}")
+        lines.append(f"{band} ({unit}): " + ', '.join(parts) + f", n={fmt(s['count'])} px")
+    return lines
+
+
+def bounds_line(geojson, digits=4):
+    """ROI bounding box as W,S,E,N degrees instead of the full GeoJSON ring"""
+    box = geojson_bounds(geojson)
+    return 'bbox W,S,E,N = ' + ', '.join(f'{v:.{digits}f}' for v in box) + ' deg'
+
+# =============================================
+# Budgeted Context Builder
+# =============================================
+class ContextBuilder:
+    """Assemble prompt sections under a token budget
+
+    Sections are admitted in priority order (lower number first). A section that
+    does not fit is cut to the lines that do, and dropped if not even its title
+    fits. Sections keep the order they were added in, and sections with a body
+    identical to an earlier one are skipped.
+    """
+
+    def __init__(self, budget_tokens=768):
+        self.budget_tokens = budget_tokens
+        self._sections = []
+
+    def add(self, title, lines, priority=5):
+        if isinstance(lines, str):
+            lines = lines.strip().splitlines()
+        lines = [line.rstrip() for line in lines if line and line.strip()]
+        if lines and all(lines != existing for _, existing, _ in self._sections):
+            self._sections.append((title, lines, priority))
+        return self
+
+    def build(self):
+        remaining = self.budget_tokens
+        kept = {}
+        order = sorted(range(len(self._sections)), key=lambda i: self._sections[i][2])
+        for i in order:
+            title, lines, _ = self._sections[i]
+            header = f'## {title}'
+            cost = estimate_tokens(header) + 1
+            if cost > remaining:
+                continue
+            included = []
+            for line in lines:
+                line_cost = estimate_tokens(line) + 1
+                if cost + line_cost > remaining:
+                    break
+                included.append(line)
+                cost += line_cost
+            if not included:
+                continue
+            if len(included) < len(lines):
+                # Make room for the omission note so the budget still holds
+                while included and cost + estimate_tokens(self._note(lines, included)) + 1 > remaining:
+                    cost -= estimate_tokens(included.pop()) + 1
+                if not included:
+                    continue
+                note = self._note(lines, included)
+                included.append(note)
+                cost += estimate_tokens(note) + 1
+            kept[i] = '\n'.join([header] + included)
+            remaining -= cost
+        return '\n\n'.join(kept[i] for i in sorted(kept))
+
+    @staticmethod
+    def _note(lines, included):
+        return f'... ({len(lines) - len(included)} more lines omitted)'
+
+
+def build_messages(context, question, system=SYSTEM_PROMPT):
+    """Chat messages with the shared system prefix; the context appears exactly once"""
+    return [
+        {'role': 'system', 'content': system},
+        {'role': 'user', 'content': f"{context}\n\n## Question\n{question}"}
+    ]
+
+# =============================================
+# Prompt Metrics
+# =============================================
+class PromptMetrics:
+    """Prompt size before the call and Ollama's prefill timings after it"""
+
+    def __init__(self, messages):
+        self.chars = sum(len(m['content']) for m in messages)
+        self.estimated_tokens = sum(estimate_tokens(m['content']) for m in messages)
+        self.prompt_tokens = None
+        self.prefill_seconds = None
+
+    def record(self, prompt_eval_count, prompt_eval_duration):
+        """Store Ollama's prompt token count and prefill duration (ns) and log them"""
+        self.prompt_tokens = prompt_eval_count
+        self.prefill_seconds = prompt_eval_duration / 1e9 if prompt_eval_duration else None
+        logger.info('prompt: %d chars, ~%d tokens estimated, %s tokens evaluated, prefill %s',
+                    self.chars, self.estimated_tokens, self.prompt_tokens,
+                    f'{self.prefill_seconds:.2f}s' if self.prefill_seconds is not None else 'n/a')
+        return self
+
+    def summary(self):
+        # Few evaluated prompt tokens means the cached system prefix was reused
+        tokens = self.prompt_tokens if self.prompt_tokens is not None else f'~{self.estimated_tokens}'
+        prefill = f' · prefill {self.prefill_seconds:.2f}s' if self.prefill_seconds is not None else ''
+        return f'prompt {tokens} tokens{prefill}'
@@ -0,0 +1,50 @@
+import math
+
+# =============================================
+# Client-Side ROI Geometry Helpers
+# =============================================
+# These work on the drawn GeoJSON directly, so they never need a round-trip.
+
+METERS_PER_DEGREE = 111320.0
+
+
+def geojson_coordinates(geojson):
+    """Yield every (lon, lat) position of a GeoJSON geometry, feature or collection"""
+    kind = geojson.get('type')
+    if kind == 'FeatureCollection':
+        for feature in geojson['features']:
+            yield from geojson_coordinates(feature)
+    elif kind == 'Feature':
+        yield from geojson_coordinates(geojson['geometry'])
+    elif kind == 'GeometryCollection':
+        for geometry in geojson['geometries']:
+            yield from geojson_coordinates(geometry)
+    else:
+        def walk(coords):
+            if coords and isinstance(coords[0], (int, float)):
+                yield coords[0], coords[1]
+            else:
+                for c in coords:
+                    yield from walk(c)
+        yield from walk(geojson['coordinates'])
+
+
+def geojson_bounds(geojson):
+    """Bounding box (west, south, east, north) in degrees"""
+    lons, lats = zip(*geojson_coordinates(geojson))
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def bounds_size_m(bounds):
+    """Approximate (width, height) of a bounding box in meters"""
+    west, south, east, north = bounds
+    mid_lat = math.radians((south + north) / 2)
+    width = (east - west) * METERS_PER_DEGREE * math.cos(mid_lat)
+    height = (north - south) * METERS_PER_DEGREE
+    return width, height
+
+
+def estimate_pixels(geojson, scale):
+    """Approximate number of pixels in the ROI's bounding box at ``scale`` meters"""
+    width, height = bounds_size_m(geojson_bounds(geojson))
+    return math.ceil(width / scale) * math.ceil(height / scale)
@@ -0,0 +1,315 @@
+import os
+import threading
+import uuid
+from contextlib import asynccontextmanager
+
+import ee
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from change_detection import CHANGE_VIS, DELTA_VIS
+from chat_session import ChatSessions
+from chat_tools import ToolContext, ToolRegistry
+from composite_cache import CompositeCache, LRUCache
+from composites import COMPOSITE_METHODS
+from ee_quota import RateLimiter, limit_ee_calls
+from engine import AnalysisEngine, AnalysisState, initialize_earth_engine
+from formula import FormulaError
+from llm_backends import LLMClient, backend_from_env
+from prompt_context import SYSTEM_PROMPT
+from tracing import trace_ee_calls, tracer
+
+# =============================================
+# Multi-User Server Mode
+# =============================================
+# uvicorn server:app --host 0.0.0.0 --port 8000
+#
+# One process serves every analyst: Earth Engine is initialized once, the
+# composite/statistics cache, map IDs and the chat model are shared, and each
+# browser session only holds its own AnalysisState. All EE requests of the
+# process pass one RateLimiter to stay inside the project quota. Run a single
+# uvicorn worker; more workers would each initialize EE and hold their own cache.
+#
+# Configuration: GEEMAPBOT_EE_SERVICE_ACCOUNT / GEEMAPBOT_EE_KEY_FILE,
+# GEEMAPBOT_EE_RATE (requests/s), GEEMAPBOT_EE_CONCURRENCY, GEEMAPBOT_CACHE_DIR
+# and the GEEMAPBOT_LLM_* / GEEMAPBOT_*_MODEL variables used by the notebooks.
+
+CHAT_MODEL = os.environ.get('GEEMAPBOT_CHAT_MODEL', "deepseek-r1:1.5b")
+TOOL_MODEL = os.environ.get('GEEMAPBOT_TOOL_MODEL', "qwen2.5:3b")
+
+
+class ServerSession:
+    """State of one analyst; requests of a session are serialized by its lock"""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.state = AnalysisState()
+        self.params = None
+        self.lock = threading.Lock()
+
+
+class GeeMapBotServer:
+    """Shared engine, caches, chat model and EE rate limiter plus the per-session store"""
+
+    def __init__(self, engine=None, llm=None, limiter=None, max_sessions=256, session_ttl=4 * 3600):
+        self.engine = engine or AnalysisEngine(
+            composite_cache=CompositeCache(max_entries=256, ttl=3600, disk_dir=os.environ.get('GEEMAPBOT_CACHE_DIR'))
+        )
+        self.llm = llm or LLMClient(backend_from_env(),
+                                    fallback_model=os.environ.get('GEEMAPBOT_FALLBACK_MODEL', "qwen2.5:0.5b"))
+        self.limiter = limiter or RateLimiter(rate=float(os.environ.get('GEEMAPBOT_EE_RATE', 10)),
+                                              max_concurrent=int(os.environ.get('GEEMAPBOT_EE_CONCURRENCY', 10)))
+        self.chat_sessions = ChatSessions(max_sessions=max_sessions, model=CHAT_MODEL, client=self.llm,
+                                          keep_alive='30m')
+        self.tool_registry = ToolRegistry()
+        self.tile_urls = LRUCache(1024, ttl=3600)  # EE map IDs expire after a few hours
+        self.sessions = LRUCache(max_sessions, ttl=session_ttl)
+
+    def start(self, initialize=True):
+        """Initialize EE once for the whole process and install the global rate limit and tracing"""
+        if initialize:
+            initialize_earth_engine(os.environ.get('GEEMAPBOT_EE_SERVICE_ACCOUNT'),
+                                    os.environ.get('GEEMAPBOT_EE_KEY_FILE'))
+        limit_ee_calls(self.limiter)
+        trace_ee_calls(tracer)  # Installed after the limit, so EE spans include quota waits
+        self.llm.warmup(CHAT_MODEL, system=SYSTEM_PROMPT)
+
+    # -----------------------------------------
+    # Sessions
+    # -----------------------------------------
+    def create_session(self):
+        session = ServerSession(uuid.uuid4().hex)
+        self.sessions.put(session.id, session)
+        return session
+
+    def session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        self.sessions.put(session_id, session)  # Sliding expiry
+        return session
+
+    def close_session(self, session_id):
+        # Chat sessions are keyed (session id, composite key[, 'tools']); drop those of every composite
+        self.sessions.pop(session_id)
+        self.chat_sessions.reset_prefix((session_id,))
+
+    # -----------------------------------------
+    # Analysis (blocking; called from the thread pool)
+    # -----------------------------------------
+    def load_composite(self, session, satellite, start, end, roi, cloud_cover=60, method='median'):
+        if method not in COMPOSITE_METHODS:
+            raise ValueError(f"Unknown method {method!r}; choose from {', '.join(COMPOSITE_METHODS)}")
+        key, image = self.engine.composite(satellite, start, end, cloud_cover, roi, method)
+        state = session.state
+        state.key, state.image, state.roi = key, image, roi
+        state.series = state.series_label = state.change = None
+        session.params = {'satellite': satellite, 'start': str(start)[:10], 'end': str(end)[:10],
+                          'cloud_cover': cloud_cover, 'method': method}
+        return {'key': key, 'tile_url': self.tile_url(key, image), **session.params}
+
+    def tile_url(self, key, image, vis=None):
+        """XYZ tile URL of the RGB composite; one getMapId per composite for all sessions"""
+        vis = vis or {'bands': ['B4', 'B3', 'B2'], 'min': 0, 'max': 0.3}
+        cache_key = (key, repr(sorted(vis.items())))
+        url = self.tile_urls.get(cache_key)
+        if url is None:
+            url = image.getMapId(vis)['tile_fetcher'].url_format
+            self.tile_urls.put(cache_key, url)
+        return url
+
+    def region_stats(self, session):
+        state = self.loaded(session)
+        return self.engine.region_stats(state.key, state.image, state.roi, session.params['satellite'])
+
+    def index_stats(self, session, indices):
+        state = self.loaded(session)
+        return self.engine.index_stats(state.key, state.image, state.roi, session.params['satellite'], indices)
+
+    def time_series(self, session, index='NDVI', period='image'):
+        state, params = self.loaded(session), session.params
+        series = self.engine.time_series(params['satellite'], params['start'], params['end'],
+                                         params['cloud_cover'], state.roi, index, period=period)
+        state.series, state.series_label = series, index
+        return series
+
+    def change(self, session, start_b, end_b, index='NDVI', threshold=0.1):
+        """Compare the loaded period (A) with period B: area of change plus difference tile URLs"""
+        state, params = self.loaded(session), session.params
+        key, delta, classes = self.engine.change(
+            params['satellite'], (params['start'], params['end']), (start_b, end_b), params['cloud_cover'],
+            state.roi, index, threshold, method=params['method']
+        )
+        stats = self.engine.change_stats(key, delta, classes, state.roi, params['satellite'])
+        state.change = {'index': index, 'threshold': threshold, 'stats': stats,
+                        'period_a': f"{params['start']}..{params['end']}",
+                        'period_b': f'{str(start_b)[:10]}..{str(end_b)[:10]}'}
+        return {**state.change,
+                'delta_tile_url': self.tile_url((key, 'delta'), delta, DELTA_VIS),
+                'classes_tile_url': self.tile_url((key, 'classes'), classes.updateMask(classes.neq(0)), CHANGE_VIS)}
+
+    def chat(self, session, question, use_tools=False):
+        state, params = self.loaded(session), session.params
+        if use_tools:
+            stats = None
+            tools = self.tool_registry.bind(ToolContext(
+                self.engine, params['satellite'], params['start'], params['end'], params['cloud_cover'],
+                state.roi, params['method']
+            ))
+            chat = self.chat_sessions.get((session.id, state.key, 'tools'), model=TOOL_MODEL)
+        else:
+            stats = self.engine.region_stats(state.key, state.image, state.roi, params['satellite'])
+            tools = None
+            chat = self.chat_sessions.get((session.id, state.key))
+        context = self.engine.chat_context(params['satellite'], params['start'], params['end'],
+                                           params['cloud_cover'], params['method'], state.roi,
+                                           stats=stats, state=state)
+        return chat.ask(question, context, tools=tools).answer.strip()
+
+    def loaded(self, session):
+        if session.state.image is None:
+            raise ValueError("No composite loaded; POST /sessions/{id}/composite first")
+        return session.state
+
+    def health(self):
+        return {
+            'sessions': len(self.sessions),
+            'cache': self.engine.composite_cache.summary(),
+            'ee': self.limiter.stats(),
+            'llm': self.llm.latency_summary()
+        }
+
+# =============================================
+# ASGI Application
+# =============================================
+def create_app(server=None, initialize=True):
+    """Starlette app around a GeeMapBotServer; ``initialize=False`` skips EE setup (tests, benchmarks)"""
+    server = server or GeeMapBotServer()
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await run_in_threadpool(server.start, initialize)
+        yield
+
+    async def call(request, method, *args, **kwargs):
+        """Run a blocking server method for the request's session, one request per session at a time"""
+        try:
+            session = server.session(request.path_params['session_id'])
+        except KeyError:
+            return JSONResponse({'error': 'Unknown or expired session'}, status_code=404)
+
+        def locked():
+            with session.lock:
+                return method(session, *args, **kwargs)
+
+        try:
+            return JSONResponse(await run_in_threadpool(locked))
+        except (FormulaError, ValueError) as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        except ee.EEException as e:
+            return JSONResponse({'error': str(e)}, status_code=502)
+
+    async def read_json(request):
+        """The JSON object in the request body, or None when it is malformed"""
+        try:
+            body = await request.json()
+        except ValueError:
+            return None
+        return body if isinstance(body, dict) else None
+
+    def invalid_body():
+        return JSONResponse({'error': 'Request body must be a JSON object'}, status_code=400)
+
+    def missing(body, *names):
+        absent = [name for name in names if name not in body]
+        return JSONResponse({'error': f"Missing {', '.join(absent)}"}, status_code=400) if absent else None
+
+    async def create_session(request):
+        return JSONResponse({'session_id': server.create_session().id}, status_code=201)
+
+    async def close_session(request):
+        server.close_session(request.path_params['session_id'])
+        return Response(status_code=204)
+
+    async def composite(request):
+        body = await read_json(request)
+        if body is None:
+            return invalid_body()
+        error = missing(body, 'start', 'end', 'roi')
+        if error is not None:
+            return error
+        return await call(request, server.load_composite, body.get('satellite', 'Landsat 8'),
+                          body['start'], body['end'], body['roi'], body.get('cloud_cover', 60),
+                          body.get('method', 'median'))
+
+    async def stats(request):
+        return await call(request, server.region_stats)
+
+    async def index(request):
+        body = await read_json(request)
+        if body is None:
+            return invalid_body()
+        return await call(request, server.index_stats, body.get('indices') or ['NDVI'])
+
+    async def series(request):
+        body = await read_json(request)
+        if body is None:
+            return invalid_body()
+        return await call(request, server.time_series, body.get('index', 'NDVI'), body.get('period', 'image'))
+
+    async def change(request):
+        body = await read_json(request)
+        if body is None:
+            return invalid_body()
+        error = missing(body, 'start_b', 'end_b')
+        if error is not None:
+            return error
+        try:
+            threshold = float(body.get('threshold', 0.1))
+        except (TypeError, ValueError):
+            return JSONResponse({'error': 'threshold must be a number'}, status_code=400)
+        return await call(request, server.change, body['start_b'], body['end_b'], body.get('index', 'NDVI'),
+                          threshold)
+
+    async def chat(request):
+        body = await read_json(request)
+        if body is None:
+            return invalid_body()
+        error = missing(body, 'question')
+        if error is not None:
+            return error
+        return await call(request, server.chat, body['question'], bool(body.get('tools')))
+
+    async def health(request):
+        return JSONResponse(server.health())
+
+    async def metrics(request):
+        return PlainTextResponse(tracer.prometheus(), media_type='text/plain; version=0.0.4')
+
+    async def trace(request):
+        try:
+            n = max(1, int(request.query_params.get('n', 50)))
+        except ValueError:
+            return JSONResponse({'error': 'n must be an integer'}, status_code=400)
+        return JSONResponse({'summary': tracer.summary(), 'spans': tracer.recent(n)})
+
+    app = Starlette(routes=[
+        Route('/sessions', create_session, methods=['POST']),
+        Route('/sessions/{session_id}', close_session, methods=['DELETE']),
+        Route('/sessions/{session_id}/composite', composite, methods=['POST']),
+        Route('/sessions/{session_id}/stats', stats, methods=['GET']),
+        Route('/sessions/{session_id}/index', index, methods=['POST']),
+        Route('/sessions/{session_id}/series', series, methods=['POST']),
+        Route('/sessions/{session_id}/change', change, methods=['POST']),
+        Route('/sessions/{session_id}/chat', chat, methods=['POST']),
+        Route('/health', health, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/trace', trace, methods=['GET']),
+    ], lifespan=lifespan)
+    app.state.server = server
+    return app
+
+
+app = create_app()
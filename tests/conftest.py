@@ -0,0 +1,35 @@
+import os
+import sys
+
+import ee
+import pytest
+
+# The modules live at the repository root, next to the notebooks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def offline_ee(monkeypatch):
+    """Earth Engine initialized offline from the algorithm signatures shipped with earthengine-api
+
+    Every server request must be stubbed by the test; ``computeValue`` fails
+    unless replaced.
+    """
+    try:
+        from ee import apitestcase
+        algorithms = apitestcase.GetAlgorithms()
+    except (ImportError, OSError):
+        pytest.skip('earthengine-api without its test algorithm signatures')
+
+    def offline(*args, **kwargs):
+        raise AssertionError('Unexpected Earth Engine request')
+
+    ee.Reset()
+    monkeypatch.setattr(ee.data, '_install_cloud_api_resource', lambda: None)
+    monkeypatch.setattr(ee.data, 'getAlgorithms', lambda: algorithms)
+    monkeypatch.setattr(ee.deprecation, '_FetchDataCatalogStac', lambda: {})
+    for name in ('computeValue', 'getMapId', 'getDownloadId', 'getThumbId', 'getTableDownloadId'):
+        monkeypatch.setattr(ee.data, name, offline)
+    ee.Initialize(None, '', project='geemapbot-test')
+    yield ee
+    ee.Reset()
@@ -0,0 +1,63 @@
+import json
+
+import ee
+
+from batch_regions import batch_region_records, features_from_draw_control, label_features, load_regions
+from engine import BAND_CONFIG
+
+CONFIG = BAND_CONFIG['Sentinel-2']
+
+
+def polygon(lon, lat, half=0.01):
+    ring = [[lon - half, lat - half], [lon + half, lat - half], [lon + half, lat + half],
+            [lon - half, lat + half], [lon - half, lat - half]]
+    return {'type': 'Polygon', 'coordinates': [ring]}
+
+
+def test_label_features_normalizes_every_shape():
+    geometry = polygon(91.7, 26.1)
+    assert label_features(geometry)['features'] == [
+        {'type': 'Feature', 'geometry': geometry, 'properties': {'region': 'ROI 1'}}
+    ]
+    single = label_features({'type': 'Feature', 'geometry': geometry, 'properties': {'name': 'Field A'}})
+    assert single['features'][0]['properties'] == {'name': 'Field A', 'region': 'Field A'}
+
+    drawn = features_from_draw_control([
+        {'type': 'Feature', 'geometry': geometry, 'properties': {'style': {'color': 'red'}}},
+        {'type': 'Feature', 'geometry': geometry, 'properties': {'region': 7, 'name': 'ignored'}},
+        {'type': 'Feature', 'geometry': geometry, 'properties': None},
+    ])
+    assert drawn['type'] == 'FeatureCollection'
+    assert [f['properties'] for f in drawn['features']] == [
+        {'region': 'ROI 1'}, {'region': '7', 'name': 'ignored'}, {'region': 'ROI 3'}
+    ]
+
+
+def test_load_regions_reads_files_and_uploads_alike(tmp_path):
+    collection = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'geometry': polygon(91.7, 26.1), 'properties': {'name': 'North'}}
+    ]}
+    path = tmp_path / 'fields.geojson'
+    path.write_text(json.dumps(collection), encoding='utf-8')
+    assert load_regions(str(path)) == load_regions(path.read_bytes()) == label_features(collection)
+
+
+def test_regions_are_reduced_in_one_request(offline_ee, monkeypatch):
+    regions = label_features({'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'geometry': polygon(91.7 + i * 0.05, 26.1), 'properties': {}} for i in range(25)
+    ]})
+    calls = []
+
+    def compute_value(obj):
+        calls.append(obj)
+        return {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': None, 'properties': {'region': f['properties']['region'], 'NDVI_mean': 0.4}}
+            for f in regions['features']
+        ]}
+
+    monkeypatch.setattr(ee.data, 'computeValue', compute_value)
+    records = batch_region_records(CONFIG, '2024-01-01', '2024-03-01', 60, regions)
+
+    assert len(calls) == 1
+    assert 'Image.reduceRegions' in calls[0].serialize()
+    assert [r['region'] for r in records] == [f'ROI {i + 1}' for i in range(25)]
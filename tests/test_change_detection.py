@@ -0,0 +1,54 @@
+import ee
+import pytest
+
+from change_detection import change_to_context, parse_change_stats
+from engine import AnalysisEngine
+
+ROI = {'type': 'Polygon', 'coordinates': [[[91.7, 26.1], [91.8, 26.1], [91.8, 26.2], [91.7, 26.2], [91.7, 26.1]]]}
+
+
+def reduce_region_result():
+    """What change_dictionary's reduceRegion returns: delta statistics plus the summed class areas"""
+    result = {'delta_mean': -0.05, 'delta_stdDev': 0.12, 'delta_min': -0.6, 'delta_max': 0.4,
+              'delta_p10': -0.2, 'delta_p50': -0.03, 'delta_p90': 0.1, 'delta_sum': -250.0}
+    for name, hectares in (('loss', 30.0), ('stable', 60.0), ('gain', 10.0)):
+        result.update({f'{name}_sum': hectares, f'{name}_mean': hectares / 5000, f'{name}_min': 0.0,
+                       f'{name}_max': 0.09, f'{name}_stdDev': 0.01})
+    return result
+
+
+def test_parse_change_stats():
+    stats = parse_change_stats(reduce_region_result())
+    assert stats['area_ha'] == {'loss': 30.0, 'stable': 60.0, 'gain': 10.0}
+    assert stats['fraction'] == pytest.approx({'loss': 0.3, 'stable': 0.6, 'gain': 0.1})
+    assert stats['delta'] == {'mean': -0.05, 'stdDev': 0.12, 'min': -0.6, 'max': 0.4,
+                              'p10': -0.2, 'p50': -0.03, 'p90': 0.1}
+
+
+def test_parse_change_stats_without_valid_pixels():
+    stats = parse_change_stats({'delta_mean': None, 'loss_sum': None, 'stable_sum': 0, 'gain_sum': None})
+    assert stats['area_ha'] == {'loss': 0.0, 'stable': 0.0, 'gain': 0.0}
+    assert stats['fraction'] == {'loss': 0.0, 'stable': 0.0, 'gain': 0.0}
+
+
+def test_change_is_one_request(offline_ee, monkeypatch):
+    calls = []
+
+    def compute_value(obj):
+        calls.append(obj.serialize())
+        return reduce_region_result()
+
+    monkeypatch.setattr(ee.data, 'computeValue', compute_value)
+    engine = AnalysisEngine()
+    key, delta, classes = engine.change('Sentinel-2', ('2023-01-01', '2023-03-01'), ('2024-01-01', '2024-03-01'),
+                                        40, ROI, 'NDVI', threshold=0.15)
+    stats = engine.change_stats(key, delta, classes, ROI, 'Sentinel-2')
+    assert engine.change_stats(key, delta, classes, ROI, 'Sentinel-2') is stats  # Cached
+
+    assert len(calls) == 1
+    assert calls[0].count('Image.reduceRegion') == 1
+    assert '2023-01-01' in calls[0] and '2024-01-01' in calls[0]  # Both periods in the one graph
+    assert stats['area_ha']['loss'] == 30.0
+    lines = change_to_context({'index': 'NDVI', 'period_a': '2023-01-01..2023-03-01',
+                               'period_b': '2024-01-01..2024-03-01', 'threshold': 0.15, 'stats': stats})
+    assert 'loss 30' in lines[0] and '(30.0%)' in lines[0]
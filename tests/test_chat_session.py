@@ -0,0 +1,34 @@
+from chat_session import ChatSession, ChatSessions, summarize_turns
+from llm_backends import FakeBackend, LLMClient
+from prompt_context import estimate_tokens
+
+
+def turn(i):
+    return {'question': f'Question number {i} about the NDVI of this field?',
+            'answer': f'Answer {i}: the NDVI is moderate. More detail follows here.'}
+
+
+def test_summary_stays_within_budget():
+    summary = None
+    for i in range(0, 200, 2):
+        summary = summarize_turns(summary, [turn(i), turn(i + 1)], max_tokens=128)
+        assert estimate_tokens(summary) <= 128
+    # The most recent turns are the ones kept
+    assert 'Question number 199' in summary and 'Question number 0 ' not in summary
+
+
+def test_long_conversation_history_is_bounded():
+    session = ChatSession(model='tiny', client=LLMClient(FakeBackend()), max_history_tokens=300, keep_turns=2)
+    for i in range(120):
+        session.ask(f'Question {i}: what does the NDVI of {i} mean for crop health in this area?',
+                    context='NDVI mean 0.6')
+    assert estimate_tokens(session.summary) <= 256
+    assert session.history_tokens() <= 300 + 256
+
+
+def test_sessions_reset():
+    sessions = ChatSessions(model='tiny', client=LLMClient(FakeBackend()))
+    first = sessions.get('a')
+    assert sessions.get('a') is first
+    sessions.reset('a')
+    assert sessions.get('a') is not first
@@ -0,0 +1,100 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ollama
+import pytest
+
+from chat_stream import StreamingReplyView, ThinkSplitter, stream_chat
+
+REPLY = '<think>NDVI 0.62 is high.</think>The vegetation is healthy (NDVI 0.62).'
+# <think> and </think> split across chunk boundaries, as small models stream them
+CHUNKS = ['<th', 'ink>NDVI 0.62', ' is high.</', 'think', '>The vegetation is ', 'healthy (NDVI 0.62).']
+
+
+# =============================================
+# Fake Ollama Server
+# =============================================
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Answers POST /api/chat with newline-delimited JSON in HTTP chunked transfer encoding"""
+
+    chunks = CHUNKS
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.requests.append((self.path, body))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        lines = [{'model': body['model'], 'created_at': '2024-01-01T00:00:00Z',
+                  'message': {'role': 'assistant', 'content': text}, 'done': False} for text in self.chunks]
+        lines.append({'model': body['model'], 'created_at': '2024-01-01T00:00:00Z',
+                      'message': {'role': 'assistant', 'content': ''}, 'done': True, 'done_reason': 'stop',
+                      'eval_count': len(self.chunks), 'eval_duration': 500_000_000,
+                      'prompt_eval_count': 42, 'prompt_eval_duration': 100_000_000})
+        for line in lines:
+            data = (json.dumps(line) + '\n').encode('utf-8')
+            self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_ollama():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOllamaHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    FakeOllamaHandler.requests = []
+    yield ollama.Client(host=f'http://127.0.0.1:{server.server_address[1]}')
+    server.shutdown()
+    server.server_close()
+
+# =============================================
+# Tests
+# =============================================
+def test_stream_chat_against_fake_server(fake_ollama):
+    updates = []
+    splitter, stats = stream_chat([{'role': 'user', 'content': 'Is it healthy?'}], model='tiny',
+                                  client=fake_ollama,
+                                  on_update=lambda s, st: updates.append((s.thinking, s.answer)))
+    assert splitter.thinking == 'NDVI 0.62 is high.'
+    assert splitter.answer == 'The vegetation is healthy (NDVI 0.62).'
+    assert stats.chunks == len(CHUNKS)
+    assert stats.eval_count == len(CHUNKS) and stats.tokens_per_second == pytest.approx(len(CHUNKS) / 0.5)
+    assert stats.prompt_eval_count == 42
+    # No partial tag ever reaches the rendered text
+    assert all('<' not in thinking and '<' not in answer for thinking, answer in updates)
+    path, body = FakeOllamaHandler.requests[0]
+    assert path == '/api/chat' and body['stream'] is True
+
+
+def test_streaming_view_renders_reasoning_and_answer(fake_ollama):
+    view = StreamingReplyView(interval=0)
+    stream_chat([{'role': 'user', 'content': 'Is it healthy?'}], model='tiny', client=fake_ollama,
+                on_update=view.update)
+    assert '<summary>Reasoning</summary>' in view.widget.value
+    assert 'NDVI 0.62 is high.' in view.widget.value
+    assert 'The vegetation is healthy (NDVI 0.62).' in view.widget.value
+    assert 'tokens/s' in view.widget.value
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7])
+def test_splitter_every_chunk_size(size):
+    splitter = ThinkSplitter()
+    for i in range(0, len(REPLY), size):
+        splitter.feed(REPLY[i:i + size])
+    splitter.flush()
+    assert (splitter.thinking, splitter.answer) == ('NDVI 0.62 is high.', 'The vegetation is healthy (NDVI 0.62).')
+
+
+def test_splitter_keeps_text_that_only_looks_like_a_tag():
+    splitter = ThinkSplitter()
+    for chunk in ['NDVI <', ' 0.2 and <th', 'e end']:
+        splitter.feed(chunk)
+    splitter.flush()
+    assert splitter.answer == 'NDVI < 0.2 and <the end' and splitter.thinking == ''
@@ -0,0 +1,65 @@
+import json
+
+from chat_tools import ToolContext, ToolRegistry
+from engine import AnalysisEngine
+
+ROI = {'type': 'Polygon', 'coordinates': [[[91.7, 26.1], [91.8, 26.1], [91.8, 26.2], [91.7, 26.1]]]}
+STATS = {'mean': 0.123456, 'min': 0.0, 'max': 0.5, 'stdDev': 0.1, 'count': 100, 'p10': 0.05, 'p50': 0.12, 'p90': 0.3}
+
+
+class CountingEngine(AnalysisEngine):
+    """Real configuration and formula compilation; the server-side statistics are canned and counted"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def composite(self, satellite, start, end, cloud_cover, roi, method='median'):
+        return None, object()
+
+    def region_stats(self, key, image, roi, satellite, progress=None):
+        self.requests.append(('region_stats', satellite))
+        bands = self.config(satellite)['bands']
+        return {'stats': {band: STATS for band in bands}, 'indices': {'NDVI': STATS, 'NDWI': STATS}}
+
+    def index_stats(self, key, image, roi, satellite, indices, aliases=None):
+        self.requests.append(('index_stats', tuple(indices)))
+        return {name: STATS for name in indices}
+
+
+def bound(registry, engine, roi=ROI):
+    return registry.bind(ToolContext(engine, 'Landsat 8', '2024-01-01', '2024-03-01', 60, roi))
+
+
+def test_results_are_memoized_per_composite_and_arguments():
+    engine, registry = CountingEngine(), ToolRegistry()
+    tools = bound(registry, engine)
+    first = tools.call('region_stats', {'bands': ['B4', 'NDVI'], 'reducer': 'p50'})
+    assert json.loads(first) == {'reducer': 'p50', 'values': {'B4': 0.12, 'NDVI': 0.12}}
+    assert tools.call('region_stats', {'reducer': 'p50', 'bands': ['B4', 'NDVI']}) == first
+    assert len(engine.requests) == 1
+
+    tools.call('region_stats', {'bands': ['B4'], 'reducer': 'mean'})  # Other arguments
+    tools.call('load_composite', {'start_date': '2023-01-01'})  # Other composite, never memoized
+    tools.call('region_stats', {'bands': ['B4', 'NDVI'], 'reducer': 'p50'})
+    assert len(engine.requests) == 3
+    assert json.loads(tools.call('compute_index', {'formula': 'NDVI'}))['mean'] == 0.1235  # Rounded
+
+
+def test_errors_go_back_to_the_model_and_are_not_memoized():
+    engine, registry = CountingEngine(), ToolRegistry()
+    tools = bound(registry, engine)
+    errors = [
+        tools.call('region_stats', {'reducer': 'median'}),
+        tools.call('region_stats', {'bands': ['B99']}),
+        tools.call('compute_index', {'formula': 'NIR +'}),
+        tools.call('compute_index', {'formula': 'NDVI', 'scale': 10}),
+        tools.call('load_composite', {'satellite': 'Landsat 5'}),
+        tools.call('fly_to', {}),
+        bound(registry, engine, roi=None).call('time_series', {}),
+    ]
+    for error in errors:
+        assert set(json.loads(error)) == {'error'}
+    assert 'median' in json.loads(errors[0])['error'] and 'p50' in json.loads(errors[0])['error']
+    assert len(registry.results) == 0
+    assert registry.calls == len(errors)
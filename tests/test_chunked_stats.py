@@ -0,0 +1,85 @@
+import ee
+import pytest
+
+import chunked_stats
+from chunked_stats import histogram_percentiles, is_transient, merge_partials, reduce_tile
+from engine import BAND_CONFIG
+
+
+class Geometry:
+    def intersection(self, other, margin):
+        return self
+
+
+class Failing:
+    """tile_dictionary stand-in raising ``errors`` in turn, then returning a result"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, image, geometry, scale, histograms=None):
+        self.calls += 1
+        return self
+
+    def getInfo(self):
+        if self.errors:
+            raise ee.EEException(self.errors.pop(0))
+        return {'B4_count': 1}
+
+
+@pytest.fixture
+def no_ee(monkeypatch):
+    monkeypatch.setattr(chunked_stats.ee.Geometry, 'Rectangle', lambda *args: None)
+    monkeypatch.setattr(chunked_stats.ee, 'ErrorMargin', lambda value: None)
+
+
+def test_transient_errors_are_retried(monkeypatch, no_ee):
+    fake = Failing(['Too many concurrent aggregations.', 'Computation timed out.'])
+    monkeypatch.setattr(chunked_stats, 'tile_dictionary', fake)
+    assert reduce_tile(None, Geometry(), (0, 0, 1, 1), 30, backoff=0) == {'B4_count': 1}
+    assert fake.calls == 3
+
+
+def test_user_errors_fail_at_once(monkeypatch, no_ee):
+    fake = Failing(["Image.select: Pattern 'B99' did not match any bands."])
+    monkeypatch.setattr(chunked_stats, 'tile_dictionary', fake)
+    with pytest.raises(ee.EEException, match='B99'):
+        reduce_tile(None, Geometry(), (0, 0, 1, 1), 30, backoff=10)
+    assert fake.calls == 1
+
+
+def test_is_transient():
+    assert is_transient(ee.EEException('User memory limit exceeded. Quota exceeded'))
+    assert is_transient(ee.EEException('HTTP 429: Too Many Requests'))
+    assert not is_transient(ee.EEException('Invalid GeoJSON geometry.'))
+
+
+def test_chunked_band_stats_have_percentiles(monkeypatch):
+    captured = {}
+
+    def fake_chunked(image, roi, scale, bands, histograms=None, progress=None, **kwargs):
+        captured['histograms'] = histograms
+        histogram = [[i / 10, 10] for i in range(10)]
+        partial = {}
+        for band in bands:
+            partial.update({f'{band}_count': 100, f'{band}_sum': 45.0, f'{band}__sq_sum': 28.5,
+                            f'{band}_min': 0.0, f'{band}_max': 0.99, f'{band}__histogram': histogram})
+        return {'bands': bands, 'tiles': 4, 'stats': merge_partials([partial], bands)}
+
+    monkeypatch.setattr(chunked_stats, 'chunked_stats', fake_chunked)
+    monkeypatch.setattr(chunked_stats, 'add_indices', lambda image, common: image)
+    config = BAND_CONFIG['Landsat 8']
+    roi = {'type': 'Polygon', 'coordinates': [[[91, 26], [92, 26], [92, 27], [91, 27], [91, 26]]]}
+    result = chunked_stats.region_stats(None, roi, config)
+
+    low, high = config['reflectance_range']
+    for band in config['bands']:
+        assert captured['histograms'][band][:2] == (low, high)
+        assert {'p10', 'p50', 'p90'} <= set(result['stats'][band])
+    assert set(result['indices']['NDVI']) >= {'p10', 'p50', 'p90'}
+
+
+def test_histogram_percentiles():
+    histogram = [[i / 10, 10] for i in range(10)]
+    assert histogram_percentiles(histogram)['p50'] == pytest.approx(0.5)
@@ -0,0 +1,112 @@
+import json
+import os
+
+import pytest
+
+import composite_cache
+from composite_cache import CompositeCache, LRUCache, composite_key, roi_hash
+
+ROI = {'type': 'Polygon', 'coordinates': [[[91.7, 26.1], [91.8, 26.1], [91.8, 26.2], [91.7, 26.1]]]}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(composite_cache.time, 'time', clock.time)
+    return clock
+
+
+def builder(value, calls):
+    def build():
+        calls.append(value)
+        return value
+    return build
+
+
+def test_keys_ignore_key_order_and_float_noise():
+    noisy = {'coordinates': [[[91.7 + 1e-12, 26.1], [91.8, 26.1], [91.8, 26.2], [91.7, 26.1]]], 'type': 'Polygon'}
+    assert roi_hash(noisy) == roi_hash(ROI)
+    assert composite_key('Landsat 8', '2024-01-01', '2024-03-01', 60, ROI, method='median') == \
+        composite_key('Landsat 8', '2024-01-01', '2024-03-01', 60, noisy, method='median')
+    assert composite_key('Landsat 8', '2024-01-01', '2024-03-01', 60, ROI) != \
+        composite_key('Landsat 8', '2024-01-01', '2024-03-01', 50, ROI)
+
+
+def test_lru_evicts_least_recently_used_and_counts():
+    cache = LRUCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache and cache.get('b') is None
+    assert cache.keys() == ['a', 'c'] and len(cache) == 2
+    assert cache.stats() == {'entries': 2, 'hits': 1, 'misses': 1, 'evictions': 1}
+
+
+def test_lru_ttl_expires_entries(clock):
+    cache = LRUCache(ttl=10)
+    cache.put('a', 1)
+    clock.now += 9
+    assert cache.get('a') == 1
+    clock.now += 2
+    assert cache.get('a') is None and len(cache) == 0
+
+
+def test_stats_come_from_memory_then_disk_then_builder(tmp_path):
+    calls = []
+    cache = CompositeCache(disk_dir=str(tmp_path))
+    assert cache.get_stats('k', builder({'mean': 0.4}, calls)) == {'mean': 0.4}
+    assert cache.get_stats('k', builder({'mean': 0.0}, calls)) == {'mean': 0.4}
+    assert calls == [{'mean': 0.4}]
+    assert os.listdir(tmp_path) == ['k.json']  # No temporary file left behind
+
+    # A new process only has the disk tier
+    restarted = CompositeCache(disk_dir=str(tmp_path))
+    assert restarted.get_stats('k', builder({'mean': 0.0}, calls)) == {'mean': 0.4}
+    assert len(calls) == 1
+    assert restarted.summary()['stats'] == {'entries': 1, 'hits': 0, 'misses': 1, 'evictions': 0, 'disk_hits': 1}
+    assert restarted.get_stats('k', builder({'mean': 0.0}, calls)) == {'mean': 0.4}
+    assert restarted.summary()['stats']['hits'] == 1
+
+
+def test_disk_ttl_and_invalidate(tmp_path, clock):
+    calls = []
+    cache = CompositeCache(disk_dir=str(tmp_path), disk_ttl=60)
+    cache.get_stats('k', builder(1, calls))
+    clock.now += 61
+    assert CompositeCache(disk_dir=str(tmp_path), disk_ttl=60).get_stats('k', builder(2, calls)) == 2
+    assert calls == [1, 2]
+
+    cache.invalidate('k')
+    assert os.listdir(tmp_path) == []
+    assert cache.get_stats('k', builder(3, calls)) == 3
+
+
+def test_unreadable_or_unserializable_stats_are_rebuilt(tmp_path):
+    calls = []
+    (tmp_path / 'k.json').write_text('{not json', encoding='utf-8')
+    cache = CompositeCache(disk_dir=str(tmp_path))
+    assert cache.get_stats('k', builder(1, calls)) == 1
+    assert json.loads((tmp_path / 'k.json').read_text(encoding='utf-8'))['value'] == 1
+
+    # A value JSON cannot hold stays in memory only, without a half-written file
+    assert cache.get_stats('other', builder({1, 2}, calls)) == {1, 2}
+    assert sorted(os.listdir(tmp_path)) == ['k.json']
+
+
+def test_composites_are_built_once(tmp_path):
+    calls = []
+    cache = CompositeCache(disk_dir=str(tmp_path))
+    image = object()
+    assert cache.get_composite('k', builder(image, calls)) is image
+    assert cache.get_composite('k', builder(object(), calls)) is image
+    assert len(calls) == 1
+    assert os.listdir(tmp_path) == []  # Composites never reach the disk tier
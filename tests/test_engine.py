@@ -0,0 +1,55 @@
+import ee
+import requests
+
+from engine import AnalysisEngine
+
+
+class StubbedEngine(AnalysisEngine):
+    """``analyze`` raises the queued errors of a region before succeeding"""
+
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors
+        self.calls = []
+
+    def analyze(self, region=None, **kwargs):
+        self.calls.append(region)
+        queued = self.errors.get(region, [])
+        if queued:
+            raise queued.pop(0)
+        return {'region': region, 'NDVI_mean': 0.5}
+
+
+def run(engine, regions):
+    progress = []
+    records = list(engine.analyze_many([{'region': r, 'satellite': 'Landsat 8', 'roi': None} for r in regions],
+                                       max_workers=2, backoff=0, progress=lambda *p: progress.append(p)))
+    return {r['region']: r for r in records}, progress
+
+
+def test_failures_do_not_stop_the_batch():
+    engine = StubbedEngine({
+        'bad_band': [ee.EEException("Image.select: Band pattern 'B99' did not match any bands.")],
+        'http': [requests.ConnectionError('Connection reset by peer')],
+        'bug': [TypeError("unsupported operand type(s) for +: 'NoneType' and 'int'")],
+        'disk': [OSError('No space left on device')],
+    })
+    records, progress = run(engine, ['ok', 'bad_band', 'http', 'bug', 'disk'])
+    assert records['ok'] == {'region': 'ok', 'NDVI_mean': 0.5}
+    for region in ('bad_band', 'http', 'bug', 'disk'):
+        assert 'error' in records[region]
+    assert "B99" in records['bad_band']['error']
+    assert progress[-1] == (5, 5, 4)
+
+
+def test_only_transient_errors_are_retried():
+    engine = StubbedEngine({
+        'quota': [ee.EEException('Too many concurrent aggregations.'), ee.EEException('Computation timed out.')],
+        'geometry': [ee.EEException('Geometry.polygon: Invalid geometry.')],
+        'exhausted': [ee.EEException('Quota exceeded')] * 3,
+    })
+    records, _ = run(engine, ['quota', 'geometry', 'exhausted'])
+    assert records['quota'] == {'region': 'quota', 'NDVI_mean': 0.5}
+    assert engine.calls.count('quota') == 3
+    assert engine.calls.count('geometry') == 1 and 'error' in records['geometry']
+    assert engine.calls.count('exhausted') == 3 and 'error' in records['exhausted']
@@ -0,0 +1,64 @@
+import numpy as np
+
+from engine import BAND_CONFIG
+from export import load_export_arrays, plan_tiles
+from local_index import LocalIndexCalculator, array_region_stats
+
+CONFIG = BAND_CONFIG['Landsat 8']
+ROI = {'type': 'Polygon', 'coordinates': [[[91.7, 26.1], [91.75, 26.1], [91.75, 26.14], [91.7, 26.14], [91.7, 26.1]]]}
+
+
+def test_tiles_cover_the_grid_once():
+    plan = plan_tiles(ROI, 30, 3, max_request_bytes=50 * 50 * 12)
+    covered = np.zeros((plan['height'], plan['width']), dtype=int)
+    for tile in plan['tiles']:
+        covered[tile['row']:tile['row'] + tile['height'], tile['col']:tile['col'] + tile['width']] += 1
+        assert tile['width'] * tile['height'] * 3 * 4 <= 50 * 50 * 12
+    assert (covered == 1).all()
+
+
+def test_register_replaces_cached_summaries(tmp_path):
+    rng = np.random.default_rng(0)
+    coarse = {band: rng.uniform(0, 0.3, (4, 4)) for band in CONFIG['bands']}
+    calculator = LocalIndexCalculator()
+    calculator.register('key', coarse)
+    before = calculator.compute('key', '(B5 - B4) / (B5 + B4)')
+
+    canvas = np.lib.format.open_memmap(str(tmp_path / 'x.npy'), mode='w+', dtype=np.float32,
+                                       shape=(len(CONFIG['bands']), 64, 64))
+    canvas[:] = rng.uniform(0, 0.3, canvas.shape)
+    canvas.flush()
+    calculator.register('key', load_export_arrays(str(tmp_path / 'x.npy'), CONFIG['bands']))
+    after = calculator.compute('key', '(B5 - B4) / (B5 + B4)')
+    assert before['count'] == 16 and after['count'] == 64 * 64
+
+
+def test_array_region_stats_has_region_stats_shape():
+    rng = np.random.default_rng(1)
+    arrays = {band: rng.uniform(0, 0.3, (8, 8)) for band in CONFIG['bands']}
+    arrays['B4'][0, 0] = np.nan
+    stats = array_region_stats(arrays, CONFIG, ROI)
+    assert stats['bands'] == CONFIG['bands']
+    assert stats['stats']['B4']['count'] == 63
+    assert {'mean', 'stdDev', 'min', 'max', 'p10', 'p50', 'p90'} <= set(stats['stats']['B5'])
+    red, nir = arrays['B4'], arrays['B5']
+    ndvi = (nir - red) / (nir + red)
+    assert np.isclose(stats['indices']['NDVI']['mean'], np.nanmean(ndvi))
+    assert stats['bounds']['type'] == 'Polygon'
+
+
+def test_array_region_stats_blocks_match_whole_array():
+    rng = np.random.default_rng(2)
+    arrays = {band: rng.uniform(0, 0.5, (37, 23)) for band in CONFIG['bands']}
+    arrays['B5'][rng.random((37, 23)) < 0.1] = np.nan
+    blocked = array_region_stats(arrays, CONFIG, ROI, block_pixels=23 * 4)
+    whole = array_region_stats(arrays, CONFIG, ROI, block_pixels=37 * 23)
+
+    red, nir = arrays['B4'], arrays['B5']
+    ndvi = ((nir - red) / (nir + red))[np.isfinite(nir)]
+    reference = {'count': ndvi.size, 'mean': ndvi.mean(), 'stdDev': ndvi.std(), 'min': ndvi.min(), 'max': ndvi.max()}
+    for stats in (blocked['indices']['NDVI'], whole['indices']['NDVI']):
+        for name, value in reference.items():
+            assert np.isclose(stats[name], value)
+        assert abs(stats['p50'] - np.median(ndvi)) <= 2 / 200  # One histogram bucket
+    assert blocked['stats']['B5']['histogram'] == whole['stats']['B5']['histogram']
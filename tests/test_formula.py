@@ -0,0 +1,152 @@
+import random
+
+import numpy as np
+import pytest
+
+from formula import FormulaError, compile_formula, evaluate
+from local_index import LocalIndexCalculator
+
+BANDS = ('B2', 'B4', 'B5')
+ALIASES = {'RED': 'B4', 'NIR': 'B5'}
+FUNCTIONS = {'abs': 1, 'sqrt': 1, 'exp': 1, 'log': 1, 'log10': 1, 'min': 2, 'max': 2}
+NUMPY_REFERENCE = {'abs': np.abs, 'sqrt': np.sqrt, 'exp': np.exp, 'log': np.log, 'log10': np.log10,
+                   'min': np.minimum, 'max': np.maximum}
+
+
+def scalar_safe(func):
+    # Constant calls return Python floats, so they combine like the other constants
+    def call(*args):
+        result = func(*args)
+        return float(result) if np.ndim(result) == 0 else result
+    return call
+
+
+REFERENCE_FUNCTIONS = {name: scalar_safe(func) for name, func in NUMPY_REFERENCE.items()}
+
+
+def band_arrays(seed=0, size=200):
+    rng = np.random.default_rng(seed)
+    arrays = {band: rng.uniform(-0.1, 1.0, size) for band in BANDS}
+    arrays['B4'][:5] = 0.0  # Zero denominators
+    arrays['B5'][:5] = 0.0
+    return arrays
+
+
+def random_expression(rng, depth=0):
+    """Random formula over the accepted grammar"""
+    if depth >= 4 or rng.random() < 0.25:
+        choice = rng.random()
+        if choice < 0.4:
+            return rng.choice(BANDS + tuple(ALIASES))
+        if choice < 0.5:
+            return f"b('{rng.choice(BANDS)}')"
+        return repr(rng.choice([0.5, 1, 2, 3, 0.1, 10, 7.5]))
+    kind = rng.random()
+    if kind < 0.5:
+        op = rng.choice(['+', '-', '*', '/', '%'])
+        return f'({random_expression(rng, depth + 1)} {op} {random_expression(rng, depth + 1)})'
+    if kind < 0.6:
+        return f'({random_expression(rng, depth + 1)} ** {rng.choice([2, 0.5, 3])})'
+    if kind < 0.7:
+        return f'(-{random_expression(rng, depth + 1)})'
+    if kind < 0.8:
+        op = rng.choice(['<', '<=', '>', '>=', '==', '!='])
+        return f'({random_expression(rng, depth + 1)} {op} {random_expression(rng, depth + 1)})'
+    name = rng.choice(sorted(FUNCTIONS))
+    args = ', '.join(random_expression(rng, depth + 1) for _ in range(FUNCTIONS[name]))
+    return f'{name}({args})'
+
+
+class Reference(np.ndarray):
+    """ndarray with the documented formula semantics: x / 0 and x % 0 are NaN, comparisons are 0/1"""
+
+    def _plain(self):
+        return self.view(np.ndarray)
+
+    def __truediv__(self, other):
+        return np.where(np.asarray(other) == 0, np.nan, np.true_divide(self._plain(), other)).view(Reference)
+
+    def __rtruediv__(self, other):
+        return np.where(self._plain() == 0, np.nan, np.true_divide(other, self._plain())).view(Reference)
+
+    def __mod__(self, other):
+        return np.where(np.asarray(other) == 0, np.nan, np.mod(self._plain(), other)).view(Reference)
+
+    def __rmod__(self, other):
+        return np.where(self._plain() == 0, np.nan, np.mod(other, self._plain())).view(Reference)
+
+    def _compare(self, other, op):
+        return np.asarray(op(self._plain(), other), dtype=float).view(Reference)
+
+    def __lt__(self, other): return self._compare(other, np.less)
+    def __le__(self, other): return self._compare(other, np.less_equal)
+    def __gt__(self, other): return self._compare(other, np.greater)
+    def __ge__(self, other): return self._compare(other, np.greater_equal)
+    def __eq__(self, other): return self._compare(other, np.equal)
+    def __ne__(self, other): return self._compare(other, np.not_equal)
+
+
+def reference(text, arrays):
+    """Plain NumPy evaluation of the formula text, with non-finite results as NaN"""
+    arrays = {band: values.view(Reference) for band, values in arrays.items()}
+    namespace = {**REFERENCE_FUNCTIONS, **arrays, **{alias: arrays[band] for alias, band in ALIASES.items()},
+                 'b': lambda name: arrays[name]}
+    with np.errstate(all='ignore'):
+        result = eval(text, {'__builtins__': {}}, namespace)  # noqa: S307 - trusted, generated input
+        result = np.broadcast_to(np.asarray(result, dtype=float), arrays['B2'].shape).view(np.ndarray).copy()
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+@pytest.mark.parametrize('seed', range(500))
+def test_fuzz_against_numpy_reference(seed):
+    rng = random.Random(seed)
+    text = random_expression(rng)
+    arrays = band_arrays(seed)
+    try:
+        expected = reference(text, arrays)
+    except (ZeroDivisionError, TypeError):
+        expected = None  # Python raises on constant x / 0, and (-x) ** 0.5 is complex
+    try:
+        compiled = compile_formula(text, BANDS, ALIASES)
+    except FormulaError as e:
+        # Only constant subexpressions that are not finite numbers are rejected
+        assert 'Division by zero' in str(e) or 'not a finite number' in str(e), text
+        return
+    assert expected is not None, text
+    result = compiled.evaluate(arrays)
+    if result.ndim == 0:
+        result = np.broadcast_to(result, expected.shape)
+    np.testing.assert_allclose(result, expected, rtol=1e-9, atol=0, equal_nan=True, err_msg=text)
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_fuzz_rejects_garbage_with_formula_error(seed):
+    rng = random.Random(seed)
+    tokens = ['B4', 'NIR', '(', ')', '+', '-', '*', '/', '**', '%', '<', '.', '[', ']', ',', 'lambda', ':',
+              'min', 'max', 'b', "'B4'", '__import__', 'x', '1', '2.5', 'if', 'else', '=', 'not', 'and']
+    text = ' '.join(rng.choice(tokens) for _ in range(rng.randint(1, 8)))
+    try:
+        compile_formula(text, BANDS, ALIASES)
+    except FormulaError:
+        pass
+
+
+@pytest.mark.parametrize('text', ['min(B4)', 'max(B4, B5, B2)', 'sqrt(B4, B5)', 'min()'])
+def test_wrong_arity_is_a_formula_error(text):
+    with pytest.raises(FormulaError, match='takes'):
+        compile_formula(text, BANDS, ALIASES)
+
+
+def test_local_calculator_matches_reference():
+    arrays = band_arrays(42)
+    calculator = LocalIndexCalculator()
+    calculator.register('key', arrays)
+    text = '(NIR - RED) / (NIR + RED)'
+    summary = calculator.compute('key', text, ALIASES)
+    expected = reference(text, arrays)
+    finite = expected[np.isfinite(expected)]
+    assert summary['count'] == finite.size
+    assert summary['stats']['mean'] == pytest.approx(finite.mean())
+    assert summary['stats']['p50'] == pytest.approx(np.percentile(finite, 50))
+    np.testing.assert_allclose(evaluate(text, arrays, ALIASES), expected, equal_nan=True)
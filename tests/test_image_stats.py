@@ -0,0 +1,33 @@
+import ee
+
+from engine import BAND_CONFIG
+from image_stats import compute_image_stats
+
+CONFIG = BAND_CONFIG['Landsat 8']
+ROI = {'type': 'Polygon', 'coordinates': [[[91.7, 26.1], [91.8, 26.1], [91.8, 26.2], [91.7, 26.2], [91.7, 26.1]]]}
+
+
+def server_result():
+    stats = {}
+    for band in CONFIG['bands'] + ['NDVI', 'NDWI']:
+        stats.update({f'{band}_count': 100, f'{band}_mean': 0.2, f'{band}_min': 0.0, f'{band}_max': 0.5,
+                      f'{band}_stdDev': 0.1, f'{band}_p10': 0.05, f'{band}_p50': 0.2, f'{band}_p90': 0.4})
+    return {'bands': CONFIG['bands'], 'stats': stats, 'bounds': ROI}
+
+
+def test_compute_image_stats_is_one_round_trip(offline_ee, monkeypatch):
+    calls = []
+
+    def compute_value(obj):
+        calls.append(obj)
+        return server_result()
+
+    monkeypatch.setattr(ee.data, 'computeValue', compute_value)
+    image = ee.Image.constant([0.1] * len(CONFIG['bands'])).rename(CONFIG['bands'])
+    result = compute_image_stats(image, ee.Geometry(ROI), CONFIG['common'], scale=CONFIG['scale'])
+
+    assert len(calls) == 1
+    assert result['bands'] == CONFIG['bands']
+    assert set(result['stats']) == set(CONFIG['bands'])
+    assert result['indices']['NDVI']['p50'] == 0.2
+    assert result['stats']['B4']['mean'] == 0.2
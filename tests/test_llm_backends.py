@@ -0,0 +1,61 @@
+import pytest
+
+from chat_session import ChatSession
+from llm_backends import FakeBackend, LLMClient, backend_from_env
+
+QUESTION = [{'role': 'user', 'content': 'Is the vegetation healthy?'}]
+
+
+def test_fake_backend_end_to_end_through_chat_session():
+    backend = FakeBackend(reply=lambda messages: '<think>NDVI is 0.6</think>Yes, NDVI is 0.6.')
+    client = LLMClient(backend)
+    reply = ChatSession(model='tiny', client=client).ask('Is it healthy?', 'NDVI mean 0.6',
+                                                         on_update=lambda splitter, stats: None)
+    assert reply.answer == 'Yes, NDVI is 0.6.'
+    assert reply.thinking == 'NDVI is 0.6'
+    assert backend.requests[-1]['stream'] is True
+    assert 'NDVI mean 0.6' in backend.requests[-1]['messages'][-1]['content']
+
+
+def test_fallback_on_failure_is_recorded():
+    backend = FakeBackend(fail_models={'big'})
+    client = LLMClient(backend, fallback_model='small')
+    response = client.chat('big', QUESTION)
+    assert response['message']['content'] == 'Echo: Is the vegetation healthy?'
+    assert [r['model'] for r in backend.requests] == ['big', 'small']
+    failed, answered = list(client.latencies)
+    assert failed['model'] == 'big' and 'Fake timeout' in failed['error'] and not failed['fallback']
+    assert answered['model'] == 'small' and answered['error'] is None and answered['fallback']
+    assert client.latency_summary()['small']['requests'] == 1
+
+
+def test_streaming_fallback_and_first_token_latency():
+    backend = FakeBackend(fail_models={'big'}, latency=0.01)
+    client = LLMClient(backend, fallback_model='small')
+    chunks = list(client.chat('big', QUESTION, stream=True))
+    assert ''.join(c['message']['content'] for c in chunks) == 'Echo: Is the vegetation healthy?'
+    record = client.latencies[-1]
+    assert record['stream'] and record['fallback']
+    assert 0 < record['first_token'] <= record['total']
+    assert record['prompt_tokens'] > 0
+
+
+def test_failure_without_fallback_raises():
+    client = LLMClient(FakeBackend(fail_models={'big'}))
+    with pytest.raises(TimeoutError):
+        client.chat('big', QUESTION)
+    assert client.latencies[-1]['error'] is not None
+
+
+def test_tool_calls_and_warmup():
+    backend = FakeBackend(tool_calls=lambda messages: [('region_stats', {})])
+    client = LLMClient(backend)
+    response = client.chat('tiny', QUESTION, tools=[{'type': 'function'}])
+    assert response['message']['tool_calls'][0]['function']['name'] == 'region_stats'
+    assert client.warmup('tiny', system='You are GeeMapBot') is True
+    assert client.latencies[-1]['kind'] == 'warmup'
+
+
+def test_backend_from_env_selects_fake(monkeypatch):
+    monkeypatch.setenv('GEEMAPBOT_LLM_BACKEND', 'fake')
+    assert isinstance(backend_from_env(), FakeBackend)
@@ -0,0 +1,84 @@
+import json
+import math
+
+import ee
+import numpy as np
+import pytest
+
+from engine import BAND_CONFIG, INDEX_FORMULAS, AnalysisEngine
+from export import mercator
+from local_index import MAX_SAMPLE_PIXELS, LocalIndexCalculator, mercator_scale, sample_scale
+from roi import geojson_bounds
+
+
+def square(lon, lat, half_deg):
+    ring = [[lon - half_deg, lat - half_deg], [lon + half_deg, lat - half_deg],
+            [lon + half_deg, lat + half_deg], [lon - half_deg, lat + half_deg], [lon - half_deg, lat - half_deg]]
+    return {'type': 'Polygon', 'coordinates': [ring]}
+
+
+@pytest.mark.parametrize('lat', [0, 26, 45, 60, 70])
+def test_sample_grid_fits_sample_rectangle(lat):
+    roi = square(10, lat, 0.1)
+    scale = mercator_scale(roi, sample_scale(roi, 10))
+    west, south, east, north = geojson_bounds(roi)
+    min_x, min_y = mercator(west, south)
+    max_x, max_y = mercator(east, north)
+    pixels = math.ceil((max_x - min_x) / scale) * math.ceil((max_y - min_y) / scale)
+    assert pixels <= MAX_SAMPLE_PIXELS * 1.01
+
+
+@pytest.mark.parametrize('satellite', ['Landsat 8', 'Sentinel-2'])
+@pytest.mark.parametrize('name', ['NDVI', 'ndwi ', 'EVI', 'SAVI'])
+def test_named_index_matches_its_formula_on_every_path(offline_ee, satellite, name):
+    engine = AnalysisEngine()
+    config = BAND_CONFIG[satellite]
+    named = engine.compile_index(satellite, name)
+    explicit = engine.compile_index(satellite, INDEX_FORMULAS[name.strip().upper()], config['common'])
+    assert named.ir == explicit.ir
+
+    # Local Index Stats
+    rng = np.random.default_rng(0)
+    calculator = LocalIndexCalculator()
+    calculator.register('key', {band: rng.uniform(0.01, 0.4, (16, 16)) for band in config['bands']})
+    local = calculator.compute('key', named)
+    by_text = calculator.compute('key', INDEX_FORMULAS[name.strip().upper()], config['common'])
+    assert local['count'] == 256
+    assert local == by_text
+
+    # Calculate Index, Time Series and Change build the same server-side graph
+    image = ee.Image.constant([0.1] * len(config['bands'])).rename(config['bands'])
+    assert named.to_ee(image).serialize() == explicit.to_ee(image).serialize()
+
+
+def test_load_samples_at_the_satellite_scale(offline_ee, monkeypatch):
+    config = BAND_CONFIG['Sentinel-2']
+    roi = square(91.7, 26.1, 0.01)
+    requests = []
+
+    def compute_value(obj):
+        requests.append(json.loads(obj.serialize()))
+        return {'properties': {band: [[0.1, 0.2], [0.3, -9999]] for band in config['bands']}}
+
+    monkeypatch.setattr(ee.data, 'computeValue', compute_value)
+    image = ee.Image.constant([0.1] * len(config['bands'])).rename(config['bands'])
+    arrays = LocalIndexCalculator().load('key', image, roi, config['bands'], config['scale'])
+
+    assert len(requests) == 1
+    scales = [v['constantValue'] for v in find_values(requests[0], 'scale')]
+    assert scales == [pytest.approx(mercator_scale(roi, 10))]
+    assert np.isnan(arrays['B8'][1, 1])
+
+
+def find_values(node, name):
+    """Every argument called ``name`` in a serialized EE graph"""
+    found = []
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == name and isinstance(value, dict) and 'constantValue' in value:
+                found.append(value)
+            found += find_values(value, name)
+    elif isinstance(node, list):
+        for value in node:
+            found += find_values(value, name)
+    return found
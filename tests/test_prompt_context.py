@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from chat_session import ChatSession
+from engine import AnalysisEngine, AnalysisState
+from llm_backends import FakeBackend, LLMClient
+from prompt_context import SYSTEM_PROMPT, ContextBuilder, band_lines, build_messages, estimate_tokens
+
+ROI = {'type': 'Polygon', 'coordinates': [[[91.7, 26.1], [91.8, 26.1], [91.8, 26.2], [91.7, 26.2], [91.7, 26.1]]]}
+STATS = {'count': 1200, 'mean': 0.31, 'stdDev': 0.08, 'min': 0.02, 'max': 0.71, 'p50': 0.3}
+
+
+def random_line(rng):
+    return ' '.join(rng.choice(['NDVI', 'mean', '0.412', 'B4', 'n=12,034 px', 'range', 'sd', '-0.05..0.9'])
+                    for _ in range(rng.randint(1, 30)))
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_context_stays_within_budget(seed):
+    rng = random.Random(seed)
+    budget = rng.randint(8, 400)
+    builder = ContextBuilder(budget_tokens=budget)
+    for i in range(rng.randint(1, 8)):
+        builder.add(f'Section {i}', [random_line(rng) for _ in range(rng.randint(1, 40))], priority=rng.randint(1, 5))
+    assert estimate_tokens(builder.build()) <= budget
+
+
+def test_priorities_truncation_and_dedupe():
+    builder = ContextBuilder(budget_tokens=60)
+    builder.add('Low priority', ['x' * 40] * 3, priority=5)
+    builder.add('Data', ['Satellite: Sentinel-2'], priority=1)
+    builder.add('Data again', ['Satellite: Sentinel-2'], priority=1)  # Same body: skipped
+    builder.add('Bands', [f'B{i}: mean 0.1' for i in range(40)], priority=2)
+    built = builder.build()
+    assert built.startswith('## Data\nSatellite: Sentinel-2\n\n## Bands\nB0: mean 0.1')
+    assert 'Data again' not in built and 'Low priority' not in built
+    assert 'more lines omitted)' in built
+    assert estimate_tokens(built) <= 60
+
+
+def test_system_prefix_is_byte_stable():
+    engine = AnalysisEngine()
+    state = AnalysisState()
+    contexts = []
+    for stats in (None, {'stats': {'B4': STATS}, 'indices': {'NDVI': STATS}}):
+        contexts.append(engine.chat_context('Sentinel-2', '2024-01-01', '2024-03-01', 40, 'median', ROI,
+                                            stats=stats, state=state))
+    systems = [build_messages(context, 'How green is it?')[0]['content'] for context in contexts]
+    assert systems == [SYSTEM_PROMPT, SYSTEM_PROMPT]
+    assert band_lines({'B4': STATS})[0] in contexts[1] and 'B4' not in contexts[0]
+
+    # Every request of a conversation starts with the previous one, system prompt first
+    backend = FakeBackend()
+    session = ChatSession(model='tiny', client=LLMClient(backend))
+    for i, context in enumerate(contexts + contexts[-1:]):
+        session.ask(f'Question {i}?', context=context)
+    requests = [r['messages'] for r in backend.requests]
+    for previous, current in zip(requests, requests[1:]):
+        assert current[0]['content'].encode('utf-8') == SYSTEM_PROMPT.encode('utf-8')
+        assert current[:len(previous)] == previous
+    assert requests[-1][-1]['content'] == 'Question 2?'  # Unchanged context is not sent again
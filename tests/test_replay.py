@@ -0,0 +1,65 @@
+import os
+import sys
+
+import ee
+import pytest
+
+import ee_quota
+from llm_backends import FakeBackend, LLMClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from replay import Fixtures, RecordingBackend, ReplayBackend, record_ee, replay_ee  # noqa: E402
+
+
+@pytest.fixture
+def fresh_wrappers(monkeypatch):
+    """Keep the record/replay wrappers installed here out of other tests"""
+    monkeypatch.setattr(ee_quota, '_originals', {})
+    monkeypatch.setattr(ee_quota, '_installed', {})
+    monkeypatch.setattr(ee_quota, '_wrappers', {})
+
+
+def test_record_then_replay_offline(offline_ee, fresh_wrappers, monkeypatch, tmp_path):
+    server_calls = []
+
+    def compute_value(obj):
+        server_calls.append(obj)
+        return 42
+
+    def get_map_id(params):
+        return {'mapid': 'abc', 'token': '', 'tile_fetcher': ee.data.TileFetcher('https://tiles/abc/{z}/{x}/{y}',
+                                                                                  map_name='abc')}
+
+    monkeypatch.setattr(ee.data, 'computeValue', compute_value)
+    monkeypatch.setattr(ee.data, 'getMapId', get_map_id)
+    fixtures = Fixtures()
+    record_ee(fixtures)
+    assert ee.Number(40).add(2).getInfo() == 42
+    ee.Image.constant(1).getMapId({'min': 0, 'max': 1})
+    path = str(tmp_path / 'flow.json.gz')
+    fixtures.save(path)
+
+    # Replay in a fresh EE state: no server, no credentials, no discovery request
+    ee.Reset()
+    monkeypatch.setattr(ee.data, 'computeValue', lambda obj: pytest.fail('computeValue reached the server'))
+    replay_ee(Fixtures.load(path), latency=0)
+    assert ee.Number(40).add(2).getInfo() == 42
+    map_id = ee.Image.constant(1).getMapId({'min': 0, 'max': 1})
+    assert map_id['tile_fetcher'].url_format == 'https://tiles/abc/{z}/{x}/{y}'
+    assert len(server_calls) == 1
+    with pytest.raises(ee.EEException, match='No recorded response'):
+        ee.Number(1).add(1).getInfo()
+
+
+def test_llm_record_then_replay():
+    fixtures = Fixtures()
+    recording = LLMClient(RecordingBackend(FakeBackend(reply=lambda messages: 'NDVI looks healthy'), fixtures))
+    messages = [{'role': 'user', 'content': 'How healthy?'}]
+    streamed = ''.join(c['message']['content'] for c in recording.chat('tiny', messages, stream=True))
+    plain = recording.chat('tiny', messages)['message']['content']
+
+    replaying = LLMClient(ReplayBackend(fixtures, latency=0))
+    assert ''.join(c['message']['content'] for c in replaying.chat('tiny', messages, stream=True)) == streamed
+    assert replaying.chat('tiny', messages)['message']['content'] == plain == 'NDVI looks healthy'
+    with pytest.raises(KeyError):
+        replaying.chat('tiny', [{'role': 'user', 'content': 'Something else'}])
@@ -0,0 +1,118 @@
+import pytest
+from starlette.testclient import TestClient
+
+import server as server_module
+from llm_backends import FakeBackend, LLMClient
+from server import GeeMapBotServer, create_app
+from tracing import Tracer
+
+ROI = {'type': 'Polygon', 'coordinates': [[[91.7, 26.1], [91.75, 26.1], [91.75, 26.14], [91.7, 26.14], [91.7, 26.1]]]}
+
+
+class FakeTileFetcher:
+    url_format = 'https://tiles/{z}/{x}/{y}'
+
+
+class FakeImage:
+    def getMapId(self, vis):
+        return {'tile_fetcher': FakeTileFetcher()}
+
+
+class FakeEngine:
+    """Just enough of AnalysisEngine for the routes; ``fail`` makes region_stats raise it"""
+
+    def __init__(self, fail=None):
+        self.fail = fail
+
+    def composite(self, satellite, start, end, cloud_cover, roi, method='median'):
+        if satellite not in ('Landsat 8', 'Sentinel-2'):
+            raise ValueError(f"Unknown satellite {satellite!r}")
+        return f'{satellite}:{start}:{end}', FakeImage()
+
+    def region_stats(self, key, image, roi, satellite, progress=None):
+        if self.fail is not None:
+            raise self.fail
+        return {'stats': {}}
+
+    def chat_context(self, *args, **kwargs):
+        return 'context'
+
+
+@pytest.fixture
+def make_client():
+    def make(engine=None):
+        server = GeeMapBotServer(engine=engine or FakeEngine(), llm=LLMClient(FakeBackend()))
+        return server, TestClient(create_app(server, initialize=False), raise_server_exceptions=False)
+    return make
+
+
+def load(client, start='2024-01-01'):
+    session_id = client.post('/sessions').json()['session_id']
+    response = client.post(f'/sessions/{session_id}/composite', json={'start': start, 'end': '2024-03-01', 'roi': ROI})
+    assert response.status_code == 200
+    return session_id
+
+
+def test_client_errors_are_400(make_client):
+    _, client = make_client()
+    session_id = client.post('/sessions').json()['session_id']
+    response = client.post(f'/sessions/{session_id}/composite',
+                           json={'satellite': 'Landsat 5', 'start': '2024-01-01', 'end': '2024-03-01', 'roi': ROI})
+    assert response.status_code == 400 and 'Unknown satellite' in response.json()['error']
+    assert client.get(f'/sessions/{session_id}/stats').status_code == 400  # Nothing loaded yet
+
+
+@pytest.mark.parametrize('error', [KeyError('B4'), TypeError('unsupported operand')])
+def test_engine_bugs_are_not_client_errors(make_client, error):
+    _, client = make_client(FakeEngine(fail=error))
+    session_id = load(client)
+    assert client.get(f'/sessions/{session_id}/stats').status_code == 500
+
+
+@pytest.mark.parametrize('route', ['composite', 'index', 'series', 'change', 'chat'])
+@pytest.mark.parametrize('body', ['{not json', '[1, 2]'])
+def test_malformed_json_is_400(make_client, route, body):
+    _, client = make_client()
+    session_id = client.post('/sessions').json()['session_id']
+    response = client.post(f'/sessions/{session_id}/{route}', content=body,
+                           headers={'content-type': 'application/json'})
+    assert response.status_code == 400
+
+
+def test_bad_threshold_is_400(make_client):
+    _, client = make_client()
+    session_id = load(client)
+    response = client.post(f'/sessions/{session_id}/change',
+                           json={'start_b': '2025-01-01', 'end_b': '2025-03-01', 'threshold': 'high'})
+    assert response.status_code == 400
+
+
+def test_close_drops_chats_of_every_composite(make_client):
+    server, client = make_client()
+    session_id = load(client)
+    other_id = load(client)
+    assert client.post(f'/sessions/{session_id}/chat', json={'question': 'Healthy?'}).status_code == 200
+    load_again = client.post(f'/sessions/{session_id}/composite',
+                             json={'start': '2023-01-01', 'end': '2023-03-01', 'roi': ROI})
+    assert load_again.status_code == 200
+    assert client.post(f'/sessions/{session_id}/chat', json={'question': 'And now?'}).status_code == 200
+    assert client.post(f'/sessions/{other_id}/chat', json={'question': 'Healthy?'}).status_code == 200
+    assert len([k for k in server.chat_sessions.sessions.keys() if k[0] == session_id]) == 2
+
+    assert client.delete(f'/sessions/{session_id}').status_code == 204
+    assert [k[0] for k in server.chat_sessions.sessions.keys()] == [other_id]
+    assert client.get(f'/sessions/{session_id}/stats').status_code == 404
+
+
+@pytest.mark.parametrize('query, status, spans', [('', 200, 3), ('?n=2', 200, 2), ('?n=0', 200, 1),
+                                                  ('?n=-5', 200, 1), ('?n=abc', 400, None)])
+def test_trace_count_parameter(make_client, monkeypatch, query, status, spans):
+    _, client = make_client()
+    tracer = Tracer()
+    for i in range(3):
+        tracer.record(f'span.{i}', 0.01)
+    monkeypatch.setattr(server_module, 'tracer', tracer)
+    response = client.get(f'/trace{query}')
+    assert response.status_code == status
+    if spans is not None:
+        assert [s['name'] for s in response.json()['spans']] == [f'span.{i}' for i in range(3)][-spans:]
@@ -0,0 +1,37 @@
+import os
+
+from tile_cache import TileCache, TileProxy, tile_proxy_from_env
+
+
+def test_hit_counted_only_after_successful_read(tmp_path):
+    cache = TileCache(str(tmp_path))
+    cache.put(('layer', 1, 0, 0), b'png')
+    assert cache.get(('layer', 1, 0, 0)) == b'png'
+    os.remove(os.path.join(str(tmp_path), 'layer', '1', '0', '0.png'))
+    assert cache.get(('layer', 1, 0, 0)) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    assert cache.stats()['tiles'] == 0 and cache.stats()['bytes'] == 0
+
+
+def test_public_url_and_bounded_upstreams(tmp_path):
+    proxy = TileProxy(TileCache(str(tmp_path)), public_url='https://maps.example.org/tiles-proxy/', max_layers=2)
+    try:
+        template = proxy.register({'layer': 1}, 'https://earthengine.example/1/{z}/{x}/{y}')
+        assert template.startswith('https://maps.example.org/tiles-proxy/tiles/')
+        proxy.register({'layer': 2}, 'https://earthengine.example/2/{z}/{x}/{y}')
+        proxy.register({'layer': 3}, 'https://earthengine.example/3/{z}/{x}/{y}')
+        assert len(proxy._upstream) == 2
+    finally:
+        proxy._server.server_close()
+
+
+def test_tile_proxy_from_env(tmp_path, monkeypatch):
+    monkeypatch.delenv('GEEMAPBOT_TILE_CACHE_DIR', raising=False)
+    assert tile_proxy_from_env() is None
+    monkeypatch.setenv('GEEMAPBOT_TILE_CACHE_DIR', str(tmp_path))
+    monkeypatch.setenv('GEEMAPBOT_TILE_PROXY_URL', 'http://kernel-host:8765')
+    proxy = tile_proxy_from_env()
+    try:
+        assert proxy.base_url == 'http://kernel-host:8765'
+    finally:
+        proxy.stop()
@@ -0,0 +1,44 @@
+from datetime import date, datetime
+
+import time_series
+from time_series import TimeSeriesEngine, bucket_starts, parse_date
+
+CONFIG = {'bands': ['B4', 'B5'], 'scale': 30}
+ROI = {'type': 'Point', 'coordinates': [91.7, 26.1]}
+
+
+def test_parse_date_normalizes_datetimes():
+    assert parse_date(datetime(2023, 1, 1, 12, 30)) == date(2023, 1, 1)
+    assert type(parse_date(datetime(2023, 1, 1))) is date
+    assert parse_date(date(2023, 1, 1)) == date(2023, 1, 1)
+    assert parse_date('2023-01-01T00:00:00') == date(2023, 1, 1)
+
+
+def test_bucket_starts_with_datetime_pickers():
+    starts = bucket_starts(parse_date(datetime(2023, 1, 1)), parse_date(datetime(2023, 4, 15)), 'month')
+    assert starts == [date(2023, 1, 1), date(2023, 2, 1), date(2023, 3, 1), date(2023, 4, 1)]
+
+
+def fake_fetch(values):
+    def fetch(config, start, end, cloud_cover, roi, compiled, period='image', reducer='mean'):
+        assert type(start) is date and type(end) is date
+        return {d: v for d, v in values.items() if start.isoformat() <= d < end.isoformat()}
+    return fetch
+
+
+def test_series_with_datetime_inputs(monkeypatch):
+    values = {'2023-01-01': 0.1, '2023-01-17': 0.2, '2023-02-02': 0.3}
+    monkeypatch.setattr(time_series, 'fetch_series', fake_fetch(values))
+    engine = TimeSeriesEngine()
+    series = engine.series('Landsat 8', CONFIG, datetime(2023, 1, 1), datetime(2023, 3, 1), 60, ROI, 'B5 - B4')
+    # The first day's point is kept although the pickers hold datetimes
+    assert series == [('2023-01-01', 0.1), ('2023-01-17', 0.2), ('2023-02-02', 0.3)]
+
+
+def test_monthly_series_with_datetime_inputs(monkeypatch):
+    values = {'2023-01-01': 0.1, '2023-02-01': 0.2}
+    monkeypatch.setattr(time_series, 'fetch_series', fake_fetch(values))
+    engine = TimeSeriesEngine()
+    series = engine.series('Landsat 8', CONFIG, datetime(2023, 1, 10), datetime.today(), 60, ROI, 'B5 - B4',
+                           period='month')
+    assert series == [('2023-01-01', 0.1), ('2023-02-01', 0.2)]
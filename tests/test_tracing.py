@@ -0,0 +1,62 @@
+import pytest
+
+from tracing import Tracer, prometheus_labels
+
+
+def sample_lines(text, prefix):
+    return [line for line in text.splitlines() if line.startswith(prefix)]
+
+
+def test_histogram_buckets_are_cumulative():
+    tracer = Tracer(buckets=(0.1, 1, 10))
+    for seconds in (0.05, 0.1, 0.5, 2, 20):
+        tracer.record('ee.getInfo', seconds)
+    text = tracer.prometheus()
+    assert sample_lines(text, 'geemapbot_span_duration_seconds_bucket') == [
+        'geemapbot_span_duration_seconds_bucket{span="ee.getInfo",le="0.1"} 2',
+        'geemapbot_span_duration_seconds_bucket{span="ee.getInfo",le="1"} 3',
+        'geemapbot_span_duration_seconds_bucket{span="ee.getInfo",le="10"} 4',
+        'geemapbot_span_duration_seconds_bucket{span="ee.getInfo",le="+Inf"} 5',
+    ]
+    assert sample_lines(text, 'geemapbot_span_duration_seconds_count') == [
+        'geemapbot_span_duration_seconds_count{span="ee.getInfo"} 5'
+    ]
+    (sum_line,) = sample_lines(text, 'geemapbot_span_duration_seconds_sum')
+    assert float(sum_line.split()[-1]) == pytest.approx(22.65)
+    assert text.count('# TYPE geemapbot_span_duration_seconds histogram') == 1
+    assert text.endswith('\n')
+
+
+def test_counters_and_summary():
+    tracer = Tracer()
+    tracer.record('cache.stats', 0.01, cache='hit')
+    tracer.record('cache.stats', 0.02, cache='miss')
+    tracer.record('ee.getInfo', 0.5, bytes=1200, error=TimeoutError('slow'))
+    assert tracer.counters[('geemapbot_spans_total', 'cache.stats', ())] == 2
+    assert tracer.counters[('geemapbot_cache_lookups_total', 'cache.stats', (('result', 'hit'),))] == 1
+    assert tracer.counters[('geemapbot_span_bytes_total', 'ee.getInfo', ())] == 1200
+
+    text = tracer.prometheus()
+    assert '# TYPE geemapbot_span_errors_total counter' in text
+    assert 'geemapbot_span_errors_total{span="ee.getInfo"} 1' in text
+    assert 'geemapbot_cache_lookups_total{span="cache.stats",result="miss"} 1' in text
+
+    summary = tracer.summary()
+    assert summary['cache.stats']['count'] == 2 and summary['cache.stats']['hit_rate'] == 0.5
+    assert summary['ee.getInfo'] == {'count': 1, 'errors': 1, 'total': 0.5, 'p50': 0.5, 'p95': 0.5,
+                                     'bytes': 1200, 'hit_rate': None}
+
+
+def test_label_values_are_escaped():
+    assert prometheus_labels(span='a"b\\c\nd') == '{span="a\\"b\\\\c\\nd"}'
+    tracer = Tracer(buckets=(1,))
+    tracer.record('tile "proxy"', 0.5)
+    assert 'geemapbot_spans_total{span="tile \\"proxy\\""} 1' in tracer.prometheus()
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer()
+    tracer.enabled = False
+    with tracer.span('x'):
+        pass
+    assert tracer.prometheus() == '\n' and tracer.summary() == {}
@@ -0,0 +1,240 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from composite_cache import LRUCache
+from tracing import tracer
+
+# =============================================
+# On-Disk Tile Cache
+# =============================================
+def params_hash(params):
+    """Short stable hash of the map-ID parameters identifying a layer"""
+    return hashlib.sha256(repr(params).encode('utf-8')).hexdigest()[:24]
+
+
+class TileCache:
+    """PNG tiles on disk keyed by (params hash, z, x, y), bounded by a byte budget
+
+    The LRU order is kept in memory and rebuilt from file modification times when
+    the cache is reopened, so the least recently used tiles are evicted first.
+    """
+
+    def __init__(self, root, max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._index = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def get(self, key):
+        path = self._path(key)
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            # Removed behind our back: forget it and count the lookup as a miss
+            with self._lock:
+                self.total_bytes -= self._index.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.total_bytes += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._evict()
+
+    def stats(self):
+        return {
+            'tiles': len(self._index),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _path(self, key):
+        layer, z, x, y = key
+        return os.path.join(self.root, layer, str(z), str(x), f'{y}.png')
+
+    def _scan(self):
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.endswith('.png'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                parts = os.path.relpath(path, self.root).split(os.sep)
+                if len(parts) != 4:
+                    continue
+                stat = os.stat(path)
+                key = (parts[0], int(parts[1]), int(parts[2]), int(parts[3][:-4]))
+                found.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(found):
+            self._index[key] = size
+            self.total_bytes += size
+        with self._lock:
+            self._evict()
+
+# =============================================
+# Local Tile Proxy
+# =============================================
+class TileProxy:
+    """Local HTTP server fronting Earth Engine tile URLs with a TileCache
+
+    ``register`` maps a layer's map-ID parameters to its upstream URL template and
+    returns a local template for the TileLayer. Cache misses are fetched through a
+    pooled HTTP session shared by all request threads.
+
+    The tile URLs point at ``public_url`` (default: the bound host and port). The
+    default loopback host only works when the browser runs on the kernel's
+    machine; under Voila served to remote browsers, bind ``host='0.0.0.0'`` and
+    set ``public_url`` to the address the browsers reach the proxy at.
+    """
+
+    def __init__(self, cache, host='127.0.0.1', port=0, public_url=None, max_layers=256, pool_size=16,
+                 timeout=30):
+        self.cache = cache
+        self.timeout = timeout
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self._upstream = LRUCache(max_layers)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        if self.public_url:
+            return self.public_url
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._session.close()
+        self._thread = None
+
+    def register(self, params, upstream_url):
+        """Return the local URL template serving ``upstream_url`` through the cache"""
+        layer = params_hash(params)
+        self._upstream.put(layer, upstream_url)
+        return f'{self.base_url}/tiles/{layer}/{{z}}/{{x}}/{{y}}'
+
+    def fetch(self, layer, z, x, y):
+        """Tile bytes from the cache, falling back to the upstream server"""
+        key = (layer, z, x, y)
+        with tracer.span('tile', z=z) as span:
+            data = self.cache.get(key)
+            if data is not None:
+                span.set(cache='hit', bytes=len(data))
+                return data
+            upstream = self._upstream.get(layer)
+            if upstream is None:
+                return None
+            span.set(cache='miss')
+            response = self._session.get(upstream.format(z=z, x=x, y=y), timeout=self.timeout)
+            response.raise_for_status()
+            data = response.content
+            span.set(bytes=len(data))
+            self.cache.put(key, data)
+            return data
+
+    def _handler(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive for the browser's tile requests
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                try:
+                    if len(parts) != 5 or parts[0] != 'tiles':
+                        raise ValueError(self.path)
+                    data = proxy.fetch(parts[1], int(parts[2]), int(parts[3]), int(parts[4]))
+                except ValueError:
+                    self.send_error(400)
+                    return
+                except requests.RequestException as e:
+                    status = getattr(e.response, 'status_code', None) or 502
+                    self.send_error(status)
+                    return
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('Cache-Control', 'max-age=86400')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def tile_proxy_from_env():
+    """Started TileProxy when GEEMAPBOT_TILE_CACHE_DIR is set, otherwise None
+
+    GEEMAPBOT_TILE_PROXY_HOST / _PORT choose the bind address (default
+    127.0.0.1 and a free port) and GEEMAPBOT_TILE_PROXY_URL the URL browsers use.
+    """
+    cache_dir = os.environ.get('GEEMAPBOT_TILE_CACHE_DIR')
+    if not cache_dir:
+        return None
+    return TileProxy(
+        TileCache(cache_dir),
+        host=os.environ.get('GEEMAPBOT_TILE_PROXY_HOST', '127.0.0.1'),
+        port=int(os.environ.get('GEEMAPBOT_TILE_PROXY_PORT', 0)),
+        public_url=os.environ.get('GEEMAPBOT_TILE_PROXY_URL')
+    ).start()
@@ -0,0 +1,188 @@
+import io
+import threading
+from datetime import date, datetime, timedelta
+
+import ee
+
+from composite_cache import LRUCache, roi_hash
+from composites import build_collection
+from formula import compile_formula
+
+# =============================================
+# Date Buckets
+# =============================================
+PERIOD_MONTHS = {'month': 1, 'season': 3}
+
+
+def parse_date(value):
+    """A ``date`` from a date, a datetime (e.g. a DatePicker value) or a 'YYYY-MM-DD' string"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def bucket_start(day, period):
+    """First day of the bucket containing ``day`` (seasons are DJF, MAM, JJA, SON)"""
+    if period == 'image':
+        return day
+    if period == 'month':
+        return day.replace(day=1)
+    month = day.month - (day.month % 3)  # Dec -> 12, Jan/Feb -> 0 (previous Dec)
+    if month == 0:
+        return date(day.year - 1, 12, 1)
+    return date(day.year, month, 1)
+
+
+def bucket_starts(start, end, period):
+    """Start dates of every bucket overlapping [start, end)"""
+    step = PERIOD_MONTHS[period]
+    current = bucket_start(start, period)
+    starts = []
+    while current < end:
+        starts.append(current)
+        month = current.month - 1 + step
+        current = date(current.year + month // 12, month % 12 + 1, 1)
+    return starts
+
+# =============================================
+# Server-Side Series Reduction
+# =============================================
+def fetch_series(config, start, end, cloud_cover, roi, compiled, period='image', reducer='mean'):
+    """Reduce the index over the ROI for every image or bucket in one request
+
+    Returns ``{'YYYY-MM-DD': value}``; images or buckets without valid pixels are
+    left out.
+    """
+    geometry = ee.Geometry(roi)
+    collection = build_collection(config, start.isoformat(), end.isoformat(), cloud_cover) \
+        .filterBounds(geometry)
+    ee_reducer = getattr(ee.Reducer, reducer)()
+
+    def reduce(image, label):
+        value = compiled.to_ee(image).reduceRegion(
+            reducer=ee_reducer,
+            geometry=geometry,
+            scale=config['scale'],
+            bestEffort=True
+        ).values().get(0)
+        return ee.Feature(None, {'date': label, 'value': value})
+
+    if period == 'image':
+        features = collection.map(lambda image: reduce(image, image.date().format('YYYY-MM-dd')))
+    else:
+        step = PERIOD_MONTHS[period]
+
+        def reduce_bucket(label):
+            bucket_begin = ee.Date(label)
+            bucket = collection.filterDate(bucket_begin, bucket_begin.advance(step, 'month'))
+            return ee.Algorithms.If(
+                bucket.size().gt(0),
+                reduce(bucket.median(), label),
+                ee.Feature(None, {'date': label, 'value': None})
+            )
+
+        labels = [d.isoformat() for d in bucket_starts(start, end, period)]
+        features = ee.FeatureCollection(ee.List(labels).map(reduce_bucket))
+
+    features = ee.FeatureCollection(features).filter(ee.Filter.notNull(['value']))
+    result = ee.Dictionary({
+        'dates': features.aggregate_array('date'),
+        'values': features.aggregate_array('value')
+    }).getInfo()
+    # Several images can share a date (adjacent scenes); keep their mean
+    totals = {}
+    for label, value in zip(result['dates'], result['values']):
+        total, count = totals.get(label, (0.0, 0))
+        totals[label] = (total + value, count + 1)
+    return {label: total / count for label, (total, count) in totals.items()}
+
+# =============================================
+# Incremental Series Cache
+# =============================================
+class SeriesEntry:
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.values = {}
+
+
+class TimeSeriesEngine:
+    """Index time series with incremental caching
+
+    A series is cached per (satellite, cloud threshold, ROI, compiled formula,
+    period, reducer) together with the date range it covers. Widening the range
+    only fetches the uncovered part; the last partial bucket is refetched because
+    new images may have landed in it.
+    """
+
+    def __init__(self, max_series=32):
+        self.cache = LRUCache(max_series)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def series(self, satellite, config, start, end, cloud_cover, roi, formula, aliases=None,
+               period='image', reducer='mean'):
+        """Sorted ``[(date, value)]`` for ``[start, end)``"""
+        start, end = parse_date(start), parse_date(end)
+        compiled = compile_formula(formula, config['bands'], aliases)
+        key = (satellite, cloud_cover, roi_hash(roi), compiled.ir, period, reducer)
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                entry = SeriesEntry()
+                self.cache.put(key, entry)
+
+        for fetch_start, fetch_end in self._missing(entry, start, end, period):
+            values = fetch_series(config, fetch_start, fetch_end, cloud_cover, roi, compiled, period, reducer)
+            with self._lock:
+                self.requests += 1
+                # Replace whatever was cached for the refetched span
+                span_start, span_end = fetch_start.isoformat(), fetch_end.isoformat()
+                entry.values = {d: v for d, v in entry.values.items() if not span_start <= d < span_end}
+                entry.values.update(values)
+                entry.start = fetch_start if entry.start is None else min(entry.start, fetch_start)
+                entry.end = fetch_end if entry.end is None else max(entry.end, fetch_end)
+
+        low, high = bucket_start(start, period).isoformat(), end.isoformat()
+        return sorted((d, v) for d, v in entry.values.items() if low <= d < high)
+
+    def _missing(self, entry, start, end, period):
+        start = bucket_start(start, period)
+        if entry.start is None:
+            return [(start, end)]
+        spans = []
+        if start < entry.start:
+            spans.append((start, entry.start))
+        if end > entry.end:
+            # The bucket holding the old end may have been partial
+            spans.append((min(bucket_start(entry.end - timedelta(days=1), period), entry.end), end))
+        return spans
+
+# =============================================
+# Chart Rendering
+# =============================================
+def render_series_png(series, title, ylabel='Index'):
+    """PNG line chart of a series; rendered off-screen so it is safe in worker threads"""
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(7, 3), dpi=100)
+    axes = figure.add_subplot(1, 1, 1)
+    if series:
+        dates = [parse_date(d) for d, _ in series]
+        axes.plot(dates, [v for _, v in series], marker='o', markersize=3, linewidth=1, color='#28A745')
+    axes.set_title(title, fontsize=10)
+    axes.set_ylabel(ylabel)
+    axes.grid(True, alpha=0.3)
+    figure.autofmt_xdate()
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+def series_to_context(series, digits=3, max_points=36):
+    """Compact 'date: value' listing of the most recent points for the chat prompt"""
+    points = series[-max_points:]
+    return ', '.join(f"{d}: {round(v, digits)}" for d, v in points)
@@ -0,0 +1,230 @@
+import bisect
+import html
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from ee_quota import wrap_ee_calls
+
+logger = logging.getLogger('geemapbot.trace')
+
+# =============================================
+# Spans
+# =============================================
+# Every EE request (getInfo, getMapId, ...), statistics cache lookup, proxied tile
+# and LLM request becomes one span record:
+#   {'name', 'ts', 'seconds', 'depth', 'thread', 'error', **attrs}
+# with attrs such as bytes, cache (hit/disk/miss) or model. Records are kept in a
+# ring buffer for the debug panel, aggregated into Prometheus-style metrics and
+# logged as one JSON object per line on the 'geemapbot.trace' logger.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Span:
+    """Handle yielded by ``Tracer.span``; ``set`` adds attributes before the span ends"""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class Tracer:
+    """Collects span records, per-span duration histograms and counters"""
+
+    def __init__(self, max_spans=2000, buckets=BUCKETS):
+        self.buckets = buckets
+        self.spans = deque(maxlen=max_spans)
+        self.histograms = {}
+        self.counters = {}
+        self.enabled = True
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        span = Span(name, attrs)
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        started = time.perf_counter()
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._local.depth = depth
+            self.record(name, time.perf_counter() - started, error=error, depth=depth, **span.attrs)
+
+    def record(self, name, seconds, error=None, depth=None, **attrs):
+        """Add a finished span, e.g. one timed elsewhere like a streamed LLM reply"""
+        if not self.enabled:
+            return
+        record = {
+            'name': name,
+            'ts': time.time(),
+            'seconds': seconds,
+            'depth': getattr(self._local, 'depth', 0) if depth is None else depth,
+            'thread': threading.current_thread().name,
+            'error': repr(error) if error is not None else None,
+            **attrs
+        }
+        with self._lock:
+            self.spans.append(record)
+            histogram = self.histograms.setdefault(name, [0] * (len(self.buckets) + 1) + [0.0])
+            histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[-1] += seconds
+            self._count('geemapbot_spans_total', name)
+            if error is not None:
+                self._count('geemapbot_span_errors_total', name)
+            if attrs.get('bytes'):
+                self._count('geemapbot_span_bytes_total', name, value=attrs['bytes'])
+            if attrs.get('cache'):
+                self._count('geemapbot_cache_lookups_total', name, result=attrs['cache'])
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record, default=str))
+
+    def _count(self, metric, span, value=1, **labels):
+        key = (metric, span, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def recent(self, n=50):
+        with self._lock:
+            return list(self.spans)[-n:]
+
+    def summary(self):
+        """Per span name: count, errors, total/p50/p95 seconds, bytes and cache hit rate"""
+        with self._lock:
+            records = list(self.spans)
+        summary = {}
+        for name in sorted({r['name'] for r in records}):
+            spans = [r for r in records if r['name'] == name]
+            seconds = sorted(r['seconds'] for r in spans)
+            lookups = [r['cache'] for r in spans if r.get('cache')]
+            summary[name] = {
+                'count': len(spans),
+                'errors': sum(r['error'] is not None for r in spans),
+                'total': sum(seconds),
+                'p50': seconds[len(seconds) // 2],
+                'p95': seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))],
+                'bytes': sum(r.get('bytes') or 0 for r in spans),
+                'hit_rate': sum(c != 'miss' for c in lookups) / len(lookups) if lookups else None
+            }
+        return summary
+
+    def prometheus(self):
+        """Counters and duration histograms in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            histograms = {name: list(h) for name, h in self.histograms.items()}
+            counters = dict(self.counters)
+        for metric in sorted({key[0] for key in counters}):
+            lines.append(f'# TYPE {metric} counter')
+            for (name, span, labels), value in sorted(counters.items(), key=lambda item: str(item[0])):
+                if name == metric:
+                    lines.append(f'{metric}{prometheus_labels(span=span, **dict(labels))} {value}')
+        if histograms:
+            lines.append('# TYPE geemapbot_span_duration_seconds histogram')
+        for name, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], histogram[:-1]):
+                cumulative += count
+                lines.append(f'geemapbot_span_duration_seconds_bucket{prometheus_labels(span=name, le=bound)} {cumulative}')
+            lines.append(f'geemapbot_span_duration_seconds_sum{prometheus_labels(span=name)} {histogram[-1]}')
+            lines.append(f'geemapbot_span_duration_seconds_count{prometheus_labels(span=name)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self.histograms.clear()
+            self.counters.clear()
+
+
+def prometheus_labels(**labels):
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+def payload_bytes(value):
+    """Approximate response size of an EE call: the length of its JSON form"""
+    if isinstance(value, (dict, list, str)):
+        return len(json.dumps(value, default=str))
+    return None
+
+
+# Process-wide tracer used by the caches, the tile proxy and the LLM client
+tracer = Tracer()
+
+# GEEMAPBOT_TRACE_LOG=path writes every span as a JSON line to that file
+if os.environ.get('GEEMAPBOT_TRACE_LOG'):
+    _handler = logging.FileHandler(os.environ['GEEMAPBOT_TRACE_LOG'])
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+
+def trace_ee_calls(tracer=tracer):
+    """Record a span for every EE server request (ee.data.computeValue, getMapId, ...)"""
+
+    def wrapper(name, call):
+        def traced(*args, **kwargs):
+            with tracer.span(f'ee.{name}') as span:
+                result = call(*args, **kwargs)
+                span.set(bytes=payload_bytes(result))
+                return result
+        return traced
+
+    wrap_ee_calls('trace', wrapper)
+    return tracer
+
+# =============================================
+# Debug Panel
+# =============================================
+class TracePanel:
+    """Widget with per-stage totals and the latest spans, refreshed on demand"""
+
+    def __init__(self, tracer=tracer, recent=25):
+        import ipywidgets as widgets
+
+        self.tracer = tracer
+        self.n_recent = recent
+        self.output = widgets.HTML()
+        refresh = widgets.Button(description="Refresh")
+        clear = widgets.Button(description="Clear")
+        refresh.on_click(lambda _: self.refresh())
+        clear.on_click(lambda _: (self.tracer.clear(), self.refresh()))
+        self.widget = widgets.VBox([widgets.HBox([refresh, clear]), self.output])
+        self.refresh()
+
+    def refresh(self):
+        cell = "style='padding:2px 8px; text-align:right;'"
+        rows = []
+        for name, s in self.tracer.summary().items():
+            hit_rate = '' if s['hit_rate'] is None else f"{s['hit_rate']:.0%}"
+            values = [s['count'], s['errors'], f"{s['total']:.2f}", f"{s['p50']:.3f}", f"{s['p95']:.3f}",
+                      f"{s['bytes'] / 1024:.1f}", hit_rate]
+            rows.append(f"<tr><td>{html.escape(name)}</td>" + ''.join(f"<td {cell}>{v}</td>" for v in values) + "</tr>")
+        recent = []
+        for r in reversed(self.tracer.recent(self.n_recent)):
+            details = ', '.join(f'{k}={v}' for k, v in r.items()
+                                if k not in ('name', 'ts', 'seconds', 'depth', 'thread') and v is not None)
+            recent.append(
+                f"<tr><td>{time.strftime('%H:%M:%S', time.localtime(r['ts']))}</td>"
+                f"<td>{'&nbsp;' * 4 * r['depth']}{html.escape(r['name'])}</td>"
+                f"<td {cell}>{r['seconds']:.3f}</td><td>{html.escape(details)}</td></tr>"
+            )
+        self.output.value = (
+            "<b>Per stage</b><table><tr><th>span</th><th>n</th><th>errors</th><th>total s</th>"
+            "<th>p50 s</th><th>p95 s</th><th>KiB</th><th>cache hits</th></tr>" + ''.join(rows) + "</table>"
+            "<b>Latest spans</b><table><tr><th>time</th><th>span</th><th>s</th><th>details</th></tr>"
+            + ''.join(recent) + "</table>"
+        )